@@ -6,14 +6,81 @@ import time
 import glob
 import re
 import pathlib
+import shutil
+import concurrent.futures
 from scheduler import scheduler
 from noscheduler import NoScheduler
 from pbs import pbs
 from slurm import slurm
 from datetime import datetime
+from sentinel import read_sentinel
+from copy_engine import CopyEngine, date_header
+from staging import StagedOutpath
+from bundle import write_bundle
+from commit_queue import CommitQueue
+from git_writer import GitTreeWriter
+from esmf_results import TestIndex, scan_log, find_esmf_os, read_results
+from summary_record import (
+    SUMMARY_FIELDS,
+    SUMMARY_JSON,
+    SummaryRecord,
+    load_summary_record,
+    parse_count,
+    parse_counts,
+    parse_summary_dat,
+    write_summary_record,
+)
+from artifact_store import ArtifactStore, read_manifest, write_manifest
+
+
+def artifacts_outpath(artifacts_root, branch, machine_name, build_basename, mpiversion):
+    """Return the directory under artifacts_root where results for build_basename go."""
+    dirbranch = re.sub("/", "_", branch)
+    parts = build_basename.split("_")
+    # [compiler, version, mpiflavor, build_type,dirbranch] = build_basename.split("_")
+    compiler = parts[0]
+    version = parts[1]
+    mpiflavor = parts[2]
+    build_type = parts[3]
+    if mpiversion in ["None", "none", None]:
+        mpiversion = "none"
+    return "{}/{}/{}/{}/{}/{}/{}/{}".format(
+        artifacts_root,
+        dirbranch,
+        machine_name,
+        compiler,
+        version,
+        build_type,
+        mpiflavor,
+        mpiversion,
+    )
+
+
+def archived_hash(outpath, artifacts_root=None, machine_name=None):
+    """Return the git hash recorded in {outpath}/summary.dat, or None if
+    there is none or its tests haven't run (a build-only or skipped summary).
+    Given artifacts_root and machine_name, the summary is read from the
+    committed machine branch instead of the checkout (see GitTreeWriter)."""
+    if machine_name is not None:
+        writer = GitTreeWriter(artifacts_root, machine_name)
+        summary = writer.read("{}/summary.dat".format(os.path.relpath(outpath, artifacts_root)))
+        text = "" if summary is None else summary.decode("utf-8", "replace")
+    else:
+        try:
+            with open("{}/summary.dat".format(outpath)) as summary_file:
+                text = summary_file.read()
+        except OSError:
+            text = ""
+    record = parse_summary_dat(text, "{}/summary.dat".format(outpath))
+    if record.stage != "test":
+        return None
+    return record.hash
 
 
 class ArchiveResults:
+    # threads copying log files into the artifacts repo, see CopyEngine
+    copy_threads = 8
+
     def __init__(
         self,
         jobid,
@@ -25,6 +92,11 @@ class ArchiveResults:
         mpiversion,
         branch,
         dryrun,
+        wait=True,
+        store=None,
+        bundle=None,
+        direct=False,
+        committer=None,
     ):
 
         self.root_path = pathlib.Path(__file__).parent.absolute()
@@ -42,29 +114,40 @@ class ArchiveResults:
         self.mpiversion = mpiversion
         self.branch = branch
         self.dryrun = dryrun
+        # "cas" keeps log bodies in the content-addressed ArtifactStore
+        self.store = store
+        # "gzip" or "zstd" puts examples, test and lib into one tar each
+        self.bundle = bundle
+        # write commits with GitTreeWriter; artifacts_root needs no checkout
+        self.direct = direct
+        # the CommitQueue commit_artifacts will be given, if known up front
+        self.committer = committer
         print("dryrun is {} -- {}".format(dryrun, self.dryrun))
+        self.build_dir = "{}/{}".format(test_root_dir, build_basename)
+        # what commit_artifacts says it updates, set once something is copied
+        self.commit_kind = None
+        # the unpublished StagedOutpath that direct mode commits from
+        self.stage = None
+        # whether jobid is the test job of the combination (the monitor knows)
+        self.test_job = False
+        if wait:
+            self.wait_and_archive()
+
+    def wait_and_archive(self):
         start_time = time.time()
         seconds = 144000
-        self.build_dir = "{}/{}".format(test_root_dir, build_basename)
+        checks = 0
         while True:
             current_time = time.time()
             elapsed_time = current_time - start_time
-            job_done = self.scheduler.checkqueue(jobid)
+            # the job script writes a sentinel when it exits; only every
+            # tenth check asks the scheduler, for jobs killed before that
+            job_done = read_sentinel(self.build_dir, self.jobid) is not None
+            if not job_done and checks % 10 == 0:
+                job_done = self.scheduler.checkqueue(self.jobid)
+            checks += 1
             if job_done:
-                oe_filelist = glob.glob(
-                    "{}/{}/*_{}*.log".format(test_root_dir, build_basename, jobid)
-                )
-                oe_filelist.extend(
-                    glob.glob("{}/{}/*.bat".format(test_root_dir, build_basename))
-                )
-                oe_filelist.extend(
-                    glob.glob(
-                        "{}/{}/module-*.log".format(test_root_dir, build_basename)
-                    )
-                )
-                print("filelist is {}".format(oe_filelist))
-                print("oe list is {}\n".format(oe_filelist))
-                self.copy_artifacts(oe_filelist)
+                self.archive()
                 break
             time.sleep(30)
 
@@ -72,6 +155,134 @@ class ArchiveResults:
                 print("Finished iterating in: " + str(int(elapsed_time)) + " seconds")
                 break
 
+    def archive(self):
+        """Collect the logs of the finished job, copy them to the artifacts repo
+        and commit them."""
+        self.collect()
+        self.commit_artifacts()
+
+    def commit_artifacts(self, committer=None, token=None):
+        """Hand what collect() or collect_skipped() copied to committer (a
+        CommitQueue) to be committed with its next batch; its flush() returns
+        token (default self) once that happened. Without a committer, commit
+        and push right away. Does nothing if nothing was archived."""
+        if self.commit_kind is None:
+            return
+        build_basename = os.path.basename(self.build_dir)
+        outpath = artifacts_outpath(
+            self.artifacts_root,
+            self.branch,
+            self.machine_name,
+            build_basename,
+            self.mpiversion,
+        )
+        paths = [os.path.relpath(outpath, self.artifacts_root)]
+        if self.store == "cas":
+            store = ArtifactStore.for_outpath(self.artifacts_root, outpath)
+            paths.append(os.path.relpath(store.root, self.artifacts_root))
+        message = "update for {} of {} with hash {} on {} [ci skip]".format(
+            self.commit_kind,
+            build_basename,
+            self.build_hash,
+            self.machine_name,
+        )
+        if token is None:
+            token = self
+        if committer is None:
+            committer = CommitQueue(self.artifacts_root, self.machine_name, self.dryrun, direct=self.direct)
+            committer.submit(paths, message, token, self.stage)
+            committer.flush()
+        else:
+            committer.submit(paths, message, token, self.stage)
+
+    def collect(self):
+        """Copy the logs of the finished job to the artifacts repo."""
+        oe_filelist = glob.glob("{}/*_{}*.log".format(self.build_dir, self.jobid))
+        oe_filelist.extend(glob.glob("{}/*.bat".format(self.build_dir)))
+        oe_filelist.extend(glob.glob("{}/module-*.log".format(self.build_dir)))
+        print("filelist is {}".format(oe_filelist))
+        print("oe list is {}\n".format(oe_filelist))
+        self.copy_artifacts(oe_filelist)
+
+    def ran(self):
+        """Whether the job wrote any of its logs, i.e. it started at all."""
+        return len(glob.glob("{}/*_{}*.log".format(self.build_dir, self.jobid))) > 0
+
+    def archive_skipped(self):
+        """Record that this (test) job was cancelled without running because
+        the job it depended on failed. The build logs archived for the build
+        job stay in place, only the summary changes."""
+        self.collect_skipped()
+        self.commit_artifacts()
+
+    def collect_skipped(self):
+        build_basename = os.path.basename(self.build_dir)
+        try:
+            self.build_hash = (
+                subprocess.check_output(
+                    "git describe --tags --abbrev=7", shell=True, cwd=self.build_dir
+                )
+                .strip()
+                .decode("utf-8")
+            )
+        except subprocess.CalledProcessError:
+            self.build_hash = "unknown"
+        self.outpath = artifacts_outpath(
+            self.artifacts_root,
+            self.branch,
+            self.machine_name,
+            build_basename,
+            self.mpiversion,
+        )
+        if self.direct:
+            # keep whatever the committed outpath has besides the new summary
+            carry = None
+        elif os.path.isdir(self.outpath):
+            carry = [name for name in os.listdir(self.outpath) if name != "summary.dat"]
+        else:
+            carry = []
+        stage = self.stage_outpath(self.outpath, carry)
+        self.outpath = stage.path
+        try:
+            make_info = (
+                subprocess.check_output(
+                    "cat module-build.log; cat info.log", shell=True, cwd=self.build_dir
+                )
+                .strip()
+                .decode("utf-8")
+            )
+        except subprocess.CalledProcessError:
+            make_info = "error finding {}/module-build.log or {}/info.log".format(
+                self.build_dir, self.build_dir
+            )
+        skipped = "build failed, tests skipped"
+        self.create_summary(skipped, skipped, skipped, "skipped", "skipped", make_info, [], "skipped")
+        self.publish(stage)
+        self.outpath = stage.outpath
+        self.commit_kind = "skipped test"
+
+    def stage_outpath(self, outpath, carry):
+        return StagedOutpath(self.artifacts_root, outpath, carry, self.dryrun, link=not self.direct)
+
+    def publish(self, stage):
+        """Swap stage in, or in direct mode keep it for commit_artifacts."""
+        if self.direct:
+            self.stage = stage
+        else:
+            stage.publish()
+
+    def write_manifest(self, stage, copier, carry):
+        """With the artifact store, write the manifest of the staged outpath:
+        what copier stored plus the entries of the carried directories."""
+        if copier.store is None or self.dryrun == True:
+            return
+        entries = {}
+        for name, entry in read_manifest(stage.outpath).items():
+            if name.split("/")[0] in carry:
+                entries[name] = entry
+        entries.update(copier.manifest)
+        write_manifest(stage.path, entries)
+
     def runcmd(self, cmd):
         if self.dryrun == True:
             print("would have executed {}".format(cmd))
@@ -87,16 +298,10 @@ class ArchiveResults:
         nuopc_fail,
         make_info,
         esmfmkfile,
+        stage="test",
     ):
-        results = (
-            subprocess.check_output(
-                "grep ESMF_OS: {}/*_{}.log".format(self.build_dir, self.jobid),
-                shell=True,
-            )
-            .strip()
-            .decode("utf-8")
-        )
-        esmf_os = results.split()[1]
+        # a job that never ran has no logs to take this from, it is "unknown"
+        esmf_os = find_esmf_os(glob.glob("{}/*_{}.log".format(self.build_dir, self.jobid)))
         print("HEY!!! esmf_os is {}".format(esmf_os))
         if len(esmfmkfile) > 0:
             self.build_time = datetime.fromtimestamp(os.path.getmtime(esmfmkfile[0]))
@@ -131,94 +336,183 @@ class ArchiveResults:
             "\n===================================================================\n"
         )
         summary_file.close()
+        write_summary_record(
+            self.outpath,
+            self.summary_record(
+                esmf_os,
+                unit_results,
+                system_results,
+                example_results,
+                nuopc_pass,
+                nuopc_fail,
+                stage,
+            ),
+        )
+        cache_stats = "{}/compiler-cache-stats.json".format(self.build_dir)
+        if os.path.isfile(cache_stats) and self.dryrun != True:
+            dest = os.path.join(self.outpath, "compiler-cache-stats.json")
+            # a carried copy is hard linked to the published one, so replace it
+            # rather than write into it
+            if os.path.lexists(dest):
+                os.unlink(dest)
+            shutil.copyfile(cache_stats, dest)
+
+    def summary_record(
+        self,
+        esmf_os,
+        unit_results,
+        system_results,
+        example_results,
+        nuopc_pass,
+        nuopc_fail,
+        stage,
+    ):
+        """The SummaryRecord of what create_summary writes to summary.dat."""
+        parts = self.build_basename.split("_")
+        mpiversion = self.mpiversion
+        if mpiversion in ["None", "none", None]:
+            mpiversion = "none"
+        sentinel = read_sentinel(self.build_dir, self.jobid)
+        if sentinel is not None:
+            seconds = sentinel["end"] - sentinel["start"]
+        else:
+            seconds = None
+        if stage == "build":
+            build_seconds = seconds
+            test_seconds = None
+        else:
+            # the build was archived before, keep its duration
+            build_seconds = self.previous_record().build_seconds
+            test_seconds = seconds
+        unit_pass, unit_fail = parse_counts(unit_results)
+        system_pass, system_fail = parse_counts(system_results)
+        example_pass, example_fail = parse_counts(example_results)
+        return SummaryRecord(
+            esmf_os=esmf_os,
+            machine=self.machine_name,
+            compiler=parts[0],
+            version=parts[1],
+            mpi_flavor=parts[2],
+            mpi_version=mpiversion,
+            bopt=parts[3],
+            unit_pass=unit_pass,
+            unit_fail=unit_fail,
+            system_pass=system_pass,
+            system_fail=system_fail,
+            example_pass=example_pass,
+            example_fail=example_fail,
+            nuopc_pass=parse_count(nuopc_pass),
+            nuopc_fail=parse_count(nuopc_fail),
+            branch=self.branch,
+            hash=self.build_hash,
+            build_time=str(self.build_time),
+            stage=stage,
+            build_seconds=build_seconds,
+            test_seconds=test_seconds,
+        )
+
+    def previous_record(self):
+        """The SummaryRecord currently archived for this combination, all
+        None if there is none. In direct mode a stage still queued in
+        self.committer is newer than the branch, so it is read first."""
+        outpath = artifacts_outpath(
+            self.artifacts_root,
+            self.branch,
+            self.machine_name,
+            self.build_basename,
+            self.mpiversion,
+        )
+        try:
+            staged = None
+            if self.direct and self.committer is not None:
+                staged = self.committer.staged(outpath, SUMMARY_JSON)
+            if staged is not None:
+                with open(staged) as _file:
+                    data = _file.read()
+            elif self.direct:
+                writer = GitTreeWriter(self.artifacts_root, self.machine_name)
+                data = writer.read("{}/{}".format(os.path.relpath(outpath, self.artifacts_root), SUMMARY_JSON))
+            else:
+                with open(os.path.join(outpath, SUMMARY_JSON)) as _file:
+                    data = _file.read()
+            if data is not None:
+                return load_summary_record(data)
+        except (OSError, ValueError):
+            pass
+        return SummaryRecord(*[None] * len(SUMMARY_FIELDS))
 
     def copy_artifacts(self, oe_filelist):
 
         build_basename = os.path.basename(self.build_dir)
         gitbranch = self.branch
         dirbranch = re.sub("/", "_", self.branch)
-        cwd = os.getcwd()
-        os.chdir(self.build_dir)
         self.build_hash = (
-            subprocess.check_output("git describe --tags --abbrev=7", shell=True)
+            subprocess.check_output(
+                "git describe --tags --abbrev=7", shell=True, cwd=self.build_dir
+            )
             .strip()
             .decode("utf-8")
         )
-        os.chdir(cwd)
         print("build_basename is {}".format(build_basename))
-        parts = build_basename.split("_")
-        # [compiler, version, mpiflavor, build_type,dirbranch] = build_basename.split("_")
-        compiler = parts[0]
-        version = parts[1]
-        mpiflavor = parts[2]
-        build_type = parts[3]
+        build_type = build_basename.split("_")[3]
         # get the full path for placment of artifacts
-        if self.mpiversion not in ["None", "none", None]:
-            outpath = "{}/{}/{}/{}/{}/{}/{}/{}".format(
-                self.artifacts_root,
-                dirbranch,
-                self.machine_name,
-                compiler,
-                version,
-                build_type,
-                mpiflavor,
-                self.mpiversion,
-            )
-        else:
-            outpath = "{}/{}/{}/{}/{}/{}/{}/{}".format(
-                self.artifacts_root,
-                dirbranch,
-                self.machine_name,
-                compiler,
-                version,
-                build_type,
-                mpiflavor,
-                "none",
-            )
+        outpath = artifacts_outpath(
+            self.artifacts_root,
+            self.branch,
+            self.machine_name,
+            build_basename,
+            self.mpiversion,
+        )
         self.outpath = outpath
         # copy/rename the stdout/stderr files to artifacts out directory
         test_stage = False
         print("outpath is {}".format(outpath))
         for cfile in oe_filelist:
             print("cfile is {}".format(cfile))
-            if int(self.jobid) < 0:
+            if str(self.jobid).startswith("-"):
                 test_stage = True
             if (
                 cfile.find("test_{}".format(self.jobid)) != -1
             ):  # this is just the build job, so no test artifacts yet
                 test_stage = True
-        if not test_stage:
-            # remove old files in out directory
-            print("just the build stage, so remove old files")
-            cmd = "mkdir -p {}/out; rm {}/*/*; rm {}/*.log; rm {}/summary.dat".format(
-                outpath, outpath, outpath, outpath
-            )
-            print("cmd is {}\n".format(cmd))
-            self.runcmd(cmd)
+        # the new results are put together next to the old ones and swapped in
+        # when complete; the test stage keeps the build logs in out/
+        if test_stage:
+            carry = ["out"]
+        else:
+            print("just the build stage, so start from an empty directory")
+            carry = []
+        stage = self.stage_outpath(outpath, carry)
         # print("oe filelist is {}".format(oe_filelist))
         if oe_filelist == []:
+            stage.discard()
             return
+        outpath = stage.path
+        self.outpath = outpath
+        stage.makedirs("out")
+        if self.store == "cas":
+            store = ArtifactStore.for_outpath(self.artifacts_root, stage.outpath)
+        else:
+            store = None
+        # the test stage indexes every test and example as it is copied
+        index = TestIndex() if test_stage else None
+        copier = CopyEngine(self.copy_threads, self.dryrun, store, stage.path, index)
+        header = date_header()
         for cfile in oe_filelist:
             nfile = os.path.basename(re.sub("_{}".format(self.jobid), "", cfile))
-            cp_cmd = "echo `date` > {}/out/{}".format(outpath, nfile)
-            self.runcmd(cp_cmd)
-            cp_cmd = "cat {} >> {}/out/{}".format(cfile, outpath, nfile)
-            self.runcmd(cp_cmd)
+            copier.add(cfile, "{}/out/{}".format(outpath, nfile), header)
+        copier.run()
         if not (test_stage):
-            command = "grep success {}/build_{}.log".format(self.build_dir, self.jobid)
             unit_results = "-1 -1"
             system_results = "-1 -1"
             example_results = "-1 -1"
             nuopc_pass = "-1"
             nuopc_fail = "-1"
             try:
-                build_result = (
-                    subprocess.check_output("{}".format(command), shell=True)
-                    .strip()
-                    .decode("utf-8")
-                )
-            except:
-                build_result = ""
+                build_succeeded = scan_log("{}/build_{}.log".format(self.build_dir, self.jobid)).success
+            except OSError:
+                build_succeeded = False
+            if not build_succeeded:
                 example_results = "Build did not complete successfully"
                 unit_results = "Build did not complete successfully"
                 system_results = "Build did not complete successfully"
@@ -250,31 +544,16 @@ class ArchiveResults:
                 nuopc_fail,
                 make_info,
                 esmfmkfile,
+                "build",
             )
-            git_cmd = "cd {};git checkout {};git add {}/{};git commit -a -m'update for build of {} with hash {} on {} [ci skip]';git push origin {}".format(
-                self.artifacts_root,
-                self.machine_name,
-                dirbranch,
-                self.machine_name,
-                build_basename,
-                self.build_hash,
-                self.machine_name,
-                self.machine_name,
-            )
-            print("git_cmd is {}".format(git_cmd))
-            self.runcmd(git_cmd)
+            copier.report()
+            self.write_manifest(stage, copier, carry)
+            self.publish(stage)
+            self.outpath = stage.outpath
+            self.commit_kind = "build"
             return
         # Make directories, if they aren't already there
-        cmd = "mkdir -p {}/examples; rm {}/examples/*; rm {}/*".format(
-            outpath, outpath, outpath
-        )
-        self.runcmd(cmd)
-        cmd = "mkdir -p {}/apps; rm {}/apps/*".format(outpath, outpath)
-        self.runcmd(cmd)
-        cmd = "mkdir -p {}/test; rm {}/test/*".format(outpath, outpath)
-        self.runcmd(cmd)
-        cmd = "mkdir -p {}/lib; rm {}/lib/*".format(outpath, outpath)
-        self.runcmd(cmd)
+        stage.makedirs("examples", "apps", "test", "lib")
         print("globbing examples")
 
         example_artifacts = glob.glob(
@@ -290,11 +569,7 @@ class ArchiveResults:
             "{}/examples/examples{}/*/*results".format(self.build_dir, build_type)
         )
         if len(ex_result_file) > 0:
-            example_results = (
-                subprocess.check_output("cat {}".format(ex_result_file[0]), shell=True)
-                .strip()
-                .decode("utf-8")
-            )
+            example_results = read_results(ex_result_file[0])
         else:
             example_results = "No examples ran"
         # get information from test results files to accumulate
@@ -305,66 +580,32 @@ class ArchiveResults:
         test_artifacts.extend(
             glob.glob("{}/test/test{}/*/*.stdout".format(self.build_dir, build_type))
         )
-        try:
-            unit_results = (
-                subprocess.check_output(
-                    "cat {}/test/test{}/*/unit_tests_results".format(
-                        self.build_dir, build_type
-                    ),
-                    shell=True,
-                )
-                .strip()
-                .decode("utf-8")
-            )
-        except:
+        unit_results = read_results(
+            "{}/test/test{}/*/unit_tests_results".format(self.build_dir, build_type)
+        )
+        if unit_results is None:
             unit_results = "unit tests did not complete"
-        try:
-            system_results = (
-                subprocess.check_output(
-                    "cat {}/test/test{}/*/system_tests_results".format(
-                        self.build_dir, build_type
-                    ),
-                    shell=True,
-                )
-                .strip()
-                .decode("utf-8")
-            )
-        except:
+        system_results = read_results(
+            "{}/test/test{}/*/system_tests_results".format(self.build_dir, build_type)
+        )
+        if system_results is None:
             system_results = "system tests did not complete"
         try:
-            nuopc_pass = (
-                subprocess.check_output(
-                    "grep PASS: {}/nuopc_{}.log | wc -l".format(
-                        self.build_dir, self.jobid
-                    ),
-                    shell=True,
-                )
-                .strip()
-                .decode("utf-8")
-            )
-            nuopc_fail = (
-                subprocess.check_output(
-                    "grep FAIL: {}/nuopc_{}.log | wc -l".format(
-                        self.build_dir, self.jobid
-                    ),
-                    shell=True,
-                )
-                .strip()
-                .decode("utf-8")
-            )
-        except:
+            nuopc = scan_log("{}/nuopc_{}.log".format(self.build_dir, self.jobid))
+            nuopc_pass = nuopc.passed
+            nuopc_fail = nuopc.failed
+        except OSError:
             nuopc_pass = 0
             nuopc_fail = 0
         python_artifacts = glob.glob("{}/src/addon/ESMPy/*.log".format(self.build_dir))
 
-        cwd = os.getcwd()
-        os.chdir(self.build_dir)
         make_info = (
-            subprocess.check_output("cat module-build.log; cat info.log", shell=True)
+            subprocess.check_output(
+                "cat module-build.log; cat info.log", shell=True, cwd=self.build_dir
+            )
             .strip()
             .decode("utf-8")
         )
-        os.chdir(cwd)
         esmfmkfile = glob.glob(
             "{}/lib/lib{}/*/esmf.mk".format(self.build_dir, build_type)
         )
@@ -379,54 +620,59 @@ class ArchiveResults:
             esmfmkfile,
         )
         timestamp = "build time -- {}".format(self.build_time)
-        for afile in example_artifacts:
-            cmd = "echo {} > {}/examples/{}".format(
-                timestamp, outpath, os.path.basename(afile)
-            )
-            self.runcmd(cmd)
-            cmd = "cat {} >> {}/examples/{}".format(
-                afile, outpath, os.path.basename(afile)
-            )
-            #   cmd = 'cp {} {}/examples'.format(afile,outpath)
-            print("cmd is {}".format(cmd))
-            self.runcmd(cmd)
-        for afile in test_artifacts:
-            cmd = "echo {} > {}/test/{}".format(
-                timestamp, outpath, os.path.basename(afile)
-            )
-            self.runcmd(cmd)
-            cmd = "cat {} >> {}/test/{}".format(afile, outpath, os.path.basename(afile))
-            #   cmd = 'cp {} {}/test".format(afile,outpath)
-            print("cmd is {}".format(cmd))
-            self.runcmd(cmd)
-        for afile in esmfmkfile:
-            cmd = "echo {} > {}/lib/{}".format(
-                timestamp, outpath, os.path.basename(afile)
-            )
-            self.runcmd(cmd)
-            cmd = "cat {} >> {}/lib/{}".format(afile, outpath, os.path.basename(afile))
-            #   cmd = 'cp {} {}/lib'.format(afile,outpath)
-            print("cmd is {}".format(cmd))
-            self.runcmd(cmd)
+        categories = [
+            ("examples", example_artifacts),
+            ("test", test_artifacts),
+            ("lib", esmfmkfile),
+        ]
+        bundles = []
+        pool = None
+        if self.bundle is not None:
+            # each category streams into its own compressed tar while the
+            # remaining files are copied
+            pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(categories))
+            for category, files in categories:
+                bundles.append(
+                    pool.submit(
+                        write_bundle,
+                        outpath,
+                        category,
+                        files,
+                        timestamp,
+                        self.bundle,
+                        self.dryrun,
+                        index if category != "lib" else None,
+                    )
+                )
+        else:
+            for category, files in categories:
+                for afile in files:
+                    copier.add(
+                        afile,
+                        "{}/{}/{}".format(outpath, category, os.path.basename(afile)),
+                        timestamp,
+                        category if category != "lib" else None,
+                    )
         for afile in python_artifacts:
-            cmd = "echo {} > {}/{}".format(timestamp, outpath, os.path.basename(afile))
-            self.runcmd(cmd)
-            cmd = "cat {} >> {}/{}".format(afile, outpath, os.path.basename(afile))
-            #   cmd = 'cp {} {}'.format(afile,outpath)
-            print("cmd is {}".format(cmd))
-            self.runcmd(cmd)
+            copier.add(afile, "{}/{}".format(outpath, os.path.basename(afile)), timestamp)
+        try:
+            copier.run()
+        finally:
+            # the bundles go into the staged outpath, so they have to be
+            # complete before it is indexed and published, even if copying failed
+            if pool is not None:
+                pool.shutdown(wait=True)
+        copier.report()
+        if bundles:
+            bundled = sum([future.result() for future in bundles])
+            print("bundled {} bytes into {} archives".format(bundled, len(bundles)))
+        if self.dryrun != True:
+            index.write(outpath)
+        self.write_manifest(stage, copier, carry)
+        self.publish(stage)
+        self.outpath = stage.outpath
 
-        git_cmd = "cd {};git checkout {};git add {}/{};git commit -a -m'update for test of {} with hash {} on {} [ci skip]';git push origin {}".format(
-            self.artifacts_root,
-            self.machine_name,
-            dirbranch,
-            self.machine_name,
-            build_basename,
-            self.build_hash,
-            self.machine_name,
-            self.machine_name,
-        )
-        self.runcmd(git_cmd)
+        self.commit_kind = "test"
         return
 
 
@@ -466,7 +712,29 @@ if __name__ == "__main__":
     parser.add_argument("-M", "--mpiversion", help="mpi version used", required=True)
     parser.add_argument("-B", "--branch", help="branch tested", required=True)
     parser.add_argument("-d", "--dryrun", help="dryrun?", required=False, default=False)
+    parser.add_argument(
+        "-c",
+        "--store",
+        help="cas to keep logs in the content-addressed artifact store",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-z",
+        "--bundle",
+        help="gzip or zstd to archive examples, test and lib as one compressed tar each",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-g",
+        "--direct",
+        help="commit straight into git objects, the artifacts repo can be a bare clone",
+        action="store_true",
+    )
     args = vars(parser.parse_args())
+    if args["direct"] and args["store"] is not None:
+        parser.error("the artifact store needs a checkout, it can't be used with --direct")
 
     archiver = ArchiveResults(
         args["self.jobid"],
@@ -478,4 +746,7 @@ if __name__ == "__main__":
         args["mpiversion"],
         args["branch"],
         args["dryrun"],
+        store=args["store"],
+        bundle=args["bundle"],
+        direct=args["direct"],
     )
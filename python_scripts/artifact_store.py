@@ -0,0 +1,119 @@
+import os
+import argparse
+import hashlib
+import json
+import shutil
+import tempfile
+
+MANIFEST = "manifest.json"
+
+
+class ArtifactStore:
+    """Content-addressed store for archived logs.
+
+    Many of the .Log/.stdout files copied into esmf-test-artifacts are the
+    same across O/g builds, mpi flavors and nights except for the header line
+    put in front of them. With the store, each distinct file body is kept
+    once as {root}/<sha256[:2]>/<sha256[2:]> and the outpath only gets a
+    manifest.json mapping every file name to its hash and header; restore()
+    puts the old layout back together when someone needs it.
+
+    root is {artifacts_root}/{dirbranch}/{machine}/.cas, inside the part of
+    the repo ArchiveResults commits, so the store is committed with the
+    manifests that point into it.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    @classmethod
+    def for_outpath(cls, artifacts_root, outpath):
+        """The store shared by every outpath of one branch and machine."""
+        parts = os.path.relpath(outpath, artifacts_root).split(os.sep)
+        return cls(os.path.join(artifacts_root, parts[0], parts[1], ".cas"))
+
+    @classmethod
+    def find(cls, outpath):
+        """The store of an existing outpath: the nearest .cas above it."""
+        directory = os.path.abspath(outpath)
+        while directory != os.path.dirname(directory):
+            if os.path.isdir(os.path.join(directory, ".cas")):
+                return cls(os.path.join(directory, ".cas"))
+            directory = os.path.dirname(directory)
+        raise IOError("no .cas store above {}".format(outpath))
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def put(self, src):
+        """Add the contents of src unless they are already stored; return
+        (digest, size). src is read once, hashed as it is copied into a
+        temporary file in the store that is then renamed to its digest."""
+        sha = hashlib.sha256()
+        size = 0
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix=".put")
+        try:
+            with os.fdopen(fd, "wb") as out_file, open(src, "rb") as in_file:
+                for block in iter(lambda: in_file.read(1 << 20), b""):
+                    sha.update(block)
+                    out_file.write(block)
+                    size += len(block)
+            digest = sha.hexdigest()
+            dest = self.path(digest)
+            if not os.path.exists(dest):
+                os.makedirs(os.path.dirname(dest), exist_ok=True)
+                os.chmod(tmp, 0o644)
+                # several threads may store the same body, only one rename wins
+                os.replace(tmp, dest)
+        finally:
+            # left over if the body was already stored or the copy failed
+            if os.path.lexists(tmp):
+                os.unlink(tmp)
+        return digest, size
+
+    def write(self, entry, dest):
+        """Write the file an entry of a manifest stands for to dest."""
+        with open(dest, "wb") as out_file:
+            out_file.write("{}\n".format(entry["header"]).encode("utf-8"))
+            with open(self.path(entry["hash"]), "rb") as in_file:
+                shutil.copyfileobj(in_file, out_file)
+
+
+def read_manifest(outpath):
+    try:
+        with open(os.path.join(outpath, MANIFEST)) as _file:
+            return json.load(_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_manifest(outpath, entries):
+    with open(os.path.join(outpath, MANIFEST), "w") as _file:
+        json.dump(entries, _file, indent=1, sort_keys=True)
+        _file.write("\n")
+
+
+def restore(outpath, dest=None, names=None):
+    """Recreate the files listed in outpath's manifest under dest (default
+    outpath itself), as they would have been archived without the store."""
+    if dest is None:
+        dest = outpath
+    store = ArtifactStore.find(outpath)
+    entries = read_manifest(outpath)
+    for name in sorted(entries):
+        if names and name not in names:
+            continue
+        target = os.path.join(dest, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        store.write(entries[name], target)
+        print(target)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild archived logs kept in the artifact store")
+    parser.add_argument("outpath", help="artifacts directory of one combination (contains manifest.json)")
+    parser.add_argument("-o", "--output", help="directory to write the files to (default: outpath)", required=False, default=None)
+    parser.add_argument("names", nargs="*", help="only these files, e.g. test/ESMF_ArrayUTest.Log")
+    args = vars(parser.parse_intermixed_args())
+    restore(args["outpath"], args["output"], args["names"])
@@ -0,0 +1,171 @@
+import os
+import argparse
+import re
+import subprocess
+from git_writer import GitTreeWriter
+from results_db import BlobReader
+from summary_record import SUMMARY_FIELDS, load_summary_record, parse_summary_dat
+
+# the table header and columns of the old perl_scripts/branch_summary.pl
+HEADER = "OS HOST compilier version mpi-type mpi-ver O/g unit-pass unit-fail sys-pass sys-fail ex-pass ex-fail nuopc-p nuopc-f"
+COLUMNS = SUMMARY_FIELDS[:15]
+# machine/compiler/version/bopt/mpi flavor/mpi version below the branch directory
+COMBINATION_DEPTH = 6
+
+
+def machine_refs(repo, prefix, summary_branch):
+    """{machine branch: commit} of the refs under prefix."""
+    output = subprocess.check_output(
+        ["git", "for-each-ref", "--format=%(refname) %(objectname)", prefix], cwd=repo
+    ).decode("utf-8")
+    refs = {}
+    for line in output.split("\n"):
+        if not line:
+            continue
+        ref, commit = line.split()
+        name = ref[len(prefix) :].strip("/")
+        if name not in ["HEAD", summary_branch]:
+            refs[ref] = commit
+    return refs
+
+
+def latest_hash(repo, ref, dirbranch):
+    """(hash, message) of the newest commit on ref archiving dirbranch, from
+    its "update for ... with hash <hash> on ..." message."""
+    log = subprocess.Popen(["git", "log", "--format=%B", ref], cwd=repo, stdout=subprocess.PIPE)
+    found = None, None
+    for line in log.stdout:
+        line = line.decode("utf-8", "replace").strip()
+        match = re.search(r" with hash (\S+)", line)
+        if dirbranch in line and match is not None:
+            found = match.group(1), line
+            break
+    log.stdout.close()
+    log.wait()
+    return found
+
+
+def read_summaries(reader, ref, dirbranch):
+    """The SummaryRecord of every combination of dirbranch on ref, reading
+    only the trees down to the combination directories and one summary blob
+    for each: summary.json where there is one, summary.dat otherwise."""
+    records = []
+    level = [("{}:{}".format(ref, dirbranch), dirbranch)]
+    for depth in range(COMBINATION_DEPTH):
+        below = []
+        for spec, path in level:
+            entries = reader.tree(spec) or {}
+            for name, (mode, oid) in sorted(entries.items()):
+                if mode == "40000" and not name.startswith("."):
+                    below.append((oid, "{}/{}".format(path, name)))
+        level = below
+    for spec, path in level:
+        entries = reader.tree(spec) or {}
+        if "summary.json" in entries:
+            data = reader.read(entries["summary.json"][1])
+            if data is not None:
+                try:
+                    records.append(load_summary_record(data))
+                    continue
+                except ValueError:
+                    pass
+        if "summary.dat" in entries:
+            data = reader.read(entries["summary.dat"][1])
+            if data is not None:
+                records.append(parse_summary_dat(data.decode("utf-8", "replace"), path + "/summary.dat"))
+    return records
+
+
+def format_table(records):
+    """The {hash}.summary table: sorted by host like sort -k 2,2 and aligned
+    like column -t."""
+    rows = []
+    for record in records:
+        rows.append(["-" if getattr(record, column) is None else str(getattr(record, column)) for column in COLUMNS])
+    rows.sort(key=lambda row: (row[1].encode("utf-8"), " ".join(row).encode("utf-8")))
+    rows.insert(0, HEADER.split())
+    widths = [max(len(row[index]) for row in rows) for index in range(len(COLUMNS))]
+    lines = []
+    for row in rows:
+        cells = [cell.ljust(width) for cell, width in zip(row[:-1], widths)] + [row[-1]]
+        lines.append("  ".join(cells))
+    return "\n".join(lines) + "\n"
+
+
+def branch_summary(repo, branch, pull_all, prefix, summary_branch, fetch, push, dryrun):
+    dirbranch = re.sub("/", "_", branch)
+    before = machine_refs(repo, prefix, summary_branch)
+    if fetch:
+        subprocess.check_call(["git", "remote", "update"], cwd=repo)
+    refs = machine_refs(repo, prefix, summary_branch)
+    if pull_all:
+        updated = sorted(refs)
+    else:
+        updated = sorted(ref for ref in refs if before.get(ref) != refs[ref])
+    print("machine branches to summarize: {}".format(" ".join(updated)))
+    hashes = {}
+    for ref in updated:
+        build_hash, message = latest_hash(repo, ref, dirbranch)
+        if build_hash is not None:
+            print("{}: {}".format(ref, message))
+            hashes.setdefault(build_hash, []).append(message)
+    if not hashes:
+        print("nothing new for {}".format(branch))
+        return
+    reader = BlobReader(repo)
+    try:
+        records = []
+        for ref in sorted(refs):
+            records.extend(read_summaries(reader, ref, dirbranch))
+        print("read {} summaries from {} machine branches".format(len(records), len(refs)))
+        writer = GitTreeWriter(repo, summary_branch, dryrun)
+        files = {}
+        for build_hash in sorted(hashes):
+            path = "{}/{}.summary".format(dirbranch, build_hash)
+            table = format_table([record for record in records if record.hash == build_hash]).encode("utf-8")
+            if reader.read("{}:{}".format(writer.ref, path)) != table:
+                files[path] = table
+    finally:
+        reader.close()
+    if not files:
+        print("summaries are up to date")
+        return
+    lines = [message for build_hash in sorted(hashes) for message in hashes[build_hash]]
+    message = "update {} summaries for {} [ci skip]\n\n{}\n".format(
+        dirbranch, " ".join(sorted(hashes)), "\n".join(lines)
+    )
+    writer.commit_files(files, message)
+    if dryrun == True:
+        return
+    print("committed {}".format(" ".join(sorted(files))))
+    if push:
+        subprocess.check_call(["git", "push", "origin", summary_branch], cwd=repo)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Write the <hash>.summary tables of a branch from the summaries on every machine branch"
+    )
+    parser.add_argument("branch", nargs="?", default="develop", help="ESMF branch (default develop)")
+    parser.add_argument("-r", "--repo", help="esmf-test-artifacts clone", required=True)
+    parser.add_argument(
+        "-a", "--all", help="summarize every machine branch, not only those the fetch updated", action="store_true"
+    )
+    parser.add_argument(
+        "--refs", help="where the machine branches are (default refs/remotes/origin)", default="refs/remotes/origin"
+    )
+    parser.add_argument("-s", "--summary-branch", help="branch the tables are committed to", default="main")
+    parser.add_argument("--no-fetch", help="don't run git remote update first", action="store_true")
+    parser.add_argument("--no-push", help="don't push the summary branch", action="store_true")
+    parser.add_argument("-d", "--dryrun", help="dryrun?", required=False, default=False)
+    args = vars(parser.parse_args())
+    branch_summary(
+        os.path.abspath(args["repo"]),
+        args["branch"],
+        args["all"],
+        args["refs"],
+        args["summary_branch"],
+        not args["no_fetch"],
+        not args["no_push"] and args["dryrun"] != True,
+        args["dryrun"],
+    )
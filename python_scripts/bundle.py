@@ -0,0 +1,115 @@
+import os
+import json
+import shutil
+import subprocess
+import tarfile
+import time
+from esmf_results import TestLogScanner
+
+COMPRESSORS = {
+    "zstd": (["zstd", "-q", "-T0", "-c"], "tar.zst"),
+    "gzip": (["gzip", "-c"], "tar.gz"),
+}
+
+
+def compressor(compression):
+    """Return (command, extension) for compression, falling back to gzip
+    when the zstd binary isn't installed."""
+    if compression == "zstd" and shutil.which("zstd") is None:
+        print("zstd not found, bundling with gzip instead")
+        compression = "gzip"
+    return COMPRESSORS[compression]
+
+
+class HeaderedFile:
+    """Read a header line followed by the contents of a file, and note
+    whether PASS or FAIL appears in it on the way through. Given a scanner
+    (see esmf_results.py), the contents are fed to it as well."""
+
+    def __init__(self, header, path, scanner=None):
+        self.prefix = "{}\n".format(header).encode("utf-8")
+        self.file = open(path, "rb")
+        self.size = len(self.prefix) + os.fstat(self.file.fileno()).st_size
+        self.tail = b""
+        self.passed = False
+        self.failed = False
+        self.scanner = scanner
+
+    def read(self, size=-1):
+        # tarfile wants exactly size bytes back until the end
+        data, self.prefix = self.prefix, b""
+        block = b""
+        if size < 0:
+            block = self.file.read()
+        elif len(data) < size:
+            block = self.file.read(size - len(data))
+        else:
+            data, self.prefix = data[:size], data[size:]
+        if self.scanner is not None and block:
+            self.scanner.update(block)
+        data += block
+        # keep a few bytes so a word split between two reads is still seen
+        window = self.tail + data
+        self.passed = self.passed or b"PASS" in window
+        self.failed = self.failed or b"FAIL" in window
+        self.tail = window[-3:]
+        return data
+
+    def status(self):
+        if self.failed:
+            return "FAIL"
+        if self.passed:
+            return "PASS"
+        return "NONE"
+
+    def close(self):
+        self.file.close()
+        if self.scanner is not None:
+            self.scanner.finish()
+
+
+def write_bundle(directory, category, files, header, compression, dryrun=False, index=None):
+    """Write files (paths) into {directory}/{category}.tar.<ext> plus
+    {directory}/{category}.index.json, each file stored under its base name
+    with header as its first line like a plain copy would have.
+
+    The tar stream is piped into a separate gzip/zstd process, so compression
+    runs alongside reading the files. The index lists every member's name,
+    size and whether PASS or FAIL occurs in it. With a TestIndex, each file is
+    also scanned for it as it is read. Returns the number of bytes read."""
+    command, extension = compressor(compression)
+    archive = os.path.join(directory, "{}.{}".format(category, extension))
+    if dryrun == True:
+        print("would have bundled {} files into {}".format(len(files), archive))
+        return 0
+    members = []
+    total = 0
+    with open(archive, "wb") as out_file:
+        proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=out_file)
+        with tarfile.open(fileobj=proc.stdin, mode="w|") as tar:
+            for path in sorted(files):
+                scanner = TestLogScanner() if index is not None else None
+                try:
+                    source = HeaderedFile(header, path, scanner)
+                except OSError as err:
+                    print("bundling {} failed: {}".format(path, err))
+                    continue
+                info = tarfile.TarInfo(os.path.basename(path))
+                info.size = source.size
+                info.mtime = int(time.time())
+                info.mode = 0o644
+                tar.addfile(info, source)
+                source.close()
+                if index is not None:
+                    index.add(category, path, scanner.result())
+                members.append(
+                    {"name": info.name, "size": info.size, "status": source.status()}
+                )
+                total += info.size
+        proc.stdin.close()
+        if proc.wait() != 0:
+            raise IOError("{} failed writing {}".format(command[0], archive))
+    with open(os.path.join(directory, "{}.index.json".format(category)), "w") as _file:
+        json.dump({"archive": os.path.basename(archive), "members": members}, _file, indent=1)
+        _file.write("\n")
+    return total
@@ -0,0 +1,217 @@
+import os
+import fcntl
+import subprocess
+import threading
+import time
+from staging import exclude_from_git
+from git_writer import GitTreeWriter
+
+
+class CommitQueue:
+    """Commit archived outpaths to the artifacts repo in batches.
+
+    Archivers hand their outpaths to submit() instead of each running its own
+    git checkout/add/commit -a/push. flush() stages just the submitted paths,
+    makes one commit for all of them and pushes once, pulling with --rebase
+    and trying again when the push is rejected. The monitor flushes whenever
+    due() says so, every interval seconds or as soon as batch outpaths are
+    waiting, and once more before it exits.
+
+    Every flush holds {artifacts_root}/.monitor/commit.lock, so monitors of
+    runs that overlap and archive_results.py run by hand never use the repo's
+    index at the same time.
+
+    With direct set, outpaths are submitted as unpublished StagedOutpaths and
+    written into the branch with GitTreeWriter instead of git add/commit.
+    Nothing is checked out, so a rejected push is handled by fetching the
+    remote branch and writing the batches again on top of it; their stages
+    are removed once they have been pushed.
+    """
+
+    push_attempts = 3
+
+    def __init__(self, artifacts_root, machine_name, dryrun, interval=60, batch=20, direct=False):
+        self.artifacts_root = artifacts_root
+        self.machine_name = machine_name
+        self.dryrun = dryrun
+        self.interval = interval
+        self.batch = batch
+        self.lock = threading.Lock()
+        # (paths, message, token, stage) in the order they were submitted
+        self.pending = []
+        self.oldest = None
+        # a commit whose push failed goes out with the next flush
+        self.unpushed = False
+        self.direct = direct
+        if direct:
+            self.writer = GitTreeWriter(artifacts_root, machine_name, dryrun)
+        # direct batches committed but not pushed yet
+        self.written = []
+
+    def submit(self, paths, message, token=None, stage=None):
+        """Queue paths (relative to artifacts_root) for the next commit;
+        flush() returns token once they are committed. In direct mode stage
+        is the StagedOutpath holding their contents."""
+        with self.lock:
+            if not self.pending:
+                self.oldest = time.time()
+            self.pending.append((paths, message, token, stage))
+
+    def staged(self, outpath, name):
+        """Path of file name in the newest stage still waiting to be committed
+        for outpath, or None. Direct mode only; lets a later stage of the same
+        combination read what an earlier one archived before it is in git."""
+        with self.lock:
+            for entry in reversed(self.pending):
+                stage = entry[3]
+                if stage is not None and stage.outpath == outpath:
+                    path = os.path.join(stage.path, name)
+                    if os.path.isfile(path):
+                        return path
+        return None
+
+    def due(self):
+        with self.lock:
+            if not self.pending:
+                return False
+            return len(self.pending) >= self.batch or time.time() - self.oldest >= self.interval
+
+    def git(self, *args, **kwargs):
+        cmd = ["git"] + list(args)
+        if self.dryrun == True:
+            print("would have executed {}".format(" ".join(cmd)))
+            return 0
+        result = subprocess.run(cmd, cwd=self.artifacts_root, **kwargs)
+        return result.returncode
+
+    def flush(self):
+        """Commit and push everything submitted so far; return the tokens of
+        what was committed. If the commit fails the outpaths stay queued."""
+        with self.lock:
+            batch = self.pending
+            self.pending = []
+            self.oldest = None
+        if not batch and not self.unpushed:
+            return []
+        with self.repo_lock():
+            if self.direct:
+                return self.flush_direct(batch)
+            try:
+                committed = self.commit(batch)
+            except (OSError, subprocess.SubprocessError) as err:
+                print("committing {} outpaths failed: {}".format(len(batch), err))
+                committed = False
+            if not committed:
+                with self.lock:
+                    self.pending = batch + self.pending
+                    self.oldest = time.time()
+                return []
+            self.push()
+        return [entry[2] for entry in batch]
+
+    def message(self, batch):
+        if len(batch) == 1:
+            return batch[0][1]
+        return "update for {} combinations on {} [ci skip]\n\n{}\n".format(
+            len(batch), self.machine_name, "\n".join(entry[1] for entry in batch)
+        )
+
+    def commit(self, batch):
+        if self.git("checkout", "-q", self.machine_name) != 0:
+            return False
+        if not batch:
+            return True
+        paths = sorted(set(path for entry in batch for path in entry[0]))
+        if self.git("add", "-A", "--", *paths) != 0:
+            return False
+        # --quiet exits 1 if something is staged
+        if self.dryrun != True and self.git("diff", "--cached", "--quiet") == 0:
+            print("nothing to commit for {} outpaths".format(len(batch)))
+            return True
+        if self.git("commit", "-q", "-F", "-", input=self.message(batch).encode("utf-8")) != 0:
+            return False
+        print("committed {} outpaths".format(len(batch)))
+        self.unpushed = True
+        return True
+
+    def push(self):
+        for attempt in range(self.push_attempts):
+            if self.git("push", "-q", "origin", self.machine_name) == 0:
+                self.unpushed = False
+                return True
+            print("push of {} rejected, rebasing".format(self.machine_name))
+            if self.git("pull", "-q", "--rebase", "origin", self.machine_name) != 0:
+                self.git("rebase", "--abort")
+                time.sleep(2 ** attempt)
+        print("giving up pushing {} until the next commit".format(self.machine_name))
+        return False
+
+    def flush_direct(self, batch):
+        if batch:
+            try:
+                files = self.writer.commit([entry[3] for entry in batch], self.message(batch))
+            except (OSError, subprocess.SubprocessError) as err:
+                print("committing {} outpaths failed: {}".format(len(batch), err))
+                with self.lock:
+                    self.pending = batch + self.pending
+                    self.oldest = time.time()
+                return []
+            print("committed {} outpaths, {} files".format(len(batch), files))
+            self.written.append(batch)
+            self.unpushed = True
+        if self.push_direct():
+            for written in self.written:
+                for entry in written:
+                    entry[3].discard()
+            self.written = []
+        return [entry[2] for entry in batch]
+
+    def push_direct(self):
+        for attempt in range(self.push_attempts):
+            if self.git("push", "-q", "origin", self.writer.ref) == 0:
+                self.unpushed = False
+                return True
+            print("push of {} rejected, writing the batches again on top of origin".format(self.machine_name))
+            refspec = "+{}:{}".format(self.writer.ref, self.writer.ref)
+            old = self.writer.tip()
+            # --update-head-ok in case the branch is checked out; its files
+            # are then synced to the fetched commit before writing again
+            if self.git("fetch", "-q", "--update-head-ok", "origin", refspec) != 0:
+                time.sleep(2 ** attempt)
+                continue
+            if self.dryrun != True:
+                self.writer.sync_checkout(old, self.writer.tip())
+            try:
+                for written in self.written:
+                    self.writer.commit([entry[3] for entry in written], self.message(written))
+            except (OSError, subprocess.SubprocessError) as err:
+                print("rewriting {} batches failed: {}".format(len(self.written), err))
+                return False
+        print("giving up pushing {} until the next commit".format(self.machine_name))
+        return False
+
+    def repo_lock(self):
+        return RepoLock(os.path.join(self.artifacts_root, ".monitor", "commit.lock"), self.dryrun)
+
+
+class RepoLock:
+    """flock() on a file, held for the duration of a with block."""
+
+    def __init__(self, path, dryrun=False):
+        self.path = path
+        self.dryrun = dryrun
+        self.file = None
+
+    def __enter__(self):
+        if self.dryrun != True:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            exclude_from_git(os.path.dirname(os.path.dirname(self.path)), ".monitor/")
+            self.file = open(self.path, "a")
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *args):
+        if self.file is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
@@ -0,0 +1,371 @@
+"""Caching compiler launcher for the generated build scripts, used as
+ESMF_F90COMPILER="python3 compiler_cache.py mpif90". Single-source -c
+compiles are kept in COMPILER_CACHE_DIR with the .mod files they define;
+anything else goes straight to the compiler. COMPILER_CACHE_BASEDIR (default
+ESMF_DIR), COMPILER_CACHE_MAXSIZE and COMPILER_CACHE_STATS are optional.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+
+KEY_VERSION = "3"
+FORTRAN_EXTS = [".f", ".for", ".ftn", ".f90", ".f95", ".f03", ".f08", ".F", ".FOR", ".F90", ".F95", ".F03", ".F08"]
+C_EXTS = [".c", ".C", ".cc", ".cpp", ".cxx", ".c++"]
+UNCACHEABLE_FLAGS = ["-E", "-S", "-M", "-MM", "-MD", "-MMD", "-MF", "-MT", "-MQ"]
+
+USE_RE = re.compile(
+    r"^\s*use\s*(?:,\s*(?:non_)?intrinsic\s*)?(?:::)?\s*(\w+)", re.IGNORECASE | re.MULTILINE
+)
+MODULE_RE = re.compile(
+    r"^\s*module\s+(?!procedure\b|function\b|subroutine\b)(\w+)\s*(?:!.*)?$",
+    re.IGNORECASE | re.MULTILINE,
+)
+SUBMODULE_RE = re.compile(r"^\s*submodule\s*\(", re.IGNORECASE | re.MULTILINE)
+# Fortran INCLUDE lines, which the compiler reads after preprocessing
+INCLUDE_RE = re.compile(r"""^\s*include\s*['"]([^'"]+)['"]""", re.IGNORECASE | re.MULTILINE)
+
+
+class Invocation:
+    """What a compile command reads and writes, as far as the cache cares."""
+
+    def __init__(self, compiler, args):
+        self.compiler = compiler
+        self.args = args
+        self.source = None
+        self.output = None
+        self.mod_dir = None
+        self.include_dirs = []
+        self.cacheable = "-c" in args
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg in UNCACHEABLE_FLAGS:
+                self.cacheable = False
+            elif arg == "-o" and i + 1 < len(args):
+                self.output = args[i + 1]
+                i += 1
+            elif arg in ["-J", "-module", "-mdir"] and i + 1 < len(args):
+                self.mod_dir = args[i + 1]
+                i += 1
+            elif arg.startswith("-J") and len(arg) > 2:
+                self.mod_dir = arg[2:]
+            elif arg.startswith("-qmoddir="):
+                self.mod_dir = arg[len("-qmoddir=") :]
+            elif arg == "-I" and i + 1 < len(args):
+                self.include_dirs.append(args[i + 1])
+                i += 1
+            elif arg.startswith("-I"):
+                self.include_dirs.append(arg[2:])
+            elif os.path.splitext(arg)[1] in FORTRAN_EXTS + C_EXTS and not arg.startswith("-"):
+                if self.source is not None:
+                    self.cacheable = False
+                self.source = arg
+            i += 1
+        if self.source is None:
+            self.cacheable = False
+            return
+        self.fortran = os.path.splitext(self.source)[1] in FORTRAN_EXTS
+        if self.output is None:
+            self.output = os.path.splitext(os.path.basename(self.source))[0] + ".o"
+        if self.mod_dir is None:
+            self.mod_dir = "."
+
+    def preprocess_args(self):
+        """The same command line with -c/-o replaced by -E."""
+        result = []
+        skip = False
+        for arg in self.args:
+            if skip:
+                skip = False
+            elif arg == "-o":
+                skip = True
+            elif arg != "-c":
+                result.append(arg)
+        return [self.compiler] + result + ["-E"]
+
+
+def parse_size(text):
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+    text = str(text).strip().upper().rstrip("B")
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def compiler_identity(compiler):
+    path = shutil.which(compiler)
+    if path is None:
+        return compiler
+    path = os.path.realpath(path)
+    st = os.stat(path)
+    return "{} {} {}".format(path, st.st_size, int(st.st_mtime))
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as _file:
+        for chunk in iter(lambda: _file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def find_module(name, inv):
+    for directory in [inv.mod_dir, "."] + inv.include_dirs:
+        path = os.path.join(directory, name.lower() + ".mod")
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def find_include(name, inv):
+    for directory in [os.path.dirname(inv.source), "."] + inv.include_dirs:
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def included_files(inv, text):
+    """[(name, digest)] of the files text INCLUDEs, and the files they include."""
+    found = []
+    pending = INCLUDE_RE.findall(text)
+    seen = set()
+    while pending:
+        name = pending.pop(0)
+        if name in seen:
+            continue
+        seen.add(name)
+        path = find_include(name, inv)
+        if path is None:
+            found.append((name, "missing"))
+            continue
+        found.append((name, file_digest(path)))
+        with open(path, "rb") as _file:
+            pending.extend(INCLUDE_RE.findall(_file.read().decode("utf-8", "replace")))
+    return found
+
+
+def build_roots():
+    """The build root as given and as a real path, longest first, or []."""
+    root = os.environ.get("COMPILER_CACHE_BASEDIR") or os.environ.get("ESMF_DIR")
+    if not root:
+        return []
+    roots = set([os.path.abspath(root).rstrip("/"), os.path.realpath(root).rstrip("/")])
+    return sorted(roots, key=len, reverse=True)
+
+
+def relative_to_root(data, roots):
+    """data (bytes) with every build root replaced by a placeholder."""
+    for root in roots:
+        data = data.replace(root.encode(), b"@ROOT@")
+    return data
+
+
+def cache_key(inv, preprocessed):
+    roots = build_roots()
+    key = hashlib.sha256()
+    key.update("{}\n".format(KEY_VERSION).encode())
+    key.update("{}\n".format(compiler_identity(inv.compiler)).encode())
+    key.update("{}\n".format(os.environ.get("LOADEDMODULES", "")).encode())
+    # where in the tree the compile runs matters for relative paths, which
+    # tree it is doesn't
+    key.update(relative_to_root(os.getcwd().encode(), roots) + b"\n")
+    key.update(relative_to_root("\0".join(inv.args).encode(), roots))
+    key.update(relative_to_root(preprocessed, roots))
+    if inv.fortran:
+        text = preprocessed.decode("utf-8", "replace")
+        defined = set(name.lower() for name in MODULE_RE.findall(text))
+        for name in sorted(set(name.lower() for name in USE_RE.findall(text)) - defined):
+            path = find_module(name, inv)
+            digest = file_digest(path) if path is not None else "missing"
+            key.update("use {} {}\n".format(name, digest).encode())
+        for name, digest in included_files(inv, text):
+            key.update("include {} {}\n".format(name, digest).encode())
+    return key.hexdigest()
+
+
+def defined_modules(inv, preprocessed):
+    if not inv.fortran:
+        return []
+    text = preprocessed.decode("utf-8", "replace")
+    return sorted(set(name.lower() for name in MODULE_RE.findall(text)))
+
+
+def copy_if_changed(src, dest):
+    """Copy src to dest atomically, leaving dest alone when it already has the
+    same content so make doesn't rebuild everything that uses the module."""
+    if os.path.isfile(dest) and file_digest(dest) == file_digest(src):
+        return
+    tmp = "{}.cache-tmp.{}".format(dest, os.getpid())
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dest)
+
+
+def update_stats(path, counter, extra=None):
+    if path is None:
+        return
+    with open(path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            with open(path) as _file:
+                stats = json.load(_file)
+        except (OSError, ValueError):
+            stats = {"hits": 0, "misses": 0, "uncacheable": 0, "errors": 0}
+        stats[counter] = stats.get(counter, 0) + 1
+        if extra is not None:
+            for key, value in extra.items():
+                stats[key] = round(stats.get(key, 0) + value, 3)
+        tmp = "{}.{}".format(path, os.getpid())
+        with open(tmp, "w") as _file:
+            json.dump(stats, _file, indent=2, sort_keys=True)
+        os.replace(tmp, path)
+
+
+def entry_size(entry):
+    total = 0
+    for root, dirs, files in os.walk(entry):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def evict(cache_dir, max_size):
+    """Remove least recently used entries until the cache is under 90% of max_size."""
+    with open(os.path.join(cache_dir, "cleanup.lock"), "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return  # another compile is already cleaning up
+        entries = []
+        total = 0
+        for prefix in os.listdir(cache_dir):
+            prefix_dir = os.path.join(cache_dir, prefix)
+            if len(prefix) != 2 or not os.path.isdir(prefix_dir):
+                continue
+            for name in os.listdir(prefix_dir):
+                entry = os.path.join(prefix_dir, name)
+                size = entry_size(entry)
+                entries.append((os.path.getmtime(entry), size, entry))
+                total += size
+        entries.sort()
+        for mtime, size, entry in entries:
+            if total <= max_size * 0.9:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+def store(cache_dir, key, inv, modules, stderr, max_size):
+    entry = os.path.join(cache_dir, key[:2], key[2:])
+    if os.path.isdir(entry):
+        return
+    tmp = os.path.join(cache_dir, "tmp", "{}.{}".format(key, os.getpid()))
+    os.makedirs(os.path.join(tmp, "mods"))
+    shutil.copyfile(inv.output, os.path.join(tmp, "object"))
+    for name in modules:
+        path = os.path.join(inv.mod_dir, name + ".mod")
+        if not os.path.isfile(path):
+            shutil.rmtree(tmp, ignore_errors=True)
+            return  # compiler put the module somewhere we didn't expect
+        shutil.copyfile(path, os.path.join(tmp, "mods", name + ".mod"))
+    with open(os.path.join(tmp, "stderr"), "wb") as _file:
+        _file.write(stderr)
+    os.makedirs(os.path.dirname(entry), exist_ok=True)
+    try:
+        os.rename(tmp, entry)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)  # another compile stored it first
+        return
+    if max_size is None:
+        return
+    # account for the new entry and clean up once every tenth of the budget
+    with open(os.path.join(cache_dir, "stored-bytes.lock"), "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        counter = os.path.join(cache_dir, "stored-bytes")
+        try:
+            with open(counter) as _file:
+                stored = int(_file.read().strip() or 0)
+        except (OSError, ValueError):
+            stored = 0
+        stored += entry_size(entry)
+        if stored > max_size / 10:
+            stored = 0
+            cleanup = True
+        else:
+            cleanup = False
+        with open(counter, "w") as _file:
+            _file.write("{}\n".format(stored))
+    if cleanup:
+        evict(cache_dir, max_size)
+
+
+def restore(entry, inv, modules):
+    # the object always gets rewritten so make sees it as newer than the source
+    tmp = "{}.cache-tmp.{}".format(inv.output, os.getpid())
+    shutil.copyfile(os.path.join(entry, "object"), tmp)
+    os.replace(tmp, inv.output)
+    for name in modules:
+        copy_if_changed(
+            os.path.join(entry, "mods", name + ".mod"), os.path.join(inv.mod_dir, name + ".mod")
+        )
+    with open(os.path.join(entry, "stderr"), "rb") as _file:
+        sys.stderr.buffer.write(_file.read())
+    now = time.time()
+    os.utime(entry, (now, now))
+
+
+def main(argv):
+    if len(argv) < 2:
+        sys.exit("usage: compiler_cache.py compiler [args...]")
+    compiler = argv[1]
+    args = argv[2:]
+    cache_dir = os.environ.get("COMPILER_CACHE_DIR")
+    stats = os.environ.get("COMPILER_CACHE_STATS")
+    if not cache_dir:
+        return subprocess.call([compiler] + args)
+    max_size = os.environ.get("COMPILER_CACHE_MAXSIZE")
+    if max_size:
+        max_size = parse_size(max_size)
+    else:
+        max_size = None
+
+    inv = Invocation(compiler, args)
+    if not inv.cacheable:
+        update_stats(stats, "uncacheable")
+        return subprocess.call([compiler] + args)
+    pre = subprocess.run(inv.preprocess_args(), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    if pre.returncode != 0 or SUBMODULE_RE.search(pre.stdout.decode("utf-8", "replace")):
+        update_stats(stats, "uncacheable")
+        return subprocess.call([compiler] + args)
+
+    key = cache_key(inv, pre.stdout)
+    modules = defined_modules(inv, pre.stdout)
+    entry = os.path.join(cache_dir, key[:2], key[2:])
+    if os.path.isdir(entry):
+        try:
+            restore(entry, inv, modules)
+            update_stats(stats, "hits", {"hit_bytes": os.path.getsize(inv.output)})
+            return 0
+        except OSError:
+            update_stats(stats, "errors")  # evicted under us, compile instead
+
+    start = time.time()
+    result = subprocess.run([compiler] + args, stderr=subprocess.PIPE)
+    sys.stderr.buffer.write(result.stderr)
+    update_stats(stats, "misses", {"miss_seconds": round(time.time() - start, 3)})
+    if result.returncode == 0 and os.path.isfile(inv.output):
+        try:
+            store(cache_dir, key, inv, modules, result.stderr, max_size)
+        except OSError:
+            update_stats(stats, "errors")
+    return result.returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,131 @@
+import os
+import concurrent.futures
+import shutil
+import time
+from esmf_results import BLOCK_SIZE, TestLogScanner, scan_log
+
+
+def date_header():
+    """The line `echo \`date\`` used to write at the top of every copied log."""
+    return time.strftime("%a %b %e %H:%M:%S %Z %Y")
+
+
+class CopyEngine:
+    """Copy files into the artifacts repo in-process, each one preceded by a
+    header line, using a pool of threads so that many small files on a
+    parallel file system are copied concurrently.
+
+    Files are added with add() and copied by run(), which reports how many
+    files and bytes it copied and how fast. With dryrun set (the same True
+    that ArchiveResults.runcmd checks for) nothing is written and each copy
+    is only printed.
+
+    Given an ArtifactStore, file bodies go into the store instead and
+    manifest collects {name relative to root: {"hash", "header", "size"}}
+    for the caller to write out.
+
+    Given a TestIndex, files added with a category are read through python
+    instead of sendfile and scanned with a TestLogScanner on the way, and
+    their results are added to the index.
+    """
+
+    def __init__(self, threads=8, dryrun=False, store=None, root=None, index=None):
+        self.threads = threads
+        self.dryrun = dryrun
+        self.store = store
+        self.root = root
+        self.index = index
+        self.manifest = {}
+        self.pending = []
+        self.files = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def add(self, src, dest, header, category=None):
+        self.pending.append((src, dest, header, category))
+
+    def copy_one(self, src, dest, header, category=None):
+        if self.index is None:
+            category = None
+        if self.store is not None:
+            digest, size = self.store.put(src)
+            self.manifest[os.path.relpath(dest, self.root)] = {
+                "hash": digest,
+                "header": header,
+                "size": size,
+            }
+            if category is not None:
+                self.index.add(category, dest, scan_log(src, TestLogScanner()))
+            return size
+        # dest may be a hard link into the published tree (see StagedOutpath),
+        # write a new file instead of truncating the shared one
+        if os.path.lexists(dest):
+            os.unlink(dest)
+        if category is not None:
+            return self.copy_scanned(src, dest, header, category)
+        with open(dest, "wb") as out_file:
+            out_file.write("{}\n".format(header).encode("utf-8"))
+            with open(src, "rb") as in_file:
+                size = os.fstat(in_file.fileno()).st_size
+                out_file.flush()
+                try:
+                    copied = 0
+                    while copied < size:
+                        sent = os.sendfile(out_file.fileno(), in_file.fileno(), copied, size - copied)
+                        if sent == 0:
+                            break
+                        copied += sent
+                except (AttributeError, OSError):
+                    # no sendfile for this pair of files, copy through python
+                    in_file.seek(0)
+                    out_file.seek(0)
+                    out_file.truncate()
+                    out_file.write("{}\n".format(header).encode("utf-8"))
+                    shutil.copyfileobj(in_file, out_file)
+                    copied = size
+        return copied
+
+    def copy_scanned(self, src, dest, header, category):
+        scanner = TestLogScanner()
+        copied = 0
+        with open(dest, "wb") as out_file, open(src, "rb") as in_file:
+            out_file.write("{}\n".format(header).encode("utf-8"))
+            for block in iter(lambda: in_file.read(BLOCK_SIZE), b""):
+                out_file.write(block)
+                scanner.update(block)
+                copied += len(block)
+        scanner.finish()
+        self.index.add(category, dest, scanner.result())
+        return copied
+
+    def run(self):
+        pending = self.pending
+        self.pending = []
+        if self.dryrun == True:
+            for src, dest, header, category in pending:
+                print("would have copied {} to {}".format(src, dest))
+            return
+        start = time.time()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.threads) as pool:
+            futures = {}
+            for src, dest, header, category in pending:
+                futures[pool.submit(self.copy_one, src, dest, header, category)] = (src, dest)
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    self.bytes += future.result()
+                    self.files += 1
+                except OSError as err:
+                    print("copying {} to {} failed: {}".format(futures[future][0], futures[future][1], err))
+        self.seconds += time.time() - start
+
+    def report(self):
+        seconds = max(self.seconds, 1e-6)
+        print(
+            "copied {} files, {} bytes in {:.2f}s ({:.1f} MB/s, {:.1f} files/s)".format(
+                self.files,
+                self.bytes,
+                self.seconds,
+                self.bytes / seconds / 1e6,
+                self.files / seconds,
+            )
+        )
@@ -0,0 +1,367 @@
+import os
+import argparse
+import collections
+import glob
+import json
+import re
+import subprocess
+import tempfile
+import threading
+import time
+
+BLOCK_SIZE = 1 << 20
+# a line longer than this is scanned in pieces rather than held in memory
+MAX_LINE = 1 << 16
+# FAIL lines longer than this are cut
+MAX_NAME = 256
+
+LogResult = collections.namedtuple("LogResult", ["passed", "failed", "success", "esmf_os"])
+LogResult.__doc__ = """What scan_log() found in a log.
+
+passed, failed -- number of lines containing PASS: and FAIL: (grep PASS: | wc -l)
+success -- whether "success" occurs anywhere (grep success)
+esmf_os -- the word after the first ESMF_OS:, or None
+"""
+
+
+class LogScanner:
+    """Single pass over a log, fed in blocks of whole lines. Each block is
+    searched with bytes.find, which skips through the lines without a match
+    at memchr speed, and only the few matching lines are looked at.
+
+    update() takes the blocks as they are read and finish() the end of the
+    file; result() is the LogResult. Only counts are kept, so memory use
+    doesn't grow with the log; TestLogScanner keeps the details of one test."""
+
+    # what counts as a PASS or FAIL line
+    tokens = [(b"PASS:", "PASS"), (b"FAIL:", "FAIL")]
+
+    def __init__(self):
+        self.passed = 0
+        self.failed = 0
+        self.success = False
+        self.esmf_os = None
+        self.tail = b""
+
+    def update(self, block):
+        data = self.tail + block
+        cut = data.rfind(b"\n") + 1
+        if cut == 0 and len(data) > MAX_LINE:
+            cut = len(data)
+        self.feed(data[:cut])
+        self.tail = data[cut:]
+
+    def finish(self):
+        self.feed(self.tail)
+        self.tail = b""
+
+    def feed(self, data):
+        if not self.success and b"success" in data:
+            self.success = True
+        if self.esmf_os is None:
+            found = data.find(b"ESMF_OS:")
+            if found >= 0:
+                words = data[found + 8 : self.line_end(data, found)].split()
+                if words:
+                    self.esmf_os = words[0].decode("utf-8", "replace")
+        for token, status in self.tokens:
+            found = data.find(token)
+            while found >= 0:
+                end = self.line_end(data, found)
+                if not self.is_result(data, found, token):
+                    found = data.find(token, found + len(token))
+                    continue
+                if status == "PASS":
+                    self.passed += 1
+                else:
+                    self.failed += 1
+                self.counted(status, data, found)
+                # a line counts once, like grep | wc -l
+                found = data.find(token, end)
+
+    def is_result(self, data, found, token):
+        return True
+
+    def counted(self, status, data, found):
+        pass
+
+    @staticmethod
+    def line_end(data, position):
+        end = data.find(b"\n", position)
+        if end < 0:
+            return len(data)
+        return end
+
+    def result(self):
+        return LogResult(self.passed, self.failed, self.success, self.esmf_os)
+
+
+TestResult = collections.namedtuple(
+    "TestResult", ["passed", "failed", "status", "ranks", "elapsed", "failures"]
+)
+TestResult.__doc__ = """What a TestLogScanner found in the Log or stdout of one test.
+
+passed, failed -- number of PASS and FAIL lines
+status -- "FAIL" if any line failed, "PASS" if any passed, "NONE" otherwise
+ranks -- the NUMBER_OF_PROCESSORS the test reported, or None
+elapsed -- seconds the test reported, or else the time between the first
+           and last ESMF Log timestamps, or None
+failures -- the first MAX_FAILURES FAIL lines
+"""
+
+TEST_INDEX = "test_index.json"
+# FAIL lines kept per test
+MAX_FAILURES = 20
+ESMF_TIMESTAMP = re.compile(rb"(\d{8}) (\d{2})(\d{2})(\d{2}(?:\.\d+)?) ")
+ELAPSED = re.compile(rb"[Ee]lapsed[^0-9\n]*([0-9]+(?:\.[0-9]+)?)")
+RANKS = re.compile(rb"NUMBER_OF_PROCESSORS\D*(\d+)")
+
+
+class TestLogScanner(LogScanner):
+    """LogScanner for the Log and stdout files of unit tests, system tests
+    and examples, which write "PASS"/"FAIL" as a word at the start of a
+    message, with or without a colon. Also picks up the rank count, the
+    elapsed time and the failing lines."""
+
+    tokens = [(b"PASS", "PASS"), (b"FAIL", "FAIL")]
+
+    def __init__(self):
+        LogScanner.__init__(self)
+        self.ranks = None
+        self.elapsed = None
+        self.first = None
+        self.last = None
+        self.failures = []
+
+    def is_result(self, data, found, token):
+        before = data[found - 1 : found] if found > 0 else b"\n"
+        after = data[found + len(token) : found + len(token) + 1]
+        return before in b" \t\n" and after in [b" ", b"\t", b":", b"\n", b""]
+
+    def counted(self, status, data, found):
+        if status == "FAIL" and len(self.failures) < MAX_FAILURES:
+            start = data.rfind(b"\n", 0, found) + 1
+            line = data[start : min(self.line_end(data, found), start + MAX_NAME)]
+            self.failures.append(line.strip().decode("utf-8", "replace"))
+
+    def feed(self, data):
+        LogScanner.feed(self, data)
+        if self.ranks is None and b"NUMBER_OF_PROCESSORS" in data:
+            match = RANKS.search(data)
+            if match is not None:
+                self.ranks = int(match.group(1))
+        if self.elapsed is None and b"lapsed" in data:
+            match = ELAPSED.search(data)
+            if match is not None:
+                self.elapsed = float(match.group(1))
+        if not data:
+            return
+        if self.first is None:
+            self.first = self.timestamp(data, 0)
+        last = data.rfind(b"\n", 0, len(data) - 1) + 1
+        stamp = self.timestamp(data, last)
+        if stamp is not None:
+            self.last = stamp
+
+    @staticmethod
+    def timestamp(data, position):
+        match = ESMF_TIMESTAMP.match(data, position)
+        if match is None:
+            return None
+        day, hours, minutes, seconds = match.groups()
+        return int(day), int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    def result(self):
+        if self.failed:
+            status = "FAIL"
+        elif self.passed:
+            status = "PASS"
+        else:
+            status = "NONE"
+        elapsed = self.elapsed
+        if elapsed is None and self.first is not None and self.last is not None and self.first[0] == self.last[0]:
+            elapsed = round(self.last[1] - self.first[1], 3)
+        return TestResult(self.passed, self.failed, status, self.ranks, elapsed, self.failures)
+
+
+def test_name(path):
+    """The test a Log or stdout file belongs to: ESMF_ArrayUTest for
+    ESMF_ArrayUTest.Log, ESMF_ArrayUTest.stdout and PET0.ESMF_ArrayUTest.Log."""
+    name = re.sub(r"^PET\d+\.", "", os.path.basename(path))
+    return name.split(".")[0]
+
+
+def merge_results(files):
+    """One TestResult for a test from the TestResults of its files,
+    [(file name, result)]. A test reports every PASS/FAIL in its Log(s) and
+    again in its stdout, so the counts come from the Logs where there are
+    any (the most any one of them has, for a Log per PET) and from the other
+    files otherwise; the test failed if any of its files did."""
+    logs = [result for name, result in files if name.endswith(".Log")]
+    counted = logs or [result for name, result in files]
+    results = [result for name, result in files]
+    if any(result.status == "FAIL" for result in results):
+        status = "FAIL"
+    elif any(result.status == "PASS" for result in results):
+        status = "PASS"
+    else:
+        status = "NONE"
+    ranks = [result.ranks for result in results if result.ranks is not None]
+    elapsed = [result.elapsed for result in results if result.elapsed is not None]
+    failures = []
+    for result in results:
+        for line in result.failures:
+            if line not in failures and len(failures) < MAX_FAILURES:
+                failures.append(line)
+    return TestResult(
+        max(result.passed for result in counted),
+        max(result.failed for result in counted),
+        status,
+        max(ranks) if ranks else None,
+        max(elapsed) if elapsed else None,
+        failures,
+    )
+
+
+class TestIndex:
+    """Per-test results of one combination, collected from many threads as
+    the test and example files are copied, and written to
+    {outpath}/test_index.json as columns: {"columns": [names],
+    "rows": count, "<name>": [one value per test], ...}.
+
+    The Log, stdout and per-PET Log files of a test are merged into one row
+    (see merge_results), so each test name appears once per category; file
+    is its Log, or its first file if it has none."""
+
+    columns = ["name", "category", "file", "status", "passed", "failed", "ranks", "elapsed", "failures"]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (category, test name) -> [(file name, TestResult)]
+        self.tests = {}
+
+    def add(self, category, path, result):
+        with self.lock:
+            self.tests.setdefault((category, test_name(path)), []).append((os.path.basename(path), result))
+
+    def rows(self):
+        rows = []
+        for (category, name), files in sorted(self.tests.items()):
+            names = sorted(file for file, result in files)
+            logs = [file for file in names if file.endswith(".Log")]
+            result = merge_results(files)
+            rows.append(
+                [
+                    name,
+                    category,
+                    (logs or names)[0],
+                    result.status,
+                    result.passed,
+                    result.failed,
+                    result.ranks,
+                    result.elapsed,
+                    result.failures,
+                ]
+            )
+        return rows
+
+    def write(self, outpath):
+        rows = self.rows()
+        index = {"columns": self.columns, "rows": len(rows)}
+        for number, column in enumerate(self.columns):
+            index[column] = [row[number] for row in rows]
+        with open(os.path.join(outpath, TEST_INDEX), "w") as _file:
+            json.dump(index, _file, separators=(",", ":"))
+            _file.write("\n")
+
+
+def scan_log(path, scanner=None):
+    """Read path once, in BLOCK_SIZE blocks, and return its LogResult (or
+    the result of scanner, default a LogScanner). Memory use does not depend
+    on the size of the log. Raises OSError if it can't be read."""
+    if scanner is None:
+        scanner = LogScanner()
+    with open(path, "rb") as _file:
+        for block in iter(lambda: _file.read(BLOCK_SIZE), b""):
+            scanner.update(block)
+    scanner.finish()
+    return scanner.result()
+
+
+def find_esmf_os(paths):
+    """The ESMF_OS of the first of paths that reports one, or "unknown"."""
+    for path in sorted(paths):
+        try:
+            esmf_os = scan_log(path).esmf_os
+        except OSError:
+            continue
+        if esmf_os is not None:
+            return esmf_os
+    return "unknown"
+
+
+def read_results(pattern):
+    """The stripped contents of the results files matching pattern (like
+    cat pattern), or None if there are none."""
+    paths = sorted(glob.glob(pattern))
+    if not paths:
+        return None
+    text = []
+    for path in paths:
+        with open(path, "rb") as _file:
+            text.append(_file.read())
+    return b"".join(text).strip().decode("utf-8", "replace")
+
+
+def write_synthetic_log(path, size):
+    """Write about size bytes of make-like output with some test results."""
+    filler = b"".join(
+        b"mpif90 -c -O2 -I../include src/Infrastructure/Array/ESMF_Array%d.F90 -o obj/ESMF_Array%d.o\n" % (i, i)
+        for i in range(200)
+    )
+    written = 0
+    index = 0
+    with open(path, "wb") as _file:
+        _file.write(b"ESMF_OS:             Linux\n")
+        while written < size:
+            _file.write(filler)
+            status = b"FAIL" if index % 50 == 0 else b"PASS"
+            _file.write(b" %s: Test %d of the synthetic suite, ESMF_SynthUTest.F90, line %d\n" % (status, index % 500, index))
+            written += len(filler)
+            index += 1
+        _file.write(b"ESMF library built successfully\n")
+
+
+def benchmark(size_gb):
+    """Compare scan_log() with the grep pipelines it replaced on a synthetic
+    log of size_gb GB."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, "build_1.log")
+        write_synthetic_log(path, int(size_gb * (1 << 30)))
+        size = os.path.getsize(path)
+        start = time.time()
+        result = scan_log(path)
+        scanned = time.time() - start
+        start = time.time()
+        for command in ["grep PASS: {} | wc -l", "grep FAIL: {} | wc -l", "grep success {}", "grep ESMF_OS: {}"]:
+            subprocess.run(command.format(path), shell=True, stdout=subprocess.DEVNULL)
+        grepped = time.time() - start
+    print("{} bytes, {} PASS, {} FAIL".format(size, result.passed, result.failed))
+    print("scan_log: {:.2f}s ({:.0f} MB/s)".format(scanned, size / max(scanned, 1e-6) / 1e6))
+    print("grep:     {:.2f}s ({:.0f} MB/s)".format(grepped, size / max(grepped, 1e-6) / 1e6))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scan ESMF logs for test results")
+    parser.add_argument("logs", nargs="*", help="logs to scan")
+    parser.add_argument("--benchmark", help="time scanning a synthetic log of this many GB", required=False)
+    args = vars(parser.parse_args())
+    if args["benchmark"] is not None:
+        benchmark(float(args["benchmark"]))
+    for log in args["logs"]:
+        result = scan_log(log)
+        print(
+            "{}: PASS {} FAIL {} success {} esmf_os {}".format(
+                log, result.passed, result.failed, result.success, result.esmf_os
+            )
+        )
@@ -0,0 +1,156 @@
+import os
+import shutil
+import stat
+import subprocess
+
+
+class GitTreeWriter:
+    """Commit staged outpaths to a branch of the artifacts repo with
+    git fast-import, without a working tree or index.
+
+    Each outpath of a batch is given as a StagedOutpath: the files in its
+    staging directory are streamed into new blobs, and whatever the branch has
+    under the outpath that the stage doesn't carry (see StagedOutpath.carry)
+    is deleted. A carry of None keeps everything the stage doesn't replace.
+    Only the new files and the trees above them are written, so the cost of a
+    commit depends on what was archived, not on the size of the repo, and
+    artifacts_root can be a bare clone or a checkout of another branch. When
+    the branch itself is checked out, its index and files are moved along with
+    it (see sync_checkout), so git status stays clean.
+    """
+
+    def __init__(self, artifacts_root, branch, dryrun=False):
+        self.artifacts_root = artifacts_root
+        self.branch = branch
+        self.ref = "refs/heads/{}".format(branch)
+        self.dryrun = dryrun
+
+    def git(self, *args):
+        return subprocess.check_output(["git"] + list(args), cwd=self.artifacts_root)
+
+    def tip(self):
+        try:
+            return self.git("rev-parse", "--verify", "-q", self.ref + "^{commit}").decode("utf-8").strip()
+        except subprocess.CalledProcessError:
+            return None
+
+    def listdir(self, path, tip=None):
+        """Names in directory path (relative to the repo root) on the branch."""
+        if tip is None:
+            tip = self.tip()
+        if tip is None:
+            return []
+        output = self.git("ls-tree", "--name-only", "-z", tip, "--", path.rstrip("/") + "/")
+        return [os.path.basename(name) for name in output.decode("utf-8").split("\0") if name]
+
+    def read(self, path):
+        """Contents of path on the branch, or None."""
+        try:
+            return self.git("cat-file", "blob", "{}:{}".format(self.ref, path))
+        except subprocess.CalledProcessError:
+            return None
+
+    def checked_out(self):
+        """Whether the branch is HEAD of a checkout."""
+        bare = self.git("rev-parse", "--is-bare-repository").strip()
+        head = subprocess.run(
+            ["git", "symbolic-ref", "-q", "HEAD"], cwd=self.artifacts_root, stdout=subprocess.PIPE
+        )
+        return bare == b"false" and head.stdout.strip().decode("utf-8") == self.ref
+
+    def sync_checkout(self, old, new):
+        """After the branch moved from old to new without a checkout, bring
+        the index and files of a checkout of it up to date, so nothing shows
+        up as deleted or modified there."""
+        if new is None or old == new or not self.checked_out():
+            return
+        if old is None:
+            self.git("read-tree", "-m", "-u", new)
+        else:
+            self.git("read-tree", "-m", "-u", old, new)
+
+    def commit_header(self, message, tip):
+        """The fast-import commands starting a commit on top of tip."""
+        ident = self.git("var", "GIT_COMMITTER_IDENT").decode("utf-8").strip()
+        data = message.encode("utf-8")
+        header = "commit {}\ncommitter {}\ndata {}\n".format(self.ref, ident, len(data)).encode("utf-8")
+        header += data + b"\n"
+        if tip is not None:
+            header += "from {}\n".format(tip).encode("utf-8")
+        return header
+
+    def commit_files(self, files, message):
+        """Make one commit on the branch setting each path in files to the
+        bytes it maps to. Returns the new commit."""
+        tip = self.tip()
+        if self.dryrun == True:
+            print("would have committed {} to {}".format(", ".join(sorted(files)), self.ref))
+            return tip
+        stream = [self.commit_header(message, tip)]
+        for path in sorted(files):
+            stream.append("M 100644 inline {}\ndata {}\n".format(path, len(files[path])).encode("utf-8"))
+            stream.append(files[path] + b"\n")
+        stream.append(b"\n")
+        subprocess.run(
+            ["git", "fast-import", "--quiet"], input=b"".join(stream), cwd=self.artifacts_root, check=True
+        )
+        new = self.tip()
+        self.sync_checkout(tip, new)
+        return new
+
+    def commit(self, stages, message):
+        """Make one commit on the branch replacing the outpath of every stage
+        with its contents. Returns the number of files written."""
+        tip = self.tip()
+        if self.dryrun == True:
+            print("would have imported {} outpaths into {}".format(len(stages), self.ref))
+            return 0
+        proc = subprocess.Popen(
+            ["git", "fast-import", "--quiet"], stdin=subprocess.PIPE, cwd=self.artifacts_root
+        )
+        stream = proc.stdin
+        files = 0
+        try:
+            stream.write(self.commit_header(message, tip))
+            for stage in stages:
+                outpath = os.path.relpath(stage.outpath, self.artifacts_root)
+                replaced = os.listdir(stage.path)
+                for name in self.listdir(outpath, tip):
+                    if stage.carry is None and name not in replaced:
+                        continue
+                    if stage.carry is not None and name in stage.carry:
+                        continue
+                    stream.write("D {}/{}\n".format(outpath, name).encode("utf-8"))
+                files += self.write_files(stream, stage.path, outpath)
+            stream.write(b"\n")
+            stream.close()
+        except BrokenPipeError:
+            pass
+        if proc.wait() != 0:
+            raise OSError("git fast-import failed writing {}".format(self.ref))
+        self.sync_checkout(tip, self.tip())
+        return files
+
+    def write_files(self, stream, directory, prefix):
+        files = 0
+        for root, dirs, names in os.walk(directory):
+            dirs.sort()
+            for name in sorted(names):
+                path = os.path.join(root, name)
+                target = "{}/{}".format(prefix, os.path.relpath(path, directory))
+                info = os.lstat(path)
+                if stat.S_ISLNK(info.st_mode):
+                    data = os.fsencode(os.readlink(path))
+                    stream.write("M 120000 inline {}\ndata {}\n".format(target, len(data)).encode("utf-8"))
+                    stream.write(data + b"\n")
+                    continue
+                if info.st_mode & stat.S_IXUSR:
+                    mode = "100755"
+                else:
+                    mode = "100644"
+                stream.write("M {} inline {}\ndata {}\n".format(mode, target, info.st_size).encode("utf-8"))
+                with open(path, "rb") as in_file:
+                    shutil.copyfileobj(in_file, stream)
+                stream.write(b"\n")
+                files += 1
+        return files
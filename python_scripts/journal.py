@@ -0,0 +1,122 @@
+import os
+import json
+import sqlite3
+import time
+from staging import exclude_from_git
+
+# the order jobs move through; "abandoned" is for jobs the monitor gave up on
+STAGES = ["submitted", "running", "finished", "archived", "committed"]
+DONE_STAGES = ["committed", "abandoned"]
+# listed rather than "NOT IN DONE_STAGES" so the jobs_stage index is used
+LIVE_STAGES = [stage for stage in STAGES if stage not in DONE_STAGES]
+
+
+class MonitorJournal:
+    """What the monitor is tracking, kept in {artifacts_root}/.monitor/state.sqlite
+    so a monitor killed with the login node can be restarted with --resume.
+
+    queues has one row per queue file (how far it has been read and the
+    settings of the run that wrote it), jobs one row per tracked job with the
+    stage it has reached. Rows are updated in place and the stage column is
+    indexed, so resuming reads the outstanding jobs only.
+    """
+
+    def __init__(self, artifacts_root):
+        directory = os.path.join(artifacts_root, ".monitor")
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, "state.sqlite")
+        # keep the journal out of git status in the artifacts repo
+        exclude_from_git(artifacts_root, ".monitor/")
+        self.db = sqlite3.connect(self.path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS queues (queue_file TEXT PRIMARY KEY, "
+            "machine_name TEXT, scheduler TEXT, test_root_dir TEXT, dryrun TEXT, "
+            "options TEXT, offset INTEGER DEFAULT 0, ended INTEGER DEFAULT 0)"
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (queue_file TEXT, jobid TEXT, "
+            "build_basename TEXT, mpiversion TEXT, branch TEXT, stage TEXT, "
+            "commit_kind TEXT, build_hash TEXT, submitted REAL, updated REAL, "
+            "PRIMARY KEY (queue_file, jobid, build_basename))"
+        )
+        columns = [row["name"] for row in self.db.execute("PRAGMA table_info(jobs)")]
+        if "kind" not in columns:
+            # "build" or "test", added after the first journals were written
+            self.db.execute("ALTER TABLE jobs ADD COLUMN kind TEXT")
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_stage ON jobs (stage)")
+        self.db.commit()
+
+    def add_queue(self, queue_file, machine_name, scheduler, test_root_dir, dryrun, options={}):
+        self.db.execute(
+            "INSERT OR IGNORE INTO queues (queue_file, machine_name, scheduler, "
+            "test_root_dir, dryrun, options) VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                queue_file,
+                str(machine_name),
+                str(scheduler),
+                test_root_dir,
+                str(dryrun),
+                json.dumps(options),
+            ),
+        )
+        self.db.commit()
+
+    def queue(self, queue_file):
+        return self.db.execute(
+            "SELECT * FROM queues WHERE queue_file = ?", (queue_file,)
+        ).fetchone()
+
+    def queue_read(self, queue_file, offset, ended):
+        self.db.execute(
+            "UPDATE queues SET offset = ?, ended = ? WHERE queue_file = ?",
+            (offset, int(ended), queue_file),
+        )
+        self.db.commit()
+
+    def add_job(self, queue_file, record):
+        now = time.time()
+        self.db.execute(
+            "INSERT OR IGNORE INTO jobs (queue_file, jobid, build_basename, mpiversion, "
+            "branch, kind, stage, submitted, updated) VALUES (?, ?, ?, ?, ?, ?, 'submitted', ?, ?)",
+            (
+                queue_file,
+                str(record["jobid"]),
+                record["build_basename"],
+                record["mpiversion"],
+                record["branch"],
+                record.get("stage"),
+                now,
+                now,
+            ),
+        )
+        self.db.commit()
+
+    def set_stage(self, queue_file, jobid, build_basename, stage, commit_kind=None, build_hash=None):
+        self.db.execute(
+            "UPDATE jobs SET stage = ?, updated = ?, commit_kind = COALESCE(?, commit_kind), "
+            "build_hash = COALESCE(?, build_hash) "
+            "WHERE queue_file = ? AND jobid = ? AND build_basename = ?",
+            (stage, time.time(), commit_kind, build_hash, queue_file, str(jobid), build_basename),
+        )
+        self.db.commit()
+
+    def outstanding(self, queue_file=None):
+        """Jobs not yet committed or abandoned, oldest first. Only the rows of
+        those jobs are read (through the jobs_stage index), so this doesn't get
+        slower as committed jobs pile up."""
+        query = "SELECT * FROM jobs WHERE stage IN ({})".format(", ".join("?" * len(LIVE_STAGES)))
+        args = list(LIVE_STAGES)
+        if queue_file is not None:
+            query += " AND queue_file = ?"
+            args.append(queue_file)
+        return self.db.execute(query + " ORDER BY rowid", args).fetchall()
+
+    def unfinished_queues(self):
+        """Queue files that may still get jobs or still have jobs to archive."""
+        busy = set(row["queue_file"] for row in self.outstanding())
+        rows = self.db.execute("SELECT * FROM queues WHERE ended = 0").fetchall()
+        # a run that died before queueing anything left nothing to read
+        names = set(row["queue_file"] for row in rows if os.path.isfile(row["queue_file"])) | busy
+        return [self.queue(name) for name in sorted(names)]
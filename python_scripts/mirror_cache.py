@@ -0,0 +1,130 @@
+import os
+import re
+import subprocess
+import threading
+import time
+
+
+class MirrorCache:
+    """Keep one bare mirror per upstream repository and make per-combination
+    checkouts from it, so each nightly run fetches from the remote once per repo
+    instead of once per compiler/mpi/build type/branch combination.
+
+    mode is "shared" (git clone --shared from the mirror, with origin pointed
+    back upstream afterwards) or "worktree" (git worktree add --detach on the
+    mirror itself).
+    """
+
+    def __init__(self, mirror_root, mode="shared", dryrun=False):
+        self.mirror_root = os.path.abspath(mirror_root)
+        self.mode = mode
+        self.dryrun = dryrun
+        self.fetched = set()
+        # self.lock guards the bookkeeping below, repo_lock(url) one mirror
+        self.lock = threading.Lock()
+        self.repo_locks = {}
+        self.clone_seconds = 0.0
+        self.fetch_seconds = 0.0
+        self.checkouts = {}
+        self.full_clone_estimate = {}
+
+    def runcmd(self, cmd, cwd=None):
+        if self.dryrun == True:
+            print("would have executed {}".format(cmd))
+            return ""
+        print("running {}".format(cmd))
+        return subprocess.check_output(cmd, shell=True, cwd=cwd).strip().decode("utf-8")
+
+    def mirror_path(self, url):
+        name = re.sub(r"\.git$", "", url.rstrip("/").split("/")[-1].split(":")[-1])
+        return os.path.join(self.mirror_root, "{}.git".format(name))
+
+    def repo_lock(self, url):
+        """The lock serializing the fetch of, and worktree changes to, the
+        mirror of url."""
+        with self.lock:
+            return self.repo_locks.setdefault(url, threading.Lock())
+
+    def ensure(self, url):
+        """Create or refresh the bare mirror for url; only the first call in a
+        run talks to the remote. Callers for other mirrors don't wait on it."""
+        mirror = self.mirror_path(url)
+        with self.repo_lock(url):
+            if url in self.fetched:
+                return mirror
+            start = time.time()
+            if os.path.isdir(mirror):
+                self.runcmd("git --git-dir={} remote set-url origin {}".format(mirror, url))
+                self.runcmd("git --git-dir={} fetch --prune --tags origin".format(mirror))
+            else:
+                os.makedirs(self.mirror_root, exist_ok=True)
+                self.runcmd("git clone --mirror {} {}".format(url, mirror))
+                # a fresh mirror clone is the best estimate we have of what a
+                # full clone of this repo costs, keep it for the savings report
+                if self.dryrun != True:
+                    with open(os.path.join(mirror, "esmf-clone-seconds"), "w") as _file:
+                        _file.write("{}\n".format(time.time() - start))
+            estimate = self.read_clone_estimate(mirror)
+            with self.lock:
+                self.fetch_seconds += time.time() - start
+                self.full_clone_estimate[url] = estimate
+            self.fetched.add(url)
+        return mirror
+
+    def read_clone_estimate(self, mirror):
+        try:
+            with open(os.path.join(mirror, "esmf-clone-seconds")) as _file:
+                return float(_file.read().strip())
+        except (OSError, ValueError):
+            return 0.0
+
+    def checkout(self, url, branch, dest):
+        """Make dest a checkout of branch backed by the mirror of url."""
+        mirror = self.ensure(url)
+        start = time.time()
+        if self.mode == "worktree":
+            # forget worktrees removed with rm -rf (by this run or an earlier
+            # one, whether or not the mirror was just created) before adding;
+            # both under the mirror's lock so no prune runs during an add
+            with self.repo_lock(url):
+                self.runcmd("git --git-dir={} worktree prune".format(mirror))
+                self.runcmd(
+                    "git --git-dir={} worktree add --force --detach {} {}".format(
+                        mirror, dest, branch
+                    )
+                )
+        else:
+            self.runcmd("git clone --shared -b {} {} {}".format(branch, mirror, dest))
+            self.runcmd("git -C {} remote set-url origin {}".format(dest, url))
+        with self.lock:
+            self.clone_seconds += time.time() - start
+            self.checkouts[url] = self.checkouts.get(url, 0) + 1
+
+    def tip(self, url, branch):
+        """Return the commit sha of branch in the (already fetched) mirror."""
+        mirror = self.ensure(url)
+        return self.runcmd("git --git-dir={} rev-parse {}".format(mirror, branch))
+
+    def describe(self, url, branch):
+        """Return git describe --tags --abbrev=7 for branch, matching the hash
+        ArchiveResults records in summary.dat."""
+        mirror = self.ensure(url)
+        return self.runcmd(
+            "git --git-dir={} describe --tags --abbrev=7 {}".format(mirror, branch)
+        )
+
+    def report(self):
+        estimated = 0.0
+        for url, count in self.checkouts.items():
+            estimated += self.full_clone_estimate.get(url, 0.0) * count
+        spent = self.fetch_seconds + self.clone_seconds
+        print(
+            "mirror cache: {} checkouts, {:.1f}s fetching mirrors, {:.1f}s in local clones".format(
+                sum(self.checkouts.values()), self.fetch_seconds, self.clone_seconds
+            )
+        )
+        print(
+            "mirror cache: estimated {:.1f}s for full clones, saved {:.1f}s".format(
+                estimated, estimated - spent
+            )
+        )
@@ -0,0 +1,523 @@
+import os
+import argparse
+import asyncio
+import concurrent.futures
+import json
+import sys
+import tempfile
+import time
+from archive_results import ArchiveResults
+from commit_queue import CommitQueue
+from journal import MonitorJournal
+from sentinel import SentinelWatcher, read_sentinel, sentinel_path
+
+
+class JobMonitor:
+    """Wait for every job submitted in a nightly run and archive each one as it
+    finishes, from a single process.
+
+    test_esmf.py appends one JSON record per job to queue_file
+    ({"jobid", "build_basename", "mpiversion", "branch"}) and a final
+    {"end": true} once everything is submitted. The monitor keeps reading the
+    file and exits once the end record has been seen and nothing is left to
+    archive. Like the old per-job archive_results.py processes, it gives up on
+    a job after budget seconds.
+
+    A job is finished when its script has written complete_<jobid>.json (see
+    sentinel.py), which is looked for every scan_interval seconds or as soon
+    as inotify reports a local write. The scheduler is only asked every
+    poll_interval seconds, for jobs killed before they could write one, and a
+    query taking longer than query_timeout seconds is abandoned. The same poll
+    looks for jobs that can never start because the job they depend on failed
+    (a test job after a failed build); those are cancelled and archived with a
+    "build failed, tests skipped" summary instead of being waited on.
+
+    With a journal (see journal.py) every job and the stage it reached is
+    recorded as it goes, and resume() builds a monitor that carries on from
+    there after a crash: finished jobs are archived without asking the
+    scheduler again and archived ones only committed.
+
+    Everything runs on one asyncio event loop. Archiving a finished job is
+    handed to a pool of archive_limit threads, so the loop keeps watching the
+    other jobs meanwhile; the build and test jobs of one combination are
+    still archived one after the other. Archived outpaths go to committer (a
+    CommitQueue, shared by monitors run together), which commits and pushes
+    them in batches rather than one combination at a time.
+    """
+
+    def __init__(
+        self,
+        queue_file,
+        machine_name,
+        scheduler,
+        test_root_dir,
+        artifacts_root,
+        dryrun,
+        scan_interval=5,
+        poll_interval=300,
+        query_timeout=120,
+        archive_limit=4,
+        budget=144000,
+        journal=None,
+        options={},
+        committer=None,
+    ):
+        self.queue_file = queue_file
+        self.machine_name = machine_name
+        self.scheduler = scheduler
+        self.test_root_dir = test_root_dir
+        self.artifacts_root = artifacts_root
+        self.dryrun = dryrun
+        self.scan_interval = scan_interval
+        self.poll_interval = poll_interval
+        self.query_timeout = query_timeout
+        self.archive_limit = archive_limit
+        self.last_poll = 0.0
+        self.watcher = SentinelWatcher()
+        self.watcher.watch(os.path.dirname(os.path.abspath(queue_file)))
+        self.budget = budget
+        self.offset = 0
+        self.ended = False
+        self.last_record = time.time()
+        # archivers in submission order, so a build job is always archived
+        # before the test job that depends on it
+        self.tracked = []
+        # build_dir -> the last archive task started for it
+        self.archive_tasks = {}
+        self.archived = 0
+        self.journal = journal
+        # extra keyword arguments for ArchiveResults, e.g. store="cas"
+        self.options = options
+        # (archiver, collect) pairs resume() found half archived
+        self.resumed = []
+        if committer is None:
+            committer = CommitQueue(artifacts_root, machine_name, dryrun, direct=options.get("direct", False))
+        self.committer = committer
+        self.commit_task = None
+        if journal is not None:
+            journal.add_queue(queue_file, machine_name, scheduler, test_root_dir, dryrun, options)
+
+    @classmethod
+    def resume(cls, journal, queue, **kwargs):
+        """Rebuild the monitor of queue (a row of journal.unfinished_queues())."""
+        monitor = cls(
+            queue["queue_file"],
+            queue["machine_name"],
+            queue["scheduler"],
+            queue["test_root_dir"],
+            os.path.dirname(os.path.dirname(journal.path)),
+            queue["dryrun"],
+            journal=journal,
+            options=json.loads(queue["options"] or "{}"),
+            **kwargs
+        )
+        monitor.offset = queue["offset"]
+        monitor.ended = bool(queue["ended"])
+        if os.path.isfile(monitor.queue_file):
+            monitor.last_record = os.path.getmtime(monitor.queue_file)
+        for row in journal.outstanding(monitor.queue_file):
+            archiver = monitor.archiver(row)
+            if row["commit_kind"] == "skipped test":
+                collect = archiver.collect_skipped
+            else:
+                collect = archiver.collect
+            if row["stage"] in ["submitted", "running"]:
+                monitor.track(archiver, row["submitted"])
+            elif row["stage"] == "finished" or archiver.direct:
+                # in direct mode the stage of an archived job died with the
+                # monitor, so it is collected again
+                monitor.resumed.append((archiver, collect))
+            else:
+                archiver.commit_kind = row["commit_kind"]
+                archiver.build_hash = row["build_hash"]
+                monitor.resumed.append((archiver, None))
+            print("resuming job {} for {} at stage {}".format(row["jobid"], row["build_basename"], row["stage"]))
+        return monitor
+
+    def archiver(self, record):
+        archiver = ArchiveResults(
+            record["jobid"],
+            record["build_basename"],
+            self.machine_name,
+            self.scheduler,
+            self.test_root_dir,
+            self.artifacts_root,
+            record["mpiversion"],
+            record["branch"],
+            self.dryrun,
+            wait=False,
+            committer=self.committer,
+            **self.options
+        )
+        # a journal row says "kind", a queue record "stage" (if it is recent)
+        if "kind" in record.keys():
+            archiver.test_job = record["kind"] == "test"
+        else:
+            archiver.test_job = record.get("stage") == "test"
+        return archiver
+
+    def record(self, archiver, stage, commit_kind=None, build_hash=None):
+        if self.journal is not None:
+            self.journal.set_stage(
+                self.queue_file, archiver.jobid, archiver.build_basename, stage, commit_kind, build_hash
+            )
+
+    def read_queue(self):
+        if not os.path.isfile(self.queue_file):
+            return
+        with open(self.queue_file) as _file:
+            _file.seek(self.offset)
+            while True:
+                line = _file.readline()
+                # a partially written line is picked up on the next pass
+                if not line.endswith("\n"):
+                    break
+                self.offset = _file.tell()
+                record = json.loads(line)
+                self.last_record = time.time()
+                if record.get("end"):
+                    self.ended = True
+                    continue
+                if self.journal is not None:
+                    self.journal.add_job(self.queue_file, record)
+                self.track(self.archiver(record))
+                print("tracking job {} for {}".format(record["jobid"], record["build_basename"]))
+        if self.journal is not None:
+            self.journal.queue_read(self.queue_file, self.offset, self.ended)
+
+    def track(self, archiver, started=None):
+        if started is None:
+            started = time.time()
+        self.watcher.watch(archiver.build_dir)
+        self.tracked.append((started, archiver))
+
+    async def poll(self):
+        remaining = []
+        # keyed by build dir too: the combinations of a pack share one jobid,
+        # but each writes its own sentinel when its own script ends
+        finished = {}
+        for started, archiver in self.tracked:
+            finished[(archiver.jobid, archiver.build_dir)] = read_sentinel(archiver.build_dir, archiver.jobid)
+        waiting = sorted(set(jobid for jobid, build_dir in finished if finished[(jobid, build_dir)] is None))
+        states = {}
+        orphans = set()
+        if waiting and time.time() - self.last_poll >= self.poll_interval:
+            self.last_poll = time.time()
+            scheduler = self.tracked[0][1].scheduler
+            # one status query for everything still waiting
+            states = await scheduler.check_many_async(waiting, self.query_timeout)
+            orphans = await scheduler.find_orphans_async(
+                [jobid for jobid in waiting if not scheduler.jobFinished(states.get(jobid, "MISSING"))],
+                self.query_timeout,
+            )
+            await scheduler.cancel_async(sorted(orphans), self.query_timeout)
+        for started, archiver in self.tracked:
+            sentinel = finished[(archiver.jobid, archiver.build_dir)]
+            if sentinel is not None:
+                print("job {} of {} finished: {}".format(archiver.jobid, archiver.build_basename, sentinel))
+                done = True
+            elif archiver.jobid in orphans:
+                print("job {} can never run, its dependency failed".format(archiver.jobid))
+                self.record(archiver, "finished", commit_kind="skipped test")
+                self.start_archive(archiver, archiver.collect_skipped)
+                continue
+            elif archiver.jobid in states:
+                done = archiver.scheduler.jobFinished(states[archiver.jobid])
+                if not done and archiver.scheduler.jobRunning(states[archiver.jobid]):
+                    self.record(archiver, "running")
+            else:
+                done = False
+            skipped = (
+                done
+                and sentinel is None
+                and getattr(archiver, "test_job", False)
+                and not archiver.ran()
+            )
+            if skipped:
+                # PBS Pro shows a test job it deleted because its build failed
+                # as finished (F); it never wrote a log, so only the summary changes
+                print("job {} finished without running, its build failed".format(archiver.jobid))
+                self.record(archiver, "finished", commit_kind="skipped test")
+                self.start_archive(archiver, archiver.collect_skipped)
+                continue
+            if done:
+                self.record(archiver, "finished")
+                self.start_archive(archiver, archiver.collect)
+            elif time.time() - started > self.budget:
+                print("giving up on job {} after {} seconds".format(archiver.jobid, self.budget))
+                self.record(archiver, "abandoned")
+            else:
+                remaining.append((started, archiver))
+        self.tracked = remaining
+
+    def start_archive(self, archiver, collect):
+        """Archive archiver's job: run collect (None if that already happened)
+        and then commit, after any earlier archive of the same build dir."""
+        previous = self.archive_tasks.get(archiver.build_dir)
+        self.archive_tasks[archiver.build_dir] = asyncio.ensure_future(
+            self.archive(archiver, collect, previous)
+        )
+
+    async def archive(self, archiver, collect, previous):
+        if previous is not None:
+            # failures were reported by the previous task itself
+            await asyncio.wait([previous])
+        loop = asyncio.get_running_loop()
+        try:
+            if collect is not None:
+                await loop.run_in_executor(self.executor, collect)
+                self.record(
+                    archiver,
+                    "archived",
+                    archiver.commit_kind,
+                    getattr(archiver, "build_hash", None),
+                )
+            if archiver.commit_kind is None:
+                # nothing was copied, so there is nothing to commit either
+                self.record(archiver, "committed")
+            else:
+                archiver.commit_artifacts(self.committer, (self, archiver))
+            self.archived += 1
+        except Exception as err:
+            print("archiving job {} failed: {}".format(archiver.jobid, err))
+        if self.committer.due():
+            self.start_commit()
+
+    def start_commit(self):
+        if self.commit_task is None or self.commit_task.done():
+            self.commit_task = asyncio.ensure_future(self.commit())
+
+    async def commit(self):
+        loop = asyncio.get_running_loop()
+        try:
+            committed = await loop.run_in_executor(self.executor, self.committer.flush)
+        except Exception as err:
+            print("committing failed: {}".format(err))
+            return
+        # the committer may be shared, so each job is recorded by its own monitor
+        for monitor, archiver in committed:
+            monitor.record(archiver, "committed")
+
+    async def wait(self):
+        try:
+            await asyncio.wait_for(self.wakeup.wait(), self.scan_interval)
+        except asyncio.TimeoutError:
+            pass
+        self.wakeup.clear()
+        self.watcher.drain()
+
+    async def main(self):
+        self.wakeup = asyncio.Event()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.archive_limit)
+        loop = asyncio.get_running_loop()
+        if self.watcher.fileno() is not None:
+            loop.add_reader(self.watcher.fileno(), self.wakeup.set)
+        for archiver, collect in self.resumed:
+            self.start_archive(archiver, collect)
+        while True:
+            self.read_queue()
+            await self.poll()
+            if not self.tracked:
+                if self.ended:
+                    break
+                # the submitting process died before writing the end record
+                if time.time() - self.last_record > self.budget:
+                    print("no new jobs for {} seconds, exiting".format(self.budget))
+                    break
+            if self.committer.due():
+                self.start_commit()
+            await self.wait()
+        if self.archive_tasks:
+            await asyncio.wait(list(self.archive_tasks.values()))
+        # one last commit for whatever is still queued
+        if self.commit_task is not None:
+            await asyncio.wait([self.commit_task])
+        await self.commit()
+        if self.watcher.fileno() is not None:
+            loop.remove_reader(self.watcher.fileno())
+        self.executor.shutdown()
+
+    def run(self):
+        asyncio.run(self.main())
+        print("monitor finished")
+
+
+def run_all(monitors):
+    """Run several monitors (resumed runs) on one event loop."""
+
+    async def main():
+        await asyncio.gather(*[monitor.main() for monitor in monitors])
+
+    asyncio.run(main())
+    print("monitor finished")
+
+
+class SimulatedArchive:
+    """Stands in for ArchiveResults in benchmark(): archiving just sleeps."""
+
+    def __init__(self, jobid, build_dir, seconds):
+        self.jobid = jobid
+        self.build_dir = build_dir
+        self.build_basename = os.path.basename(build_dir)
+        self.seconds = seconds
+        self.scheduler = None
+        self.commit_kind = None
+
+    def collect(self):
+        time.sleep(self.seconds)
+
+    def commit_artifacts(self, committer=None, token=None):
+        pass
+
+
+def benchmark(count, archive_limit, seconds=0.2):
+    """Time the monitor archiving count jobs that all finish at once, each
+    archive taking seconds."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        queue_file = os.path.join(tmpdir, "monitor-queue.jsonl")
+        with open(queue_file, "w") as _file:
+            _file.write(json.dumps({"end": True}) + "\n")
+        monitor = JobMonitor(
+            queue_file, "bench", "None", tmpdir, tmpdir, True, archive_limit=archive_limit
+        )
+        for index in range(count):
+            build_dir = os.path.join(tmpdir, "job{}".format(index))
+            os.mkdir(build_dir)
+            with open(sentinel_path(build_dir, index), "w") as _file:
+                _file.write(json.dumps({"jobid": str(index), "status": 0}) + "\n")
+            monitor.track(SimulatedArchive(index, build_dir, seconds))
+        start = time.time()
+        monitor.run()
+        elapsed = time.time() - start
+    print(
+        "{} jobs, archive limit {}: {:.2f}s, {:.1f} jobs/s".format(
+            monitor.archived, archive_limit, elapsed, monitor.archived / elapsed
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive the results of every job of an ESMF nightly run")
+    parser.add_argument("-q", "--queue", help="queue file written by test_esmf.py", required=False)
+    parser.add_argument(
+        "-m",
+        "--machinename",
+        help="name of machine where tests were run",
+        required=False,
+        default=False,
+    )
+    parser.add_argument("-s", "--scheduler", help="type of scheduler used", required=False, default=None)
+    parser.add_argument(
+        "-t",
+        "--testrootdir",
+        help="root directory containing python_scritps",
+        required=False,
+    )
+    parser.add_argument(
+        "-a",
+        "--artifactsrootdir",
+        help="directory where artifacts will be placed",
+        required=False,
+    )
+    parser.add_argument("-d", "--dryrun", help="dryrun?", required=False, default=False)
+    parser.add_argument(
+        "-l", "--archive-limit", help="number of jobs archived at the same time", required=False, default=4
+    )
+    parser.add_argument(
+        "-c",
+        "--store",
+        help="cas to keep logs in the content-addressed artifact store",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-z",
+        "--bundle",
+        help="gzip or zstd to archive examples, test and lib as one compressed tar each",
+        required=False,
+        default=None,
+    )
+    parser.add_argument(
+        "-g",
+        "--direct",
+        help="commit straight into git objects, the artifacts repo can be a bare clone",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--commit-interval",
+        help="seconds archived outpaths may wait before they are committed",
+        required=False,
+        default=60,
+    )
+    parser.add_argument(
+        "--commit-batch",
+        help="commit as soon as this many outpaths are waiting",
+        required=False,
+        default=20,
+    )
+    parser.add_argument(
+        "--resume",
+        help="carry on with every unfinished run recorded under the artifacts root",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--benchmark", help="time archiving this many simulated jobs finishing at once", required=False
+    )
+    args = vars(parser.parse_args())
+
+    if args["benchmark"] is not None:
+        benchmark(int(args["benchmark"]), 1)
+        benchmark(int(args["benchmark"]), int(args["archive_limit"]))
+        sys.exit(0)
+    if args["resume"]:
+        if args["artifactsrootdir"] is None:
+            parser.error("--resume needs -a")
+        journal = MonitorJournal(args["artifactsrootdir"])
+        monitors = []
+        # one committer per machine branch, shared by the resumed runs
+        committers = {}
+        for queue in journal.unfinished_queues():
+            if queue["machine_name"] not in committers:
+                committers[queue["machine_name"]] = CommitQueue(
+                    args["artifactsrootdir"],
+                    queue["machine_name"],
+                    queue["dryrun"],
+                    int(args["commit_interval"]),
+                    int(args["commit_batch"]),
+                    json.loads(queue["options"] or "{}").get("direct", False),
+                )
+            monitors.append(
+                JobMonitor.resume(
+                    journal,
+                    queue,
+                    archive_limit=int(args["archive_limit"]),
+                    committer=committers[queue["machine_name"]],
+                )
+            )
+        print("resuming {} runs".format(len(monitors)))
+        run_all(monitors)
+        sys.exit(0)
+    if args["queue"] is None or args["testrootdir"] is None or args["artifactsrootdir"] is None:
+        parser.error("-q, -t and -a are required")
+    if args["direct"] and args["store"] is not None:
+        parser.error("the artifact store needs a checkout, it can't be used with --direct")
+    monitor = JobMonitor(
+        args["queue"],
+        args["machinename"],
+        args["scheduler"],
+        args["testrootdir"],
+        args["artifactsrootdir"],
+        args["dryrun"],
+        archive_limit=int(args["archive_limit"]),
+        journal=MonitorJournal(args["artifactsrootdir"]),
+        options={"store": args["store"], "bundle": args["bundle"], "direct": args["direct"]},
+        committer=CommitQueue(
+            args["artifactsrootdir"],
+            args["machinename"],
+            args["dryrun"],
+            int(args["commit_interval"]),
+            int(args["commit_batch"]),
+            args["direct"],
+        ),
+    )
+    monitor.run()
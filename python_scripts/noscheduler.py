@@ -6,11 +6,14 @@ class NoScheduler(scheduler):
     def __init__(self, scheduler_type):
         self.type = scheduler_type
 
-    def submitJob(self, test, subdir, mpiver, branch):
-        test.runcmd("chmod +x {}".format(test.b_filename))
+    def submitJob(self, test, job):
+        subdir = job.subdir
+        mpiver = job.mpiver
+        branch = job.branch
+        test.runcmd("chmod +x {}".format(job.b_filename), cwd=job.path)
         jobnum = 12345
-        test.runcmd("./{} {}".format(test.b_filename, jobnum))
-        monitor_cmd_build = "python3 {}/archive_results.py -j {} -b {} -m {} -s {} -t {} -a {} -M {} -B {} -d {}".format(
+        test.runcmd("./{} {}".format(job.b_filename, jobnum), cwd=job.path)
+        monitor_cmd_build = "python3 {}/archive_results.py -j {} -b {} -m {} -s {} -t {} -a {} -M {} -B {} -d {}{}".format(
             test.mypath,
             jobnum,
             subdir,
@@ -21,12 +24,13 @@ class NoScheduler(scheduler):
             mpiver,
             branch,
             test.dryrun,
+            self.archiveOptions(test),
         )
         test.runcmd("{}".format(monitor_cmd_build))
         jobnum = 12346
-        test.runcmd("chmod +x {}".format(test.t_filename))
-        test.runcmd("./{} {}".format(test.t_filename, jobnum))
-        monitor_cmd_test = "python3 {}/archive_results.py -j {} -b {} -m {} -s {} -t {} -a {} -M {} -B {} -d {}".format(
+        test.runcmd("chmod +x {}".format(job.t_filename), cwd=job.path)
+        test.runcmd("./{} {}".format(job.t_filename, jobnum), cwd=job.path)
+        monitor_cmd_test = "python3 {}/archive_results.py -j {} -b {} -m {} -s {} -t {} -a {} -M {} -B {} -d {}{}".format(
             test.mypath,
             jobnum,
             subdir,
@@ -37,17 +41,24 @@ class NoScheduler(scheduler):
             mpiver,
             branch,
             test.dryrun,
+            self.archiveOptions(test),
         )
         test.runcmd("{}".format(monitor_cmd_test))
-        test.createGetResScripts(monitor_cmd_build, monitor_cmd_test)
+        test.createGetResScripts(job, monitor_cmd_build, monitor_cmd_test)
 
-    def createHeaders(self, test):
+    def submitPacks(self, test, packs):
+        # jobs already run one after another here, nothing to pack
+        for pack in packs:
+            for job in pack:
+                self.submitJob(test, job)
+
+    def createHeaders(self, test, job):
         for headerType in ["build", "test"]:
             if headerType == "build":
-                file_out = test.fb
+                file_out = job.fb
                 jobid = 12345
             else:
-                file_out = test.ft
+                file_out = job.ft
                 jobid = 12346
             file_out.write("#!{} -l\n".format(test.bash))
             file_out.write("export JOBID={}\n".format(jobid))
@@ -0,0 +1,23 @@
+def plan_packs(jobs, capacity):
+    """Group jobs into packs whose combined core count fits in capacity.
+
+    Each job needs max(build_cores, test_cores) cores, since a pack runs its
+    builds together and later its tests together. Packs are filled first-fit
+    in decreasing order of size, and keep the original job order inside.
+    """
+    order = sorted(jobs, key=lambda job: -max(job.build_cores, job.test_cores))
+    packs = []
+    free = []
+    for job in order:
+        need = min(max(job.build_cores, job.test_cores), capacity)
+        for i in range(len(packs)):
+            if free[i] >= need:
+                packs[i].append(job)
+                free[i] -= need
+                break
+        else:
+            packs.append([job])
+            free.append(capacity - need)
+    for pack in packs:
+        pack.sort(key=jobs.index)
+    return packs
@@ -1,4 +1,5 @@
 import os
+import json
 import subprocess
 from scheduler import scheduler
 
@@ -7,71 +8,130 @@ class pbs(scheduler):
      self.type = scheduler_type
 
 
-  def createHeaders(self,test):
-    for headerType in ["build","test"]:
-      if(headerType == "build"):
-        file_out = test.fb
-      else:
-        file_out = test.ft
+  def writeHeader(self,test,file_out,name,walltime,count=None):
       file_out.write("#!/bin/sh -l\n")
-      if(headerType == "build"):
-        file_out.write("#PBS -N {}\n".format(test.b_filename))
-        file_out.write("#PBS -l walltime={}\n".format(test.build_time))
-      else:
-        file_out.write("#PBS -N {}\n".format(test.t_filename))
-      file_out.write("#PBS -l walltime={}\n".format(test.test_time))
+      file_out.write("#PBS -N {}\n".format(name))
+      if(count is not None):
+        file_out.write("#PBS -J 0-{}\n".format(count-1))
+      file_out.write("#PBS -l walltime={}\n".format(walltime))
       file_out.write("#PBS -q {}\n".format(test.queue))
       file_out.write("#PBS -A {}\n".format(test.account))
       file_out.write("#PBS -l select=1:ncpus={}:mpiprocs={}\n".format(test.cpn,test.cpn))
-      file_out.write("JOBID=\"`echo $PBS_JOBID | cut -d. -f1`\"\n\n")
-      file_out.write("cd {}\n".format(os.getcwd()))
+      # subjobs are 1234[5] to PBS, use 1234_5 so JOBID is safe in file names
+      file_out.write("if [ -n \"$PBS_ARRAY_INDEX\" ]; then\n")
+      file_out.write("  JOBID=\"`echo $PBS_JOBID | cut -d[ -f1`_$PBS_ARRAY_INDEX\"\n")
+      file_out.write("else\n")
+      file_out.write("  JOBID=\"`echo $PBS_JOBID | cut -d. -f1`\"\n")
+      file_out.write("fi\n\n")
+
+  def createHeaders(self,test,job):
+    for headerType in ["build","test"]:
+      if(headerType == "build"):
+        file_out = job.fb
+        self.writeHeader(test,file_out,job.b_filename,job.build_time)
+      else:
+        file_out = job.ft
+        self.writeHeader(test,file_out,job.t_filename,job.test_time)
+      file_out.write("cd {}\n".format(job.path))
 
-  def submitJob(self,test,subdir,mpiver,branch):
+  def arrayHeader(self,test,file_out,name,walltime,count):
+      self.writeHeader(test,file_out,name,walltime,count)
+
+  def submitBatch(self,test,options,filename,cwd):
+    batch_cmd = "qsub {}{}".format(options,filename)
+    print("Submitting with command: {}".format(batch_cmd))
+    if(test.dryrun == True):
+      return 1234
+    return subprocess.check_output(batch_cmd,shell=True,cwd=cwd).strip().decode('utf-8').split(".")[0]
+
+  def dependOption(self,jobnum):
+    return "-W depend=afterok:{} ".format(jobnum)
+
+  def submitJob(self,test,job):
     # add ssh back to the head node for archiving of results to batch scripts
 #   test.runcmd("echo \"ssh {} {}/getres-build.sh\" >> {}".format(test.headnodename,os.getcwd(),test.b_filename))
 #   test.runcmd("echo \"ssh {} {}/getres-test.sh\" >> {}".format(test.headnodename,os.getcwd(),test.t_filename))
-    batch_build = "qsub {}".format(test.b_filename)
+    batch_build = "qsub {}".format(job.b_filename)
     print(batch_build)
     if(test.dryrun == True):
       jobnum = 1234
     else:
-      jobnum= subprocess.check_output(batch_build,shell=True).strip().decode('utf-8').split(".")[0]
+      jobnum= subprocess.check_output(batch_build,shell=True,cwd=job.path).strip().decode('utf-8').split(".")[0]
     print("Submitting batch_build with command: {}, jobnum is {}".format(batch_build,jobnum))
-    monitor_cmd_build = \
-                   "python3 {}/archive_results.py -j {} -b {} -m {} -s {} -t {} -a {} -M {} -B {} -d {}".format(test.mypath,jobnum,subdir,test.machine_name,self.type,test.script_dir,test.artifacts_root,mpiver,branch,test.dryrun)
-    if(test.dryrun == True):
-      print(monitor_cmd_build)
-    else:
-      proc = subprocess.Popen(monitor_cmd_build, shell=True, stdin=None, stdout=None, stderr=None, close_fds=True)
+    monitor_cmd_build = self.startMonitor(test,jobnum,job)
     # submit the second job to be dependent on the first
 #   getrescmd = "ssh {} {}/getres-test.sh".format(test.headnodename,os.getcwd())
 #   os.system("echo {} >> {}".format(getrescmd,test.t_filename))
-    batch_test = "qsub -W depend=afterok:{} {}".format(jobnum,test.t_filename)
+    batch_test = "qsub -W depend=afterok:{} {}".format(jobnum,job.t_filename)
     print("Submitting test_batch with command: {}".format(batch_test))
     if(test.dryrun == True):
       jobnum = 1234
     else:
-      jobnum= subprocess.check_output(batch_test,shell=True).strip().decode('utf-8').split(".")[0]
-    monitor_cmd_test = \
-                   "python3 {}/archive_results.py -j {} -b {} -m {} -s {} -t {} -a {} -M {} -B {} -d {}".format(test.mypath,jobnum,subdir,test.machine_name,self.type,test.script_dir,test.artifacts_root,mpiver,branch,test.dryrun)
-    if(test.dryrun == True):
-      print(monitor_cmd_test)
-    else:
-      proc = subprocess.Popen(monitor_cmd_test, shell=True, stdin=None, stdout=None, stderr=None, close_fds=True)
-    test.createGetResScripts(monitor_cmd_build,monitor_cmd_test)
-    
-
-  def checkqueue(self,jobid):
-    if(int(jobid) < 0):
-      return True
-    queue_query = "qstat -H {} | tail -n 1 | awk -F ' +' '{{print $10}}'".format(jobid)
-    try:
-      result= subprocess.check_output(queue_query,shell=True).strip().decode('utf-8')
-      if(result == "F"): #could check for R and Q to see if it is running or waiting
-        return True
-      else:
-        return False
-    except:
-      result="done"
-      return True
-    return False
+      jobnum= subprocess.check_output(batch_test,shell=True,cwd=job.path).strip().decode('utf-8').split(".")[0]
+    monitor_cmd_test = self.startMonitor(test,jobnum,job,"test")
+    test.createGetResScripts(job,monitor_cmd_build,monitor_cmd_test)
+
+  def submitArray(self,test,jobs):
+    """One build array and one test array for all jobs. PBS can only make a
+    job depend on a whole array, so the test array starts once every build
+    has ended (afterany) and each test index checks its own build log, see
+    writeArrayScript."""
+    if(len(jobs) < 2):
+      return scheduler.submitArray(self,test,jobs)
+    self.writeManifest(test,jobs)
+    build_script = self.writeArrayScript(test,jobs,"build","PBS_ARRAY_INDEX")
+    build_array = str(self.submitBatch(test,"",build_script,test.script_dir)).split("[")[0]
+    test_script = self.writeArrayScript(test,jobs,"test","PBS_ARRAY_INDEX",build_array)
+    test_array = str(self.submitBatch(test,"-W depend=afterany:{}[] ".format(build_array),test_script,test.script_dir)).split("[")[0]
+    for index, job in enumerate(jobs):
+      monitor_cmd_build = self.startMonitor(test,"{}_{}".format(build_array,index),job)
+      monitor_cmd_test = self.startMonitor(test,"{}_{}".format(test_array,index),job,"test")
+      test.createGetResScripts(job,monitor_cmd_build,monitor_cmd_test)
+
+
+  def pbsJobid(self,jobid):
+    # array subjobs are tracked as <array>_<index>, PBS calls them <array>[<index>]
+    if("_" in jobid):
+      return "{}[{}]".format(*jobid.split("_"))
+    return jobid
+
+  def statusCommand(self,jobids):
+    return ["qstat","-x","-f","-F","json"] + [self.pbsJobid(jobid) for jobid in jobids]
+
+  def parseStatus(self,output,jobids):
+    names = {}
+    for jobid in jobids:
+      names[self.pbsJobid(jobid)] = jobid
+    states = {}
+    for name, info in json.loads(output).get("Jobs",{}).items():
+      # drop the server name, 1234.server -> 1234
+      name = name.split(".")[0]
+      if(name in names):
+        states[names[name]] = info.get("job_state","")
+    return states
+
+  def orphanCommand(self,jobids):
+    return ["qstat","-f","-F","json"] + [self.pbsJobid(jobid) for jobid in jobids]
+
+  def parseOrphans(self,output,jobids):
+    # PBS Pro deletes a job whose afterok dependency failed, but Torque and
+    # older servers leave it on a system hold
+    names = {}
+    for jobid in jobids:
+      names[self.pbsJobid(jobid)] = jobid
+    orphans = set()
+    for name, info in json.loads(output).get("Jobs",{}).items():
+      name = name.split(".")[0]
+      if(name in names and info.get("job_state") == "H" and "s" in info.get("Hold_Types","") and "depend" in info):
+        orphans.add(names[name])
+    return orphans
+
+  def cancelCommand(self,jobids):
+    return ["qdel"] + [self.pbsJobid(jobid) for jobid in jobids]
+
+  def jobRunning(self,state):
+    return state == "R"
+
+  def jobFinished(self,state):
+    #could check for R and Q to see if it is running or waiting
+    return state in ["F","X","UNKNOWN"]
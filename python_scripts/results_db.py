@@ -0,0 +1,363 @@
+import os
+import argparse
+import json
+import re
+import sqlite3
+import subprocess
+import time
+from esmf_results import TEST_INDEX, TestIndex
+from staging import exclude_from_git
+from summary_record import (
+    SUMMARY_FIELDS,
+    SummaryRecord,
+    format_row,
+    load_summary_record,
+    parse_summary_dat,
+)
+
+# columns stored besides the SUMMARY_FIELDS
+EXTRA_FIELDS = ["path", "dirbranch", "ref", "commit_id", "committed"]
+TEST_KINDS = ["unit", "system", "example", "nuopc"]
+INTEGER_FIELDS = [
+    field for field in SUMMARY_FIELDS if field.endswith(("_pass", "_fail", "_seconds"))
+] + ["committed"]
+# columns of the tests table besides the TestIndex columns
+TEST_KEY_FIELDS = ["path", "hash"]
+
+
+class BlobReader:
+    """Read many files out of a git repo through one git cat-file --batch."""
+
+    def __init__(self, repo):
+        self.proc = subprocess.Popen(
+            ["git", "cat-file", "--batch"],
+            cwd=repo,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+
+    def read_object(self, spec):
+        """(object id, type, contents) of spec, e.g. "<commit>:<path>", or
+        None if there is no such object."""
+        self.proc.stdin.write(spec.encode("utf-8") + b"\n")
+        self.proc.stdin.flush()
+        header = self.proc.stdout.readline().split()
+        if len(header) != 3:
+            return None
+        data = self.proc.stdout.read(int(header[2]))
+        self.proc.stdout.read(1)
+        return header[0].decode("ascii"), header[1].decode("ascii"), data
+
+    def read(self, spec):
+        """The contents of the blob spec, or None if there is no such blob."""
+        found = self.read_object(spec)
+        if found is None or found[1] != "blob":
+            return None
+        return found[2]
+
+    def tree(self, spec):
+        """{name: (mode, object id)} of the tree spec, or None."""
+        found = self.read_object(spec)
+        if found is None or found[1] != "tree":
+            return None
+        oid, kind, data = found
+        # binary ids as long as the hex id of the tree itself
+        size = len(oid) // 2
+        entries = {}
+        position = 0
+        while position < len(data):
+            space = data.index(b" ", position)
+            nul = data.index(b"\0", space)
+            mode = data[position:space].decode("ascii")
+            name = data[space + 1 : nul].decode("utf-8", "replace")
+            entries[name] = (mode, data[nul + 1 : nul + 1 + size].hex())
+            position = nul + 1 + size
+        return entries
+
+    def close(self):
+        self.proc.stdin.close()
+        self.proc.wait()
+
+
+class ResultsDatabase:
+    """Summaries of every archived combination, ingested from the machine
+    branches of an esmf-test-artifacts clone into an indexed SQLite file.
+
+    results has one row per combination (its outpath) and ESMF hash, with the
+    SUMMARY_FIELDS of summary_record.py; a later summary for the same pair
+    (the test results after the build results) replaces the earlier one.
+    tests has one row per test of the test_index.json next to each
+    summary, so individual failing tests can be looked up without reading
+    any Logs. refs remembers the last commit read from each branch, so
+    ingest() only walks the commits that came since.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS refs (ref TEXT PRIMARY KEY, commit_id TEXT)")
+        columns = ", ".join(
+            "{} {}".format(field, "INTEGER" if field in INTEGER_FIELDS else "TEXT")
+            for field in SUMMARY_FIELDS + EXTRA_FIELDS
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS results ({}, PRIMARY KEY (path, hash))".format(columns)
+        )
+        for columns in ["dirbranch, hash", "hash", "machine", "compiler", "mpi_flavor", "bopt"]:
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS results_{} ON results ({})".format(
+                    re.sub("[, ]+", "_", columns), columns
+                )
+            )
+        columns = ", ".join(
+            "{} {}".format(field, "INTEGER" if field in ["passed", "failed", "ranks"] else "TEXT")
+            for field in TEST_KEY_FIELDS + TestIndex.columns
+        )
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS tests ({}, PRIMARY KEY (path, hash, file))".format(columns)
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS tests_hash ON tests (hash, status)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS tests_name ON tests (name, status)")
+        self.db.commit()
+
+    def ingest(self, repo, patterns=["refs/heads"]):
+        """Read the summaries committed to the branches of repo under
+        patterns since the last ingest. Returns (summaries, commits)."""
+        refs = subprocess.check_output(
+            ["git", "for-each-ref", "--format=%(refname) %(objectname)"] + patterns, cwd=repo
+        ).decode("utf-8")
+        reader = BlobReader(repo)
+        summaries = 0
+        commits = 0
+        try:
+            for line in refs.split("\n"):
+                if not line or line.split()[0].endswith("/HEAD"):
+                    continue
+                ref, tip = line.split()
+                found, walked = self.ingest_ref(repo, reader, ref, tip)
+                summaries += found
+                commits += walked
+        finally:
+            reader.close()
+        return summaries, commits
+
+    def ingest_ref(self, repo, reader, ref, tip):
+        row = self.db.execute("SELECT commit_id FROM refs WHERE ref = ?", (ref,)).fetchone()
+        if row is not None and row["commit_id"] == tip:
+            return 0, 0
+        command = ["git", "log", "--reverse", "--format=%x01%H %ct", "--name-only"]
+        pathspec = ["--", "*/summary.json", "*/summary.dat", "*/" + TEST_INDEX]
+        log = None
+        if row is not None:
+            revisions = "{}..{}".format(row["commit_id"], tip)
+            try:
+                log = subprocess.check_output(command + [revisions] + pathspec, cwd=repo, stderr=subprocess.DEVNULL)
+            except subprocess.CalledProcessError:
+                # the branch was rewritten, read all of it again
+                log = None
+        if log is None:
+            log = subprocess.check_output(command + [tip] + pathspec, cwd=repo)
+        log = log.decode("utf-8", "replace")
+        summaries = 0
+        commits = 0
+        # each commit is "\x01<hash> <time>" followed by the files it changed
+        for entry in log.split("\x01")[1:]:
+            lines = [line for line in entry.split("\n") if line]
+            summaries += self.ingest_commit(reader, ref, lines[0].split(), lines[1:])
+            commits += 1
+        self.db.execute("INSERT OR REPLACE INTO refs (ref, commit_id) VALUES (?, ?)", (ref, tip))
+        self.db.commit()
+        return summaries, commits
+
+    def ingest_commit(self, reader, ref, commit, changed):
+        commit_id, committed = commit
+        outpaths = {}
+        indexes = []
+        for path in changed:
+            directory, name = os.path.split(path)
+            if name == TEST_INDEX:
+                indexes.append(directory)
+            # summary.json says everything summary.dat does, and more
+            elif name == "summary.json" or directory not in outpaths:
+                outpaths[directory] = name
+        found = 0
+        for directory in indexes:
+            self.ingest_tests(reader, commit_id, directory)
+        for directory, name in outpaths.items():
+            path = "{}/{}".format(directory, name)
+            data = reader.read("{}:{}".format(commit_id, path))
+            if data is None:
+                continue
+            try:
+                if name == "summary.json":
+                    record = load_summary_record(data)
+                else:
+                    record = parse_summary_dat(data.decode("utf-8", "replace"), path)
+            except ValueError:
+                continue
+            if record.hash is None:
+                continue
+            self.add(record, directory, ref, commit_id, committed)
+            found += 1
+        return found
+
+    def ingest_tests(self, reader, commit_id, directory):
+        """Replace the tests of directory at the hash of its summary.json
+        with those in its test_index.json at commit_id."""
+        summary = reader.read("{}:{}/summary.json".format(commit_id, directory))
+        data = reader.read("{}:{}/{}".format(commit_id, directory, TEST_INDEX))
+        if summary is None or data is None:
+            return
+        try:
+            build_hash = load_summary_record(summary).hash
+            index = json.loads(data)
+        except ValueError:
+            return
+        if build_hash is None:
+            return
+        self.db.execute("DELETE FROM tests WHERE path = ? AND hash = ?", (directory, build_hash))
+        columns = [index.get(column, [None] * index["rows"]) for column in TestIndex.columns]
+        rows = []
+        for values in zip(*columns):
+            values = list(values)
+            values[-1] = json.dumps(values[-1])
+            rows.append([directory, build_hash] + values)
+        fields = TEST_KEY_FIELDS + TestIndex.columns
+        self.db.executemany(
+            "INSERT OR REPLACE INTO tests ({}) VALUES ({})".format(", ".join(fields), ", ".join("?" * len(fields))),
+            rows,
+        )
+
+    def add(self, record, outpath, ref, commit_id, committed):
+        fields = SUMMARY_FIELDS + EXTRA_FIELDS
+        values = list(record) + [outpath, outpath.split("/")[0], ref, commit_id, committed]
+        self.db.execute(
+            "INSERT OR REPLACE INTO results ({}) VALUES ({})".format(
+                ", ".join(fields), ", ".join("?" * len(fields))
+            ),
+            values,
+        )
+
+    def query(
+        self,
+        machine=None,
+        compiler=None,
+        mpi=None,
+        bopt=None,
+        branch=None,
+        hash=None,
+        failed=None,
+    ):
+        """SummaryRecords matching every filter given, sorted like the
+        branch summary tables. failed is one of TEST_KINDS or "any" and keeps
+        only combinations with failures (or no results) for those tests."""
+        conditions = []
+        args = []
+        for column, value in [
+            ("machine", machine),
+            ("compiler", compiler),
+            ("mpi_flavor", mpi),
+            ("bopt", bopt),
+            ("hash", hash),
+        ]:
+            if value is not None:
+                conditions.append("{} = ?".format(column))
+                args.append(value)
+        if branch is not None:
+            conditions.append("dirbranch = ?")
+            args.append(re.sub("/", "_", branch))
+        if failed is not None:
+            kinds = TEST_KINDS if failed == "any" else [failed]
+            conditions.append(
+                "({})".format(
+                    " OR ".join(
+                        "{}_fail > 0 OR {}_pass IS NULL".format(kind, kind)
+                        for kind in kinds
+                    )
+                )
+            )
+        query = "SELECT {} FROM results".format(", ".join(SUMMARY_FIELDS))
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += " ORDER BY machine, compiler, version, mpi_flavor, mpi_version, bopt"
+        return [SummaryRecord(*row) for row in self.db.execute(query, args)]
+
+    def failing_tests(self, name=None, machine=None, branch=None, hash=None):
+        """(machine, path, hash, category, name, failed, failures) of every
+        failed test file matching the filters, from the tests table."""
+        conditions = ["tests.status = 'FAIL'"]
+        args = []
+        for column, value in [("tests.name", name), ("results.machine", machine), ("tests.hash", hash)]:
+            if value is not None:
+                conditions.append("{} = ?".format(column))
+                args.append(value)
+        if branch is not None:
+            conditions.append("results.dirbranch = ?")
+            args.append(re.sub("/", "_", branch))
+        query = (
+            "SELECT results.machine, tests.path, tests.hash, tests.category, tests.name, tests.failed, tests.failures"
+            " FROM tests JOIN results ON results.path = tests.path AND results.hash = tests.hash"
+            " WHERE {} ORDER BY tests.name, results.machine, tests.path".format(" AND ".join(conditions))
+        )
+        return [tuple(row[:-1]) + (json.loads(row[-1]),) for row in self.db.execute(query, args)]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest and query archived ESMF test summaries")
+    parser.add_argument("action", choices=["ingest", "query", "tests"])
+    parser.add_argument("-r", "--repo", help="esmf-test-artifacts clone (may be bare)", required=True)
+    parser.add_argument(
+        "-d", "--database", help="SQLite file (default: <repo>/.monitor/results.sqlite)", required=False
+    )
+    parser.add_argument(
+        "--refs",
+        help="where the machine branches are (default refs/heads, refs/remotes/origin in a plain clone)",
+        required=False,
+        default="refs/heads",
+    )
+    parser.add_argument("-m", "--machine", help="machine name", required=False)
+    parser.add_argument("-c", "--compiler", help="compiler, e.g. gfortran", required=False)
+    parser.add_argument("-p", "--mpi", help="MPI flavor, e.g. openmpi or mpiuni", required=False)
+    parser.add_argument("-o", "--bopt", help="O or g", required=False)
+    parser.add_argument("-b", "--branch", help="ESMF branch, e.g. develop", required=False)
+    parser.add_argument("-H", "--hash", help="ESMF hash as in summary.dat, e.g. v8.7.0-12-gabcdef0", required=False)
+    parser.add_argument("-t", "--test", help="test name for the tests action, e.g. ESMF_FieldUTest", required=False)
+    parser.add_argument(
+        "-f", "--failed", help="only combinations with failing tests", choices=TEST_KINDS + ["any"], required=False
+    )
+    args = vars(parser.parse_args())
+
+    database = args["database"]
+    if database is None:
+        directory = os.path.join(args["repo"], ".monitor")
+        os.makedirs(directory, exist_ok=True)
+        exclude_from_git(args["repo"], ".monitor/")
+        database = os.path.join(directory, "results.sqlite")
+    results = ResultsDatabase(database)
+    start = time.time()
+    if args["action"] == "ingest":
+        summaries, commits = results.ingest(args["repo"], args["refs"].split())
+        print("ingested {} summaries from {} commits in {:.2f}s".format(summaries, commits, time.time() - start))
+    elif args["action"] == "tests":
+        failing = results.failing_tests(args["test"], args["machine"], args["branch"], args["hash"])
+        for machine, path, build_hash, category, name, failed, failures in failing:
+            print("{}\t{}\t{}\t{} {}\tFAIL {}".format(name, machine, build_hash, category, path, failed))
+            for line in failures:
+                print("    {}".format(line))
+        print("{} failing tests in {:.3f}s".format(len(failing), time.time() - start))
+    else:
+        records = results.query(
+            args["machine"],
+            args["compiler"],
+            args["mpi"],
+            args["bopt"],
+            args["branch"],
+            args["hash"],
+            args["failed"],
+        )
+        print("\t".join(SUMMARY_FIELDS))
+        for record in records:
+            print(format_row(record), end="")
+        print("{} combinations in {:.3f}s".format(len(records), time.time() - start))
@@ -0,0 +1,220 @@
+import os
+import argparse
+import collections
+import json
+import tempfile
+import time
+from results_db import TEST_KINDS, ResultsDatabase
+from staging import exclude_from_git
+from summary_record import SUMMARY_FIELDS, SummaryRecord
+
+ResultsDiff = collections.namedtuple(
+    "ResultsDiff", ["old", "new", "failures", "fixes", "missing", "added", "incomplete", "counts"]
+)
+ResultsDiff.__doc__ = """What changed between the results of two hashes.
+
+old, new -- {combination: SummaryRecord} of each hash
+failures -- [(combination, file, name, failed, failure lines)] failing at new but not at old
+fixes -- [(combination, file, name)] failing at old and passing at new
+missing -- combinations archived at old but not at new
+added -- combinations archived at new but not at old
+incomplete -- combinations of both whose tests at new haven't finished (build only or skipped)
+counts -- [(combination, kind, (pass, fail) at old, (pass, fail) at new)] where the fail count changed
+"""
+
+# FAIL lines shown for each new failure
+SHOWN_FAILURES = 3
+
+
+def combination(path):
+    """The combination of an outpath, without the branch directory, so
+    hashes of different branches can be compared."""
+    return path.split("/", 1)[-1]
+
+
+def summaries(db, build_hash, branch):
+    conditions = "hash = ?"
+    args = [build_hash]
+    if branch is not None:
+        conditions += " AND dirbranch = ?"
+        args.append(branch.replace("/", "_"))
+    query = "SELECT path, {} FROM results WHERE {}".format(", ".join(SUMMARY_FIELDS), conditions)
+    return {combination(row[0]): (row[0], SummaryRecord(*row[1:])) for row in db.execute(query, args)}
+
+
+def failing(db, build_hash, paths):
+    """{(combination, file): (name, failed, failures)} of the failed tests of
+    build_hash in paths, read through the (hash, status) index."""
+    found = {}
+    query = "SELECT path, file, name, failed, failures FROM tests WHERE hash = ? AND status = 'FAIL'"
+    for path, file, name, failed, failures in db.execute(query, (build_hash,)):
+        if path in paths:
+            found[(combination(path), file)] = (name, failed, failures)
+    return found
+
+
+def indexed(db, path, build_hash):
+    """Whether the tests of path were indexed at build_hash."""
+    query = "SELECT 1 FROM tests WHERE path = ? AND hash = ? LIMIT 1"
+    return db.execute(query, (path, build_hash)).fetchone() is not None
+
+
+def test_status(db, path, build_hash, file):
+    row = db.execute(
+        "SELECT status FROM tests WHERE path = ? AND hash = ? AND file = ?", (path, build_hash, file)
+    ).fetchone()
+    return None if row is None else row[0]
+
+
+def diff_hashes(results, old_hash, new_hash, branch=None):
+    """The ResultsDiff of new_hash against old_hash in results, a
+    ResultsDatabase. Only the failed tests of either hash are read in full;
+    every other comparison is a set operation on the combinations or a
+    primary key lookup, so the time depends on the number of failures, not
+    on the number of tests archived."""
+    db = results.db
+    old = summaries(db, old_hash, branch)
+    new = summaries(db, new_hash, branch)
+    common = set(old) & set(new)
+    missing = sorted(set(old) - set(new))
+    added = sorted(set(new) - set(old))
+    incomplete = sorted(key for key in common if new[key][1].stage != "test")
+    compared = common - set(incomplete)
+    old_failing = failing(db, old_hash, set(old[key][0] for key in compared))
+    new_failing = failing(db, new_hash, set(new[key][0] for key in compared))
+    failures = []
+    with_index = {}
+    for key, file in sorted(set(new_failing) - set(old_failing)):
+        # a test can only be newly failing where the old hash indexed its tests
+        if key not in with_index:
+            with_index[key] = indexed(db, old[key][0], old_hash)
+        if with_index[key]:
+            name, failed, lines = new_failing[(key, file)]
+            failures.append((key, file, name, failed, json.loads(lines)[:SHOWN_FAILURES]))
+    fixes = []
+    for key, file in sorted(set(old_failing) - set(new_failing)):
+        if test_status(db, new[key][0], new_hash, file) == "PASS":
+            fixes.append((key, file, old_failing[(key, file)][0]))
+    counts = []
+    for key in sorted(compared):
+        for kind in TEST_KINDS:
+            before = (getattr(old[key][1], kind + "_pass"), getattr(old[key][1], kind + "_fail"))
+            after = (getattr(new[key][1], kind + "_pass"), getattr(new[key][1], kind + "_fail"))
+            if before[1] != after[1]:
+                counts.append((key, kind, before, after))
+    return ResultsDiff(
+        {key: old[key][1] for key in old},
+        {key: new[key][1] for key in new},
+        failures,
+        fixes,
+        missing,
+        added,
+        incomplete,
+        counts,
+    )
+
+
+def format_count(counts):
+    return "PASS {} FAIL {}".format(*["-" if count is None else count for count in counts])
+
+
+def print_diff(diff, old_hash, new_hash):
+    print(
+        "{} ({} combinations) -> {} ({} combinations)".format(old_hash, len(diff.old), new_hash, len(diff.new))
+    )
+    print("new failures: {}".format(len(diff.failures)))
+    for key, file, name, failed, lines in diff.failures:
+        print("  {}  {}  FAIL {}".format(key, file, failed))
+        for line in lines:
+            print("      {}".format(line))
+    print("fixed: {}".format(len(diff.fixes)))
+    for key, file, name in diff.fixes:
+        print("  {}  {}".format(key, file))
+    print("changed counts: {}".format(len(diff.counts)))
+    for key, kind, before, after in diff.counts:
+        print("  {}  {}: {} -> {}".format(key, kind, format_count(before), format_count(after)))
+    print("missing at {}: {}".format(new_hash, len(diff.missing)))
+    for key in diff.missing:
+        print("  {}".format(key))
+    print("new at {}: {}".format(new_hash, len(diff.added)))
+    for key in diff.added:
+        print("  {}".format(key))
+    print("tests not finished at {}: {}".format(new_hash, len(diff.incomplete)))
+    for key in diff.incomplete:
+        print("  {}  {}".format(key, diff.new[key].stage))
+
+
+def benchmark(combinations, tests):
+    """Time diff_hashes() on a synthetic database of combinations x tests
+    for each of two hashes, with a few hundred failures changing."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results = ResultsDatabase(os.path.join(tmpdir, "results.sqlite"))
+        start = time.time()
+        for number, build_hash in enumerate(["old", "new"]):
+            for index in range(combinations):
+                path = "develop/machine{}/gfortran/{}/O/openmpi/4.1".format(index % 40, index)
+                values = dict.fromkeys(SUMMARY_FIELDS)
+                values.update(hash=build_hash, stage="test", machine="machine{}".format(index % 40))
+                values.update(unit_pass=tests, unit_fail=index % 7 if number else index % 5)
+                results.add(SummaryRecord(**values), path, "refs/heads/machine", build_hash, 0)
+                rows = []
+                for test in range(tests):
+                    name = "ESMF_T{}UTest".format(test)
+                    status = "FAIL" if (test + index * (number + 1)) % 997 == 0 else "PASS"
+                    rows.append(
+                        (path, build_hash, name, "test", name + ".Log", status, 1, int(status == "FAIL"), 4, 1.0, "[]")
+                    )
+                results.db.executemany("INSERT INTO tests VALUES ({})".format(", ".join("?" * 11)), rows)
+        results.db.commit()
+        print("built {} x {} test results for two hashes in {:.1f}s".format(combinations, tests, time.time() - start))
+        start = time.time()
+        diff = diff_hashes(results, "old", "new")
+        elapsed = time.time() - start
+    print(
+        "diff: {} new failures, {} fixed, {} changed counts in {:.3f}s".format(
+            len(diff.failures), len(diff.fixes), len(diff.counts), elapsed
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the archived results of two ESMF hashes across every machine and combination"
+    )
+    parser.add_argument("old", nargs="?", help="ESMF hash to compare against, as in summary.dat")
+    parser.add_argument("new", nargs="?", help="ESMF hash to compare, e.g. the new develop tip")
+    parser.add_argument("-r", "--repo", help="esmf-test-artifacts clone (may be bare)", required=False)
+    parser.add_argument(
+        "-d", "--database", help="SQLite file (default: <repo>/.monitor/results.sqlite)", required=False
+    )
+    parser.add_argument(
+        "--refs", help="where the machine branches are (default refs/heads)", required=False, default="refs/heads"
+    )
+    parser.add_argument("-b", "--branch", help="only combinations archived for this ESMF branch", required=False)
+    parser.add_argument("--no-ingest", help="don't ingest new commits from the repo first", action="store_true")
+    parser.add_argument(
+        "--benchmark",
+        help="time a diff of COMBINATIONSxTESTS synthetic results, e.g. 500x3000",
+        required=False,
+    )
+    args = vars(parser.parse_args())
+    if args["benchmark"] is not None:
+        benchmark(*[int(count) for count in args["benchmark"].split("x")])
+    else:
+        if args["old"] is None or args["new"] is None:
+            parser.error("the old and new hashes are required")
+        if args["repo"] is None and args["database"] is None:
+            parser.error("one of --repo and --database is required")
+        database = args["database"]
+        if database is None:
+            directory = os.path.join(args["repo"], ".monitor")
+            os.makedirs(directory, exist_ok=True)
+            exclude_from_git(args["repo"], ".monitor/")
+            database = os.path.join(directory, "results.sqlite")
+        results = ResultsDatabase(database)
+        if args["repo"] is not None and not args["no_ingest"]:
+            results.ingest(args["repo"], args["refs"].split())
+        start = time.time()
+        diff = diff_hashes(results, args["old"], args["new"], args["branch"])
+        print_diff(diff, args["old"], args["new"])
+        print("compared in {:.3f}s".format(time.time() - start))
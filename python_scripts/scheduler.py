@@ -1,12 +1,423 @@
+import os
+import asyncio
+import json
+import re
+import subprocess
+import threading
+import time
+
+
+def walltime_seconds(walltime):
+    seconds = 0
+    for part in str(walltime).split(":"):
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+
 class scheduler:
+    # startMonitor is called from the submit worker threads
+    queue_lock = threading.Lock()
+    # job states from the last bulk status query, shared by every instance so
+    # all the jobs a monitor tracks cost one sacct/qstat call per interval
+    status_ttl = 30
+    status_lock = threading.Lock()
+    status_cache = {}
+
     def __init__(self, scheduler_type, test):
         pass
 
-    def createHeaders(self):
+    def createHeaders(self, test, job):
         pass
 
-    def submitJob(self):
+    def submitJob(self, test, job):
         pass
 
     def checkQueue(self):
         pass
+
+    def statusCommand(self, jobids):
+        """Return the argument list of one command reporting on all jobids,
+        or None if the scheduler has no way to query job state."""
+        return None
+
+    def parseStatus(self, output, jobids):
+        """Turn the output of statusCommand into {jobid: state}."""
+        return {}
+
+    def jobFinished(self, state):
+        return True
+
+    def jobRunning(self, state):
+        return False
+
+    def check_many(self, jobids):
+        """Return {jobid: state} for every jobid using at most one scheduler
+        query; answers younger than status_ttl seconds are reused. Jobs the
+        scheduler doesn't list (yet) are "MISSING". A query that fails or
+        can't be parsed decides nothing: the jobs it was asking about are left
+        out of the result and not cached, so they are asked about again."""
+        with scheduler.status_lock:
+            states, query = self.cached_states(jobids)
+            if query:
+                found = self.queryStatus(query)
+                if found is not None:
+                    states.update(self.cache_states(query, found))
+        return states
+
+    def cached_states(self, jobids):
+        """({jobid: state} known without asking the scheduler, [jobids to
+        query]). The status cache is shared by check_many and
+        check_many_async."""
+        states = {}
+        query = []
+        now = time.time()
+        for jobid in [str(jobid) for jobid in jobids]:
+            if jobid.startswith("-"):
+                states[jobid] = "COMPLETED"
+                continue
+            cached = scheduler.status_cache.get((self.type, jobid))
+            if cached is not None and now - cached[0] < self.status_ttl:
+                states[jobid] = cached[1]
+            else:
+                query.append(jobid)
+        return states, query
+
+    def cache_states(self, query, found):
+        """Remember what a query for the jobids in query found and return
+        {jobid: state} for all of them."""
+        now = time.time()
+        states = {}
+        for jobid in query:
+            states[jobid] = found.get(jobid, "MISSING")
+            scheduler.status_cache[(self.type, jobid)] = (now, states[jobid])
+        return states
+
+    def queryStatus(self, jobids):
+        """{jobid: state} from statusCommand, or None if it failed."""
+        cmd = self.statusCommand(jobids)
+        if cmd is None:
+            return dict((jobid, "UNKNOWN") for jobid in jobids)
+        try:
+            result = subprocess.run(cmd, stdout=subprocess.PIPE)
+        except OSError as err:
+            print("status query {} failed: {}".format(" ".join(cmd), err))
+            return None
+        return self.parseQuery(cmd, result.returncode, result.stdout, jobids)
+
+    def parseQuery(self, cmd, returncode, output, jobids):
+        # qstat exits non-zero when any one of the jobs is unknown but still
+        # reports the others, so only a failure without output counts
+        if returncode != 0 and not output.strip():
+            print("status query {} failed with exit status {}".format(" ".join(cmd), returncode))
+            return None
+        try:
+            return self.parseStatus(output.decode("utf-8"), jobids)
+        except Exception as err:
+            print("status query {} failed: {}".format(" ".join(cmd), err))
+            return None
+
+    async def check_many_async(self, jobids, timeout):
+        """check_many for an asyncio event loop: uses the same status cache,
+        runs statusCommand without blocking the loop and gives up after
+        timeout seconds. A query that fails or times out decides nothing, the
+        jobs it was asking about are left out of the result."""
+        with scheduler.status_lock:
+            states, query = self.cached_states(jobids)
+        if query:
+            found = await self.queryStatusAsync(query, timeout)
+            if found is not None:
+                with scheduler.status_lock:
+                    states.update(self.cache_states(query, found))
+        return states
+
+    async def queryStatusAsync(self, jobids, timeout):
+        """queryStatus without blocking the loop; None if it failed or timed out."""
+        cmd = self.statusCommand(jobids)
+        if cmd is None:
+            return dict((jobid, "UNKNOWN") for jobid in jobids)
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE
+            )
+        except OSError as err:
+            print("status query {} failed: {}".format(" ".join(cmd), err))
+            return None
+        try:
+            output, _ = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            print("status query {} timed out after {}s".format(" ".join(cmd), timeout))
+            return None
+        return self.parseQuery(cmd, proc.returncode, output, jobids)
+
+    def orphanCommand(self, jobids):
+        """Return the argument list of a command listing which of jobids wait
+        on a dependency that can no longer be satisfied, or None."""
+        return None
+
+    def parseOrphans(self, output, jobids):
+        return set()
+
+    def cancelCommand(self, jobids):
+        return None
+
+    async def runAsync(self, cmd, timeout):
+        """Run cmd without blocking the event loop and return its output, or
+        None if it could not be started or took longer than timeout seconds."""
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE
+            )
+        except OSError as err:
+            print("{} failed: {}".format(" ".join(cmd), err))
+            return None
+        try:
+            output, _ = await asyncio.wait_for(proc.communicate(), timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            print("{} timed out after {}s".format(" ".join(cmd), timeout))
+            return None
+        return output.decode("utf-8")
+
+    async def find_orphans_async(self, jobids, timeout):
+        """Return the jobids that can never start because a job they depend
+        on failed (e.g. a test job whose build failed)."""
+        jobids = [str(jobid) for jobid in jobids]
+        cmd = self.orphanCommand(jobids)
+        if not jobids or cmd is None:
+            return set()
+        output = await self.runAsync(cmd, timeout)
+        if output is None:
+            return set()
+        try:
+            return self.parseOrphans(output, jobids)
+        except Exception as err:
+            print("{} failed: {}".format(" ".join(cmd), err))
+            return set()
+
+    async def cancel_async(self, jobids, timeout):
+        cmd = self.cancelCommand([str(jobid) for jobid in jobids])
+        if jobids and cmd is not None:
+            print("cancelling {}".format(" ".join(cmd)))
+            await self.runAsync(cmd, timeout)
+
+    def checkqueue(self, jobid):
+        state = self.check_many([jobid]).get(str(jobid))
+        # no answer from the scheduler, ask again next time
+        if state is None:
+            return False
+        return self.jobFinished(state)
+
+    def submitArray(self, test, jobs):
+        """Submit all jobs at once; schedulers without job arrays submit them one by one."""
+        for job in jobs:
+            self.submitJob(test, job)
+
+    def archiveOptions(self, test):
+        """Command line options archive_results.py and monitor.py share."""
+        options = ""
+        if test.artifact_store is not None:
+            options += " -c {}".format(test.artifact_store)
+        if test.artifact_bundle is not None:
+            options += " -z {}".format(test.artifact_bundle)
+        if test.artifact_direct:
+            options += " -g"
+        return options
+
+    def monitorCommand(self, test, jobnum, job):
+        return "python3 {}/archive_results.py -j {} -b {} -m {} -s {} -t {} -a {} -M {} -B {} -d {}{}".format(
+            test.mypath,
+            jobnum,
+            job.subdir,
+            test.machine_name,
+            self.type,
+            test.script_dir,
+            test.artifacts_root,
+            job.mpiver,
+            job.branch,
+            test.dryrun,
+            self.archiveOptions(test),
+        )
+
+    def startMonitor(self, test, jobnum, job, stage="build"):
+        """Hand jobnum, the build or test job of job, to the run's monitor
+        (see monitor.py) and return the equivalent archive_results.py command
+        for the getres scripts."""
+        monitor_cmd = self.monitorCommand(test, jobnum, job)
+        if test.dryrun == True:
+            print(monitor_cmd)
+        else:
+            self.enqueueMonitor(
+                test.monitor_queue,
+                {
+                    "jobid": str(jobnum),
+                    "build_basename": job.subdir,
+                    "mpiversion": job.mpiver,
+                    "branch": job.branch,
+                    "stage": stage,
+                },
+            )
+        return monitor_cmd
+
+    def enqueueMonitor(self, queue_file, record):
+        with scheduler.queue_lock:
+            with open(queue_file, "a") as _file:
+                _file.write(json.dumps(record) + "\n")
+
+    def startMonitorDaemon(self, test):
+        """Start the single monitor.py process that archives every job of this run."""
+        monitor_cmd = "python3 {}/monitor.py -q {} -m {} -s {} -t {} -a {} -d {}{}".format(
+            test.mypath,
+            test.monitor_queue,
+            test.machine_name,
+            self.type,
+            test.script_dir,
+            test.artifacts_root,
+            test.dryrun,
+            self.archiveOptions(test),
+        )
+        if test.dryrun == True:
+            print(monitor_cmd)
+            return
+        log = open(re.sub(r"\.jsonl$", ".log", test.monitor_queue), "w")
+        subprocess.Popen(
+            monitor_cmd,
+            shell=True,
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            close_fds=True,
+            start_new_session=True,
+        )
+        log.close()
+
+    def stopMonitorDaemon(self, test):
+        """Tell the monitor that no more jobs are coming; it exits once the
+        tracked ones are archived."""
+        if test.dryrun != True:
+            self.enqueueMonitor(test.monitor_queue, {"end": True})
+
+    def writeArrayScripts(self, test, jobs, index_var):
+        """Write a manifest of the combinations plus build-array.bat and
+        test-array.bat in test.script_dir, see writeArrayScript."""
+        self.writeManifest(test, jobs)
+        return [self.writeArrayScript(test, jobs, stage, index_var) for stage in ["build", "test"]]
+
+    def writeManifest(self, test, jobs):
+        manifest = os.path.join(test.script_dir, "array.manifest")
+        with open(manifest, "w") as manifest_file:
+            for job in jobs:
+                manifest_file.write(
+                    "{} {} {}\n".format(job.path, job.b_filename, job.t_filename)
+                )
+        return manifest
+
+    def writeArrayScript(self, test, jobs, stage, index_var, build_array=None):
+        """Write {stage}-array.bat in test.script_dir. Array index i runs line
+        i+1 of the manifest, so the per-combination scripts stay exactly as
+        generated. The scheduler supplies the header through arrayHeader.
+
+        Given build_array, test index i only runs if build index i succeeded
+        (its build_{build_array}_{i}.log says success), for schedulers whose
+        test array can only wait for the whole build array."""
+        manifest = os.path.join(test.script_dir, "array.manifest")
+        if stage == "build":
+            walltime = max([job.build_time for job in jobs], key=walltime_seconds)
+            field = 2
+        else:
+            walltime = max([job.test_time for job in jobs], key=walltime_seconds)
+            field = 3
+        filename = os.path.join(test.script_dir, "{}-array.bat".format(stage))
+        with open(filename, "w") as file_out:
+            self.arrayHeader(test, file_out, "{}-array.bat".format(stage), walltime, len(jobs))
+            file_out.write(
+                'line=`sed -n "$(({}+1))p" {}`\n'.format(index_var, manifest)
+            )
+            file_out.write("dir=`echo $line | cut -d' ' -f1`\n")
+            file_out.write("script=`echo $line | cut -d' ' -f{}`\n".format(field))
+            file_out.write("cd $dir\n")
+            run = "{} -l ./$script > ${{script}}_$JOBID.o 2> ${{script}}_$JOBID.e\n".format(test.bash)
+            if build_array is None:
+                file_out.write(run)
+            else:
+                # the monitor archives a test that never ran as skipped
+                file_out.write(
+                    "if grep -qs success build_{}_${}.log; then\n  {}else\n".format(build_array, index_var, run)
+                )
+                file_out.write(
+                    '  echo "build {}_${} failed, not testing"\nfi\n'.format(build_array, index_var)
+                )
+        return filename
+
+    def writePackScript(self, test, pack, stage, index, build_jobnum=None):
+        """Write {stage}-pack-{index}.bat, which runs the stage script of every
+        job in the pack at once on its own range of cores. Each job still runs
+        in and logs to its own directory, so archiving is unchanged.
+
+        The build pack exits non-zero only if no job in it built, so the test
+        pack (and its afterok dependency) is dropped when there is nothing to
+        test. The test pack runs the test script of a job only if its build
+        log (build_{build_jobnum}.log) says the build succeeded; the monitor
+        archives the others as skipped."""
+        name = "{}-pack-{}.bat".format(stage, index)
+        if stage == "build":
+            walltime = max([job.build_time for job in pack], key=walltime_seconds)
+        else:
+            walltime = max([job.test_time for job in pack], key=walltime_seconds)
+        filename = os.path.join(test.script_dir, name)
+        with open(filename, "w") as file_out:
+            self.writeHeader(test, file_out, name, walltime)
+            first_core = 0
+            for job in pack:
+                cores = min(max(job.build_cores, job.test_cores), test.cpn)
+                if stage == "build":
+                    script = job.b_filename
+                else:
+                    script = job.t_filename
+                run = "(cd {} && exec taskset -c {}-{} {} -l ./{} > {}_$JOBID.o 2> {}_$JOBID.e) &\n".format(
+                    job.path,
+                    first_core,
+                    first_core + cores - 1,
+                    test.bash,
+                    script,
+                    script,
+                    script,
+                )
+                if stage == "build":
+                    file_out.write(run)
+                else:
+                    # "success" in the build log is what archive_results checks too
+                    file_out.write(
+                        "if grep -qs success {}/build_{}.log; then\n  {}fi\n".format(job.path, build_jobnum, run)
+                    )
+                first_core += cores
+            file_out.write("wait\n")
+            if stage == "build":
+                file_out.write("built=0\n")
+                for job in pack:
+                    file_out.write(
+                        "grep -qs success {}/build_$JOBID.log && built=$((built+1))\n".format(job.path)
+                    )
+                file_out.write('echo "$built of {} builds succeeded"\n'.format(len(pack)))
+                file_out.write("test $built -gt 0\n")
+            else:
+                # every job reports its own status in its logs
+                file_out.write("exit 0\n")
+        return filename
+
+    def submitPacks(self, test, packs):
+        """Submit one build job and one dependent test job per pack."""
+        for index, pack in enumerate(packs):
+            build_script = self.writePackScript(test, pack, "build", index)
+            build_jobnum = self.submitBatch(test, "", build_script, test.script_dir)
+            # the test pack looks for the build logs of the build pack
+            test_script = self.writePackScript(test, pack, "test", index, build_jobnum)
+            test_jobnum = self.submitBatch(
+                test, self.dependOption(build_jobnum), test_script, test.script_dir
+            )
+            for job in pack:
+                monitor_cmd_build = self.startMonitor(test, build_jobnum, job)
+                monitor_cmd_test = self.startMonitor(test, test_jobnum, job, "test")
+                test.createGetResScripts(job, monitor_cmd_build, monitor_cmd_test)
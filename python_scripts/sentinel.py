@@ -0,0 +1,89 @@
+import os
+import ctypes
+import ctypes.util
+import json
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+
+def sentinel_path(build_dir, jobid):
+    """The file the build and test scripts write as their very last action."""
+    return "{}/complete_{}.json".format(build_dir, jobid)
+
+
+def read_sentinel(build_dir, jobid):
+    """Return the completion record of jobid ({"jobid", "status", "start",
+    "end", "host"}) or None if the job hasn't finished."""
+    try:
+        with open(sentinel_path(build_dir, jobid)) as _file:
+            return json.load(_file)
+    except (OSError, ValueError):
+        return None
+
+
+def write_sentinel_trap(file_out, build_dir):
+    """Make a batch script write complete_$JOBID.json when it exits, whether
+    it ran to the end, a command failed or the scheduler sent SIGTERM (scancel,
+    or the grace period before a TIMEOUT kill). The file is written under a
+    temporary name and renamed so readers never see half of it. Must come
+    after JOBID is set."""
+    sentinel = sentinel_path(build_dir, "$JOBID")
+    file_out.write("esmf_start=`date +%s`\n")
+    file_out.write("esmf_sentinel() {\n")
+    file_out.write("  esmf_status=$?\n")
+    file_out.write(
+        "  printf '{{\"jobid\": \"%s\", \"status\": %d, \"start\": %s, \"end\": %s, \"host\": \"%s\"}}\\n' "
+        '"$JOBID" $esmf_status $esmf_start `date +%s` "`hostname`" > {}.tmp\n'.format(sentinel)
+    )
+    file_out.write("  mv -f {}.tmp {}\n".format(sentinel, sentinel))
+    file_out.write("}\n")
+    file_out.write("trap esmf_sentinel EXIT\n")
+    file_out.write("trap 'exit 143' TERM\n\n")
+
+
+class SentinelWatcher:
+    """Tell an event loop when a file shows up in one of the watched
+    directories: fileno() becomes readable, and drain() resets it.
+
+    Uses inotify where libc provides it. inotify only reports changes made on
+    this host, and on a shared file system the sentinels are written by the
+    compute nodes, so callers must still stat for the files they expect each
+    time they wake up; the watcher just lets a local write end a wait early.
+    """
+
+    def __init__(self):
+        self.fd = None
+        self.watched = set()
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd >= 0:
+                self.fd = fd
+        except (OSError, AttributeError):
+            self.fd = None
+
+    def watch(self, directory):
+        if self.fd is None or directory in self.watched or not os.path.isdir(directory):
+            return
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO
+        )
+        if wd >= 0:
+            self.watched.add(directory)
+
+    def fileno(self):
+        """The inotify descriptor to wait on for readability, or None."""
+        return self.fd
+
+    def drain(self):
+        if self.fd is None:
+            return
+        try:
+            # the events themselves don't matter, the caller rescans
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
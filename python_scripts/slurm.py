@@ -1,4 +1,5 @@
 import os
+import re
 import subprocess
 from scheduler import scheduler
 
@@ -8,22 +9,17 @@ class slurm(scheduler):
         self.type = scheduler_type
 
 
-  def createHeaders(self,test):
-    for headerType in ["build","test"]:
-      if(headerType == "build"):
-        file_out = test.fb
-      else:
-        file_out = test.ft
+  def writeHeader(self, test, file_out, name, walltime, count=None):
       file_out.write("#!/bin/sh -l\n")
       file_out.write("#SBATCH --account={}\n".format(test.account))
-      if(headerType == "build"):
-        file_out.write("#SBATCH -o {}_%j.o\n".format(test.b_filename))
-        file_out.write("#SBATCH -e {}_%j.e\n".format(test.b_filename))
-        file_out.write("#SBATCH --time={}\n".format(test.build_time))
+      if(count is None):
+        file_out.write("#SBATCH -o {}_%j.o\n".format(name))
+        file_out.write("#SBATCH -e {}_%j.e\n".format(name))
       else:
-        file_out.write("#SBATCH -o {}_%j.o\n".format(test.t_filename))
-        file_out.write("#SBATCH -e {}_%j.e\n".format(test.t_filename))
-        file_out.write("#SBATCH --time={}\n".format(test.test_time))
+        file_out.write("#SBATCH -o {}_%A_%a.o\n".format(name))
+        file_out.write("#SBATCH -e {}_%A_%a.e\n".format(name))
+        file_out.write("#SBATCH --array=0-{}\n".format(count - 1))
+      file_out.write("#SBATCH --time={}\n".format(walltime))
       if(test.partition != "None"):
         file_out.write("#SBATCH --partition={}\n".format(test.partition))
       if(test.cluster != "None"):
@@ -34,97 +30,142 @@ class slurm(scheduler):
       file_out.write("#SBATCH --nodes=1\n")
       file_out.write("#SBATCH --ntasks-per-node={}\n".format(test.cpn))
       file_out.write("#SBATCH --exclusive\n")
-      file_out.write("export JOBID=$SLURM_JOBID\n")
+      # array tasks are tracked by sacct as <array job>_<index>
+      file_out.write("if [ -n \"$SLURM_ARRAY_JOB_ID\" ]; then\n")
+      file_out.write("  export JOBID=${SLURM_ARRAY_JOB_ID}_${SLURM_ARRAY_TASK_ID}\n")
+      file_out.write("else\n")
+      file_out.write("  export JOBID=$SLURM_JOBID\n")
+      file_out.write("fi\n")
 
-  def submitJob(self, test, subdir, mpiver, branch):
-        batch_build = "sbatch {}".format(test.b_filename)
-        jobnum = (
-            subprocess.check_output(batch_build, shell=True)
+  def createHeaders(self,test,job):
+    for headerType in ["build","test"]:
+      if(headerType == "build"):
+        self.writeHeader(test, job.fb, job.b_filename, job.build_time)
+      else:
+        self.writeHeader(test, job.ft, job.t_filename, job.test_time)
+
+  def arrayHeader(self, test, file_out, name, walltime, count):
+      self.writeHeader(test, file_out, name, walltime, count)
+
+  def submitBatch(self, test, options, filename, cwd):
+        batch_cmd = "sbatch {}{}".format(options, filename)
+        print("Submitting with command: {}".format(batch_cmd))
+        if test.dryrun == True:
+            return 1234
+        return (
+            subprocess.check_output(batch_cmd, shell=True, cwd=cwd)
             .strip()
             .decode("utf-8")
             .split()[3]
         )
-        monitor_cmd_build = "python3 {}/archive_results.py -j {} -b {} -m {} -s {} -t {} -a {} -M {} -B {} -d {}".format(
-            test.mypath,
-            jobnum,
-            subdir,
-            test.machine_name,
-            self.type,
-            test.script_dir,
-            test.artifacts_root,
-            mpiver,
-            branch,
-            test.dryrun,
+
+  def dependOption(self, jobnum):
+        return "--depend=afterok:{} ".format(jobnum)
+
+  def submitJob(self, test, job):
+        batch_build = "sbatch {}".format(job.b_filename)
+        jobnum = (
+            subprocess.check_output(batch_build, shell=True, cwd=job.path)
+            .strip()
+            .decode("utf-8")
+            .split()[3]
         )
+        monitor_cmd_build = self.startMonitor(test, jobnum, job)
         if test.dryrun == True:
-            print(monitor_cmd_build)
             jobnum = 1234
         else:
-            proc = subprocess.Popen(
-                monitor_cmd_build,
-                shell=True,
-                stdin=None,
-                stdout=None,
-                stderr=None,
-                close_fds=True,
-            )
             # submit the second job to be dependent on the first
-            batch_test = "sbatch --depend=afterok:{} {}".format(jobnum, test.t_filename)
+            batch_test = "sbatch --depend=afterok:{} {}".format(jobnum, job.t_filename)
             print("Submitting test_batch with command: {}".format(batch_test))
             jobnum = (
-                subprocess.check_output(batch_test, shell=True)
+                subprocess.check_output(batch_test, shell=True, cwd=job.path)
                 .strip()
                 .decode("utf-8")
                 .split()[3]
             )
 
-        monitor_cmd_test = "python3 {}/archive_results.py -j {} -b {} -m {} -s {} -t {} -a {} -M {} -B {} -d {}".format(
-            test.mypath,
-            jobnum,
-            subdir,
-            test.machine_name,
-            self.type,
-            test.script_dir,
-            test.artifacts_root,
-            mpiver,
-            branch,
-            test.dryrun,
-        )
-        if test.dryrun == True:
-            print(monitor_cmd_test)
-        else:
-            proc = subprocess.Popen(
-                monitor_cmd_test,
-                shell=True,
-                stdin=None,
-                stdout=None,
-                stderr=None,
-                close_fds=True,
-            )
-        test.createGetResScripts(monitor_cmd_build, monitor_cmd_test)
-
-  def checkqueue(self, jobid):
-        if int(jobid) < 0:
-            return True
-        queue_query = (
-            "sacct -j {} | head -n 3 | tail -n 1 | awk -F ' ' '{{print $6}}'".format(
-                jobid
-            )
+        monitor_cmd_test = self.startMonitor(test, jobnum, job, "test")
+        test.createGetResScripts(job, monitor_cmd_build, monitor_cmd_test)
+
+  def submitArray(self, test, jobs):
+        """One build array and one test array for all jobs, with test index i
+        released only when build index i succeeds (aftercorr)."""
+        if len(jobs) < 2:
+            return scheduler.submitArray(self, test, jobs)
+        build_script, test_script = self.writeArrayScripts(test, jobs, "SLURM_ARRAY_TASK_ID")
+        build_array = self.submitBatch(test, "", build_script, test.script_dir)
+        test_array = self.submitBatch(
+            test, "--dependency=aftercorr:{} ".format(build_array), test_script, test.script_dir
         )
-        try:
-            result = (
-                subprocess.check_output(queue_query, shell=True).strip().decode("utf-8")
-            )
-            if (
-                (result == "COMPLETED")
-                or (result == "TIMEOUT")
-                or (result == "FAILED")
-                or (result == "CANCELLED")
-            ):  # could check for R and Q to see if it is running or waiting
-                return True
-            else:
-                return False
-        except:
-            result = "done"
-            return True
-        return False
+        for index, job in enumerate(jobs):
+            monitor_cmd_build = self.startMonitor(test, "{}_{}".format(build_array, index), job)
+            monitor_cmd_test = self.startMonitor(test, "{}_{}".format(test_array, index), job, "test")
+            test.createGetResScripts(job, monitor_cmd_build, monitor_cmd_test)
+
+  def statusCommand(self, jobids):
+        return [
+            "sacct",
+            "-j",
+            ",".join(jobids),
+            "--parsable2",
+            "--noheader",
+            "--format=JobID,State",
+        ]
+
+  def parseStatus(self, output, jobids):
+        states = {}
+        for line in output.splitlines():
+            fields = line.split("|")
+            if len(fields) < 2 or "." in fields[0]:
+                # job steps (123.batch, 123.extern) follow the job itself
+                continue
+            # "CANCELLED by 1234" -> "CANCELLED"
+            state = fields[1].split()[0] if fields[1] else ""
+            for jobid in self.arrayTasks(fields[0]):
+                states[jobid] = state
+        return states
+
+  def arrayTasks(self, jobid):
+        """The jobids of the line sacct writes for jobid: array tasks that
+        haven't started are listed together, e.g. 1234_[2-5,7%4]."""
+        match = re.match(r"^(\d+)_\[([0-9,-]+)(?:%\d+)?\]$", jobid)
+        if match is None:
+            return [jobid]
+        tasks = []
+        for part in match.group(2).split(","):
+            first, _, last = part.partition("-")
+            for index in range(int(first), int(last or first) + 1):
+                tasks.append("{}_{}".format(match.group(1), index))
+        return tasks
+
+  def orphanCommand(self, jobids):
+        return ["squeue", "-h", "-r", "-t", "PD", "-j", ",".join(jobids), "-o", "%i|%r"]
+
+  def parseOrphans(self, output, jobids):
+        orphans = set()
+        for line in output.splitlines():
+            fields = line.strip().split("|")
+            if len(fields) == 2 and fields[1] == "DependencyNeverSatisfied":
+                orphans.add(fields[0])
+        return orphans
+
+  def cancelCommand(self, jobids):
+        return ["scancel"] + jobids
+
+  def jobRunning(self, state):
+        return state == "RUNNING"
+
+  def jobFinished(self, state):
+        # could check for RUNNING and PENDING to see if it is running or waiting
+        return state in [
+            "COMPLETED",
+            "TIMEOUT",
+            "FAILED",
+            "CANCELLED",
+            "NODE_FAIL",
+            "OUT_OF_MEMORY",
+            "BOOT_FAIL",
+            "DEADLINE",
+            "PREEMPTED",
+            "UNKNOWN",
+        ]
@@ -0,0 +1,109 @@
+import os
+import ctypes
+import ctypes.util
+import errno
+import re
+import shutil
+import tempfile
+import threading
+
+AT_FDCWD = -100
+RENAME_EXCHANGE = 2
+
+
+def exclude_from_git(repo, pattern):
+    """Add pattern to repo's .git/info/exclude unless it is already there."""
+    exclude = os.path.join(repo, ".git", "info", "exclude")
+    if not os.path.isdir(os.path.dirname(exclude)):
+        return
+    with open(exclude, "a+") as _file:
+        _file.seek(0)
+        if pattern not in _file.read().split("\n"):
+            _file.write(pattern + "\n")
+
+
+def exchange(src, dest):
+    """Atomically swap two paths with renameat2(RENAME_EXCHANGE). Returns
+    False if the kernel, libc or file system can't do that."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        renameat2 = libc.renameat2
+    except (OSError, AttributeError):
+        return False
+    result = renameat2(AT_FDCWD, os.fsencode(src), AT_FDCWD, os.fsencode(dest), RENAME_EXCHANGE)
+    if result == 0:
+        return True
+    err = ctypes.get_errno()
+    if err in [errno.EINVAL, errno.ENOSYS, errno.ENOTSUP]:
+        return False
+    raise OSError(err, os.strerror(err), src)
+
+
+class StagedOutpath:
+    """Build the new contents of an artifacts outpath in a staging directory
+    and swap it in with a single rename, so nobody (a reader, or the git
+    commit of another combination) ever sees it half written.
+
+    The staging directories live in {artifacts_root}/.monitor/staging, on the
+    same file system as the outpath and ignored by git. The entries of the
+    current outpath named in carry are hard linked into the stage first, so
+    they survive without being copied; writers must replace files rather than
+    rewrite them in place (CopyEngine does). After publish() the previous
+    tree is removed in a background thread.
+
+    With link unset the carried entries are only remembered in carry, for
+    GitTreeWriter to keep from the committed tree instead.
+
+    With dryrun set (the same True ArchiveResults.runcmd checks for), path is
+    the outpath itself and nothing is created, moved or removed.
+    """
+
+    def __init__(self, artifacts_root, outpath, carry=[], dryrun=False, link=True):
+        self.outpath = outpath
+        self.carry = carry
+        self.dryrun = dryrun
+        if self.dryrun == True:
+            self.path = outpath
+            return
+        staging_root = os.path.join(artifacts_root, ".monitor", "staging")
+        os.makedirs(staging_root, exist_ok=True)
+        exclude_from_git(artifacts_root, ".monitor/")
+        prefix = re.sub("/", "_", os.path.relpath(outpath, artifacts_root)) + "."
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=staging_root)
+        if not link:
+            return
+        for name in carry:
+            source = os.path.join(outpath, name)
+            if os.path.isdir(source):
+                shutil.copytree(source, os.path.join(self.path, name), copy_function=os.link)
+            elif os.path.isfile(source):
+                os.link(source, os.path.join(self.path, name))
+
+    def makedirs(self, *names):
+        for name in names:
+            if self.dryrun == True:
+                print("would have executed mkdir -p {}/{}".format(self.path, name))
+            else:
+                os.makedirs(os.path.join(self.path, name), exist_ok=True)
+
+    def publish(self):
+        if self.dryrun == True:
+            print("would have published {}".format(self.outpath))
+            return
+        os.chmod(self.path, 0o755)
+        if not os.path.isdir(self.outpath):
+            os.makedirs(os.path.dirname(self.outpath), exist_ok=True)
+            os.rename(self.path, self.outpath)
+            return
+        if not exchange(self.path, self.outpath):
+            # two renames leave a moment with no outpath, but never a partial one
+            old = self.path + ".old"
+            os.rename(self.outpath, old)
+            os.rename(self.path, self.outpath)
+            self.path = old
+        # self.path now holds the previous tree
+        threading.Thread(target=shutil.rmtree, args=(self.path, True)).start()
+
+    def discard(self):
+        if self.dryrun != True:
+            shutil.rmtree(self.path, True)
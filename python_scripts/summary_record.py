@@ -0,0 +1,122 @@
+import os
+import collections
+import json
+import re
+
+# column order of summary.row; the first 15 are the columns of the
+# <hash>.summary tables made by branch_summary.py
+SUMMARY_FIELDS = [
+    "esmf_os",
+    "machine",
+    "compiler",
+    "version",
+    "mpi_flavor",
+    "mpi_version",
+    "bopt",
+    "unit_pass",
+    "unit_fail",
+    "system_pass",
+    "system_fail",
+    "example_pass",
+    "example_fail",
+    "nuopc_pass",
+    "nuopc_fail",
+    "branch",
+    "hash",
+    "build_time",
+    "stage",
+    "build_seconds",
+    "test_seconds",
+]
+
+SummaryRecord = collections.namedtuple("SummaryRecord", SUMMARY_FIELDS)
+
+SUMMARY_JSON = "summary.json"
+SUMMARY_ROW = "summary.row"
+
+
+def parse_counts(text):
+    """(pass, fail) from a results line like "PASS 7350 FAIL 2" or the
+    "-1 -1" of a build-only summary; (None, None) for anything else, e.g.
+    "unit tests did not complete"."""
+    text = str(text)
+    match = re.search(r"PASS\s+(-?\d+)\s+FAIL\s+(-?\d+)", text)
+    if match is None:
+        match = re.match(r"\s*(-?\d+)\s+(-?\d+)\s*$", text)
+    if match is None:
+        return None, None
+    return int(match.group(1)), int(match.group(2))
+
+
+def parse_count(value):
+    """An int for a count like 12 or "12", None for text like "skipped"."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def format_row(record):
+    """record as one tab separated line, "-" for missing values."""
+    return "\t".join("-" if value is None else str(value) for value in record) + "\n"
+
+
+def write_summary_record(outpath, record):
+    """Write record as {outpath}/summary.json and {outpath}/summary.row."""
+    with open(os.path.join(outpath, SUMMARY_JSON), "w") as _file:
+        json.dump(record._asdict(), _file, sort_keys=True)
+        _file.write("\n")
+    with open(os.path.join(outpath, SUMMARY_ROW), "w") as _file:
+        _file.write(format_row(record))
+
+
+def load_summary_record(data):
+    """The SummaryRecord in the contents of a summary.json (str or bytes);
+    fields it doesn't have are None."""
+    values = json.loads(data)
+    return SummaryRecord(*[values.get(field) for field in SUMMARY_FIELDS])
+
+
+def parse_summary_dat(text, path):
+    """The SummaryRecord of a summary.dat from before summary.json was
+    written. path is its path in the artifacts repo,
+    <branch>/<machine>/<compiler>/<version>/<bopt>/<mpi flavor>/<mpi version>/summary.dat,
+    which gives the parts the text doesn't."""
+    parts = path.split("/")[-8:-1]
+    values = dict.fromkeys(SUMMARY_FIELDS)
+    if len(parts) == 7:
+        values.update(
+            branch=parts[0],
+            machine=parts[1],
+            compiler=parts[2],
+            version=parts[3],
+            bopt=parts[4],
+            mpi_flavor=parts[5],
+            mpi_version=parts[6],
+        )
+    values["stage"] = "test"
+    for line in text.split("\n"):
+        if line.startswith("Build for = "):
+            match = re.search(r" on (\S+)(?: esmf_os: (\S+))?", line)
+            if match is not None:
+                values["machine"] = match.group(1)
+                values["esmf_os"] = match.group(2)
+        elif line.startswith("Build time = "):
+            values["build_time"] = line[len("Build time = ") :].strip()
+        elif line.startswith("git hash = "):
+            values["hash"] = line[len("git hash = ") :].strip()
+        else:
+            for name, prefix in [
+                ("unit", "unit test results"),
+                ("system", "system test results"),
+                ("example", "example test results"),
+                ("nuopc", "nuopc test results"),
+            ]:
+                if line.startswith(prefix):
+                    result = line[len(prefix) :].strip()
+                    values[name + "_pass"], values[name + "_fail"] = parse_counts(result)
+                    if result == "-1 -1":
+                        values["stage"] = "build"
+                    elif "tests skipped" in result:
+                        values["stage"] = "skipped"
+    return SummaryRecord(**values)
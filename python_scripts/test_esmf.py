@@ -6,18 +6,49 @@ import subprocess
 import sys
 import pathlib
 import argparse
+import threading
+import concurrent.futures
 from scheduler import scheduler
 from noscheduler import NoScheduler
 from pbs import pbs
 from slurm import slurm
+from mirror_cache import MirrorCache
+from packing import plan_packs
+from sentinel import write_sentinel_trap
+from archive_results import artifacts_outpath, archived_hash
 
 REPO_ESMF_TEST_ARTIFACTS = "https://github.com/esmf-org/esmf-test-artifacts.git"
 
+class BuildJob:
+  """State for one compiler/version/mpi/build type/branch combination, so
+  combinations can be prepared side by side without sharing ESMFTest attributes."""
+  def __init__(self,build_type,comp,ver,key,branch,nuopcbranch,mpidict,root):
+    self.build_type = build_type
+    self.comp = comp
+    self.ver = ver
+    self.key = key
+    self.branch = branch
+    self.nuopcbranch = nuopcbranch
+    self.mpidict = mpidict
+    subdir="{}_{}_{}_{}_{}".format(comp,ver,key,build_type,branch)
+    self.subdir = re.sub("/","_",subdir) #Some branches have a slash, so replace that with underscore
+    self.path = os.path.join(root,self.subdir)
+    self.b_filename = 'build-{}_{}_{}_{}.bat'.format(comp,ver,key,build_type)
+    self.t_filename = 'test-{}_{}_{}_{}.bat'.format(comp,ver,key,build_type)
+    mpimodule = mpidict[key]['module']
+    if(mpimodule in ["None", ""]):
+      self.mpiver = "None"
+    else:
+      self.mpiver = mpimodule.split('/')[-1]
+
 class ESMFTest:
-  def __init__(self, yaml_file, artifacts_root, workdir, dryrun):
+  def __init__(self, yaml_file, artifacts_root, workdir, dryrun, jobs=1, incremental=False, force=False):
     self.yaml_file=yaml_file
     self.artifacts_root=artifacts_root
     self.workdir=workdir
+    self.jobs=int(jobs)
+    self.incremental=incremental
+    self.force=force
     if(dryrun == "True"):
       self.dryrun = True
     else:
@@ -27,13 +58,14 @@ class ESMFTest:
     print("path is {}".format(self.mypath))
     print("calling readyaml")
     self.readYAML()
+    if(self.incremental == True and self.mirror is None):
+      print("incremental mode needs mirror-root in {} to find branch tips, rebuilding everything".format(self.yaml_file))
+      self.incremental = False
     if(self.reclone == True):
       print("recloning")
       os.system("rm -rf {}".format(self.artifacts_root))
       os.system("git clone -b {} {}".format(self.machine_name,REPO_ESMF_TEST_ARTIFACTS))
-      os.chdir("esmf-test-artifacts")
-      os.system("git checkout -b {}".format(self.machine_name))
-      os.chdir("..")
+      os.system("git -C esmf-test-artifacts checkout -b {}".format(self.machine_name))
     if(self.scheduler_type == "slurm"):
       self.scheduler=slurm("slurm")
     elif(self.scheduler_type == "None"):
@@ -62,6 +94,50 @@ class ESMFTest:
         self.https = True
       else: 
         self.https = False
+      if("git-remote" in self.machine_list):
+        self.git_remote = self.machine_list['git-remote']
+      elif(self.https == True):
+        self.git_remote = "https://github.com/esmf-org"
+      else:
+        self.git_remote = "git@github.com:esmf-org"
+      self.esmf_url = "{}/esmf".format(self.git_remote)
+      self.nuopc_url = "{}/nuopc-app-prototypes".format(self.git_remote)
+      if("mirror-root" in self.machine_list):
+        if("mirror-mode" in self.machine_list):
+          mirror_mode = self.machine_list['mirror-mode']
+        else:
+          mirror_mode = "shared"
+        self.mirror = MirrorCache(self.machine_list['mirror-root'],mirror_mode,self.dryrun)
+      else:
+        self.mirror = None
+      if("compiler-cache" in self.machine_list):
+        self.compiler_cache = self.machine_list['compiler-cache']
+      else:
+        self.compiler_cache = None
+      if("array-submit" in self.machine_list):
+        self.array_submit = self.machine_list['array-submit']
+      else:
+        self.array_submit = False
+      if("pack" in self.machine_list):
+        self.pack = self.machine_list['pack']
+      else:
+        self.pack = None
+      if("artifact-store" in self.machine_list):
+        self.artifact_store = self.machine_list['artifact-store']
+      else:
+        self.artifact_store = None
+      if("artifact-bundle" in self.machine_list):
+        self.artifact_bundle = self.machine_list['artifact-bundle']
+      else:
+        self.artifact_bundle = None
+      if("artifact-direct" in self.machine_list):
+        self.artifact_direct = self.machine_list['artifact-direct']
+      else:
+        self.artifact_direct = False
+      if("persistent-trees" in self.machine_list):
+        self.persistent = self.machine_list['persistent-trees']
+      else:
+        self.persistent = False
       if("bash" in self.machine_list):
         self.bash = self.machine_list['bash']
       else: 
@@ -95,6 +171,17 @@ class ESMFTest:
       self.build_types = ['O','g']
 #     self.build_types = ['O']
       self.script_dir=os.getcwd()
+      # one monitor process per run archives every job, see monitor.py
+      self.monitor_queue = os.path.join(self.script_dir,"monitor-queue-{}.jsonl".format(time.strftime("%Y%m%d-%H%M%S")))
+      # per-stage caps on how many combinations may clone, generate scripts
+      # or talk to the scheduler at the same time
+      self.stage_limits = {"clone": self.jobs, "generate": self.jobs, "submit": self.jobs}
+      if("stage-limits" in self.machine_list):
+        for stage in self.machine_list['stage-limits']:
+          self.stage_limits[stage] = int(self.machine_list['stage-limits'][stage])
+      self.stage_locks = {}
+      for stage in self.stage_limits:
+        self.stage_locks[stage] = threading.BoundedSemaphore(self.stage_limits[stage])
       if("cluster" in self.machine_list):
         self.cluster=self.machine_list['cluster']
       else:
@@ -121,38 +208,69 @@ class ESMFTest:
 #           subdir="{}_{}_{}_{}".format(comp,ver,key,build_type)
 #           print("{}".format(subdir))
 
-  def runcmd(self,cmd):
+  def runcmd(self,cmd,cwd=None):
     if(self.dryrun == True):
        print("would have executed {}".format(cmd))
     else:
        print("running {}\n".format(cmd))
-       os.system(cmd)
+       subprocess.call(cmd,shell=True,cwd=cwd)
 
-  def updateRepo(self,subdir,branch,nuopcbranch):
+  def refreshRepo(self,path,url,branch):
+     """Bring an existing checkout at path to the tip of branch, keeping build products."""
+     if(self.mirror is not None):
+       source = self.mirror.ensure(url)
+     else:
+       source = "origin"
+     self.runcmd("git fetch --tags {} {}".format(source,branch),cwd=path)
+     self.runcmd("git reset --hard FETCH_HEAD",cwd=path)
+
+  def updateRepo(self,job):
+     subdir = job.path
+     if(self.persistent == True and os.path.exists(os.path.join(subdir,".git"))):
+       # keep obj, mod and lib so make only rebuilds what changed, but drop
+       # anything the archiver would otherwise pick up from the last run
+       self.refreshRepo(subdir,self.esmf_url,job.branch)
+       self.runcmd("rm -rf *.o *.e *bat.o* *bat.e* *.log DEFAULTINSTALLDIR",cwd=subdir)
+       self.runcmd("find test examples \\( -name '*.Log' -o -name '*.stdout' -o -name '*results' \\) -delete 2>/dev/null",cwd=subdir)
+       nuopcdir = os.path.join(subdir,"nuopc-app-prototypes")
+       if(os.path.exists(os.path.join(nuopcdir,".git"))):
+         self.refreshRepo(nuopcdir,self.nuopc_url,job.nuopcbranch)
+         return
+       os.system("rm -rf {}".format(nuopcdir))
+       if(self.mirror is not None):
+         self.mirror.checkout(self.nuopc_url,job.nuopcbranch,nuopcdir)
+       else:
+         self.runcmd("git clone -b {} {}".format(job.nuopcbranch,self.nuopc_url),cwd=subdir)
+       return
      os.system("rm -rf {}".format(subdir))
+     if(self.mirror is not None):
+       self.mirror.checkout(self.esmf_url,job.branch,subdir)
+       if(self.dryrun == True):
+         os.makedirs(subdir,exist_ok=True)
+       self.runcmd("rm -rf obj mod lib examples test *.o *.e *bat.o* *bat.e*",cwd=subdir)
+       self.mirror.checkout(self.nuopc_url,job.nuopcbranch,os.path.join(subdir,"nuopc-app-prototypes"))
+       return
      if(not(os.path.isdir(subdir))):
-       if(self.https == True):
-         cmdstring = "git clone -b {} https://github.com/esmf-org/esmf {}".format(branch,subdir)
-         nuopcclone = "git clone -b {} https://github.com/esmf-org/nuopc-app-prototypes".format(nuopcbranch)
-       else:
-         cmdstring = "git clone -b {} git@github.com:esmf-org/esmf {}".format(branch,subdir)
-         nuopcclone = "git clone -b {} git@github.com:esmf-org/nuopc-app-prototypes".format(nuopcbranch)
+       cmdstring = "git clone -b {} {} {}".format(job.branch,self.esmf_url,subdir)
+       nuopcclone = "git clone -b {} {}".format(job.nuopcbranch,self.nuopc_url)
        if(self.dryrun == True):
          print("would have executed {}".format(cmdstring))
          print("would have executed {}".format(nuopcclone))
-         print("would have cd'd to {}".format(subdir))
-         os.system("mkdir {}".format(subdir))
-         os.chdir(subdir)
+         os.makedirs(subdir,exist_ok=True)
        else:
          status= subprocess.check_output(cmdstring,shell=True).strip().decode('utf-8')
-         os.chdir(subdir)
-         self.runcmd("rm -rf obj mod lib examples test *.o *.e *bat.o* *bat.e*")
-         self.runcmd("git checkout {}".format(branch))
-         self.runcmd("git pull origin {}".format(branch))
-         status= subprocess.check_output(nuopcclone,shell=True).strip().decode('utf-8')
+         self.runcmd("rm -rf obj mod lib examples test *.o *.e *bat.o* *bat.e*",cwd=subdir)
+         self.runcmd("git checkout {}".format(job.branch),cwd=subdir)
+         self.runcmd("git pull origin {}".format(job.branch),cwd=subdir)
+         status= subprocess.check_output(nuopcclone,shell=True,cwd=subdir).strip().decode('utf-8')
          print("status from nuopc clone command {} was {}".format(nuopcclone,status))
      
-  def createScripts(self,build_type,comp,ver,mpidict,mpitypes,key,branch):
+  def createScripts(self,job):
+    build_type = job.build_type
+    comp = job.comp
+    ver = job.ver
+    key = job.key
+    mpidict = job.mpidict
     print("Ryan Look Here: ", mpidict)
     mpiflavor = mpidict[key]
     if(mpiflavor is not None and "pythontest" in mpiflavor):
@@ -161,16 +279,18 @@ class ESMFTest:
       headerList = ["build","test"]
     for headerType in headerList: 
       if(headerType == "build"):
-        file_out = self.fb
+        file_out = job.fb
+        write_sentinel_trap(file_out,job.path)
       elif(headerType == "test"):
-        file_out = self.ft
+        file_out = job.ft
+        write_sentinel_trap(file_out,job.path)
       else:
-        pythonscript = open("runpython.sh", "w")
+        pythonscript = open(os.path.join(job.path,"runpython.sh"), "w")
         file_out = pythonscript
         file_out.write("#!{} -l\n".format(self.bash))
-        file_out.write("cd {}\n".format(os.getcwd()))
+        file_out.write("cd {}\n".format(job.path))
         file_out.write("export ESMFMKFILE=`find $PWD/DEFAULTINSTALLDIR -iname esmf.mk`\n\n")
-        file_out.write("cd {}/src/addon/ESMPy\n".format(os.getcwd()))
+        file_out.write("cd {}/src/addon/ESMPy\n".format(job.path))
       if("unloadmodule" in self.machine_list[comp]):
         file_out.write("\nmodule unload {}\n".format(self.machine_list[comp]['unloadmodule']))
       if("modulepath" in self.machine_list):
@@ -179,9 +299,11 @@ class ESMFTest:
       if("extramodule" in self.machine_list[comp]):
         file_out.write("\nmodule load {}\n".format(self.machine_list[comp]['extramodule']))
 
-      if(mpiflavor['module'] == "None"):
-        mpiflavor['module'] = ""
-        cmdstring = "export ESMF_MPIRUN={}/src/Infrastructure/stubs/mpiuni/mpirun\n".format(os.getcwd())
+      # the yaml dicts are shared between combinations, so don't modify them here
+      mpimodule = mpiflavor['module']
+      if(mpimodule == "None"):
+        mpimodule = ""
+        cmdstring = "export ESMF_MPIRUN={}/src/Infrastructure/stubs/mpiuni/mpirun\n".format(job.path)
         file_out.write(cmdstring)
 
       if("mpi_env_vars" in mpidict[key]):
@@ -189,11 +311,11 @@ class ESMFTest:
           file_out.write("export {}\n".format(mpidict[key]['mpi_env_vars'][mpi_var]))
 
       if(self.machine_list[comp]['versions'][ver]['netcdf'] == "None" ):
-        modulecmd = "module load {} {} \n\n".format(self.machine_list[comp]['versions'][ver]['compiler'],mpiflavor['module'])
+        modulecmd = "module load {} {} \n\n".format(self.machine_list[comp]['versions'][ver]['compiler'],mpimodule)
         esmfnetcdf = "\n"
         file_out.write(modulecmd)
       else:
-        modulecmd = "module load {} {} {}\n".format(self.machine_list[comp]['versions'][ver]['compiler'],mpiflavor['module'],self.machine_list[comp]['versions'][ver]['netcdf'])
+        modulecmd = "module load {} {} {}\n".format(self.machine_list[comp]['versions'][ver]['compiler'],mpimodule,self.machine_list[comp]['versions'][ver]['netcdf'])
         esmfnetcdf = "export ESMF_NETCDF=nc-config\n\n"
         file_out.write(modulecmd)
 
@@ -220,7 +342,7 @@ class ESMFTest:
           for cmd in self.machine_list[comp]['versions'][ver]['extra_commands']:
             file_out.write("{}\n".format(self.machine_list[comp]['versions'][ver]['extra_commands'][cmd]))
 
-      cmdstring = "export ESMF_DIR={}\n".format(os.getcwd())
+      cmdstring = "export ESMF_DIR={}\n".format(job.path)
       file_out.write(cmdstring)
 
       cmdstring = "export ESMF_COMPILER={}\n".format(comp)
@@ -240,7 +362,11 @@ class ESMFTest:
 
       if(headerType == "build"):
 
-        cmdstring = "make -j {} 2>&1| tee build_$JOBID.log\n\n".format(self.cpn)
+        if(self.compiler_cache is not None):
+          self.writeCompilerCache(file_out,job)
+        if(self.persistent == True):
+          self.writeBuildFingerprint(file_out)
+        cmdstring = "make -j {} 2>&1| tee build_$JOBID.log\n\n".format(job.build_cores)
         file_out.write(cmdstring)
       elif(headerType == "test"):
         cmdstring = "make info 2>&1| tee info.log \nmake install 2>&1| tee install_$JOBID.log \nmake all_tests 2>&1| tee test_$JOBID.log \n"
@@ -248,7 +374,7 @@ class ESMFTest:
 #       file_out.write("ssh {} {}/{}/getres-int.sh\n".format(self.headnodename,self.script_dir,os.getcwd()))
         cmdstring = "export ESMFMKFILE=`find $PWD/DEFAULTINSTALLDIR -iname esmf.mk`\n"
         file_out.write(cmdstring)
-        if(mpiflavor['module'] != "None"):
+        if(mpimodule != "None"):
           cmdstring = "chmod +x runpython.sh\ncd nuopc-app-prototypes\n./testProtos.sh 2>&1| tee ../nuopc_$JOBID.log \n\n"
           file_out.write(cmdstring)
 #         file_out.write("ssh {} {}/{}/getres-int.sh\n".format(self.headnodename,self.script_dir,os.getcwd()))
@@ -262,11 +388,11 @@ class ESMFTest:
 
            cmdstring = "\ncd ../src/addon/ESMPy\n"
            file_out.write(cmdstring)
-           cmdstring = "\nexport PATH=$PATH:$HOME/.local/bin\n".format(os.getcwd())
+           cmdstring = "\nexport PATH=$PATH:$HOME/.local/bin\n"
            file_out.write(cmdstring)
            cmdstring = "python3 setup.py build 2>&1 | tee python_build.log\n".format(self.headnodename)
            file_out.write(cmdstring)
-           cmdstring = "ssh {} {}/runpython.sh 2>&1 | tee python_build.log\n".format(self.headnodename,os.getcwd())
+           cmdstring = "ssh {} {}/runpython.sh 2>&1 | tee python_build.log\n".format(self.headnodename,job.path)
            file_out.write(cmdstring)
            cmdstring = "python3 setup.py test 2>&1 | tee python_test.log\n".format(self.headnodename)
            file_out.write(cmdstring)
@@ -275,27 +401,48 @@ class ESMFTest:
            cmdstring = "python3 setup.py test_regrid_from_file 2>&1 | tee python_regrid.log\n".format(self.headnodename)
            file_out.write(cmdstring)
       file_out.close()
-      mpimodule = mpiflavor['module']
-      if(mpimodule == ""):
-        self.mpiver = "None"
-      else:
-        self.mpiver = mpiflavor['module'].split('/')[-1]
 
-  def createGetResScripts(self,monitor_cmd_build,monitor_cmd_test):
+  def writeCompilerCache(self,file_out,job):
+    """Route ESMF's Fortran and C++ compiles through compiler_cache.py."""
+    file_out.write("export COMPILER_CACHE_DIR={}\n".format(self.compiler_cache['dir']))
+    if("max-size" in self.compiler_cache):
+      file_out.write("export COMPILER_CACHE_MAXSIZE={}\n".format(self.compiler_cache['max-size']))
+    file_out.write("export COMPILER_CACHE_STATS={}/compiler-cache-stats.json\n".format(job.path))
+    file_out.write("rm -f $COMPILER_CACHE_STATS\n")
+    # ask ESMF which compilers it would use, then put the launcher in front of them
+    file_out.write("make info > compiler-info.log 2>&1\n")
+    for var in ["ESMF_F90COMPILER","ESMF_CXXCOMPILER"]:
+      file_out.write("real_compiler=`awk '$1 == \"{}:\" {{print $2; exit}}' compiler-info.log`\n".format(var))
+      file_out.write("if [ -n \"$real_compiler\" ]; then export {}=\"python3 {}/compiler_cache.py $real_compiler\"; fi\n".format(var,self.mypath))
+    file_out.write("\n")
+
+  def writeBuildFingerprint(self,file_out):
+    """The tree is reused between runs, so only start over (make clean) when
+    the compiler/module environment differs from the one that built it."""
+    file_out.write("fingerprint=`(cat module-build.log; env | grep ^ESMF_ | sort) | cksum`\n")
+    file_out.write("if [ \"$fingerprint\" != \"`cat .build-fingerprint 2>/dev/null`\" ]; then\n")
+    file_out.write("  make clean 2>&1| tee clean_$JOBID.log\n")
+    file_out.write("fi\n")
+    file_out.write("echo \"$fingerprint\" > .build-fingerprint\n")
+
+  def createGetResScripts(self,job,monitor_cmd_build,monitor_cmd_test):
     # write these out no matter what, so we can run them manually, if necessary
-    get_res_file = open("getres-build.sh", "w")
+    get_res_path = os.path.join(job.path,"getres-build.sh")
+    get_res_file = open(get_res_path, "w")
     get_res_file.write("#!{} -l\n".format(self.bash))
     get_res_file.write("{} >& build-res.log &\n".format(monitor_cmd_build))
     get_res_file.close() 
-    os.system("chmod +x getres-build.sh")      
+    os.chmod(get_res_path,0o755)
 
-    get_res_file = open("getres-test.sh", "w")
+    get_res_path = os.path.join(job.path,"getres-test.sh")
+    get_res_file = open(get_res_path, "w")
     get_res_file.write("#!{} -l\n".format(self.bash))
     get_res_file.write("{} >& test-res.log &\n".format(monitor_cmd_test))
     get_res_file.close()
-    os.system("chmod +x getres-test.sh")      
+    os.chmod(get_res_path,0o755)
 
-  def createJobCardsAndSubmit(self):
+  def combinations(self):
+      jobs = []
       for build_type in self.build_types:
         for comp in self.machine_list['compiler']:
          for ver in self.machine_list[comp]['versions']:
@@ -304,36 +451,99 @@ class ESMFTest:
             mpitypes= mpidict.keys()
             print(self.machine_list[comp]['versions'][ver])
             for key in mpitypes:
-              if('build_time' in self.machine_list[comp]):
-                self.build_time = self.machine_list[comp]['build_time']
-              else:
-                self.build_time = "1:00:00"
-              if('test_time' in self.machine_list[comp]):
-                self.test_time = self.machine_list[comp]['test_time']
-              else:
-                self.test_time = "1:00:00"
               for branch in self.machine_list['branch']:
                 if("nuopcbranch" in self.machine_list):
                   nuopcbranch = self.machine_list['nuopcbranch']
                 else: 
                   nuopcbranch = branch
-                subdir="{}_{}_{}_{}_{}".format(comp,ver,key,build_type,branch)
-                subdir = re.sub("/","_",subdir) #Some branches have a slash, so replace that with underscore
-                if(self.https == True):
-                  cmdstring = "git clone -b {} https://github.com/esmf-org/esmf {}".format(branch,subdir)
-                  nuopcclone = "git clone -b {} https://github.com/esmf-org/nuopc-app-prototypes".format(nuopcbranch)
+                job = BuildJob(build_type,comp,ver,key,branch,nuopcbranch,mpidict,self.script_dir)
+                if('build_time' in self.machine_list[comp]):
+                  job.build_time = self.machine_list[comp]['build_time']
                 else:
-                  cmdstring = "git clone -b {} git@github.com:esmf-org/esmf {}".format(branch,subdir)
-                  nuopcclone = "git clone -b {} git@github.com:esmf-org/nuopc-app-prototypes".format(nuopcbranch)
-                self.updateRepo(subdir,branch,nuopcbranch)
-                self.b_filename = 'build-{}_{}_{}_{}.bat'.format(comp,ver,key,build_type)
-                self.t_filename = 'test-{}_{}_{}_{}.bat'.format(comp,ver,key,build_type)
-                self.fb = open(self.b_filename, "w")
-                self.ft = open(self.t_filename, "w")
-                self.scheduler.createHeaders(self)
-                self.createScripts(build_type,comp,ver,mpidict,mpitypes,key,branch)
-                self.scheduler.submitJob(self,subdir,self.mpiver,branch)
-                os.chdir("..")
+                  job.build_time = "1:00:00"
+                if('test_time' in self.machine_list[comp]):
+                  job.test_time = self.machine_list[comp]['test_time']
+                else:
+                  job.test_time = "1:00:00"
+                # cores each combination gets when several share a node
+                job.build_cores = self.cpn
+                job.test_cores = self.cpn
+                if(self.pack is not None):
+                  for stage in ["build","test"]:
+                    if("{}-cores".format(stage) in self.machine_list[comp]):
+                      cores = self.machine_list[comp]["{}-cores".format(stage)]
+                    elif("{}-cores".format(stage) in self.pack):
+                      cores = self.pack["{}-cores".format(stage)]
+                    else:
+                      cores = self.cpn
+                    setattr(job,"{}_cores".format(stage),int(cores))
+                jobs.append(job)
+      return jobs
+
+  def isUnchanged(self,job):
+      """True if the archived results for job were made from the current branch tip."""
+      outpath = artifacts_outpath(self.artifacts_root,job.branch,self.machine_name,job.subdir,job.mpiver)
+      if(self.artifact_direct):
+        last_hash = archived_hash(outpath,self.artifacts_root,self.machine_name)
+      else:
+        last_hash = archived_hash(outpath)
+      if(last_hash is None):
+        return False
+      tip_hash = self.mirror.describe(self.esmf_url,job.branch)
+      print("{}: archived hash {}, {} tip {}".format(job.subdir,last_hash,job.branch,tip_hash))
+      return last_hash == tip_hash
+
+  def prepareAndSubmit(self,job):
+      if(self.incremental == True and self.force == False and self.isUnchanged(job)):
+        print("skipping {}, {} has not moved since it was last archived".format(job.subdir,job.branch))
+        return False
+      with self.stage_locks["clone"]:
+        self.updateRepo(job)
+      with self.stage_locks["generate"]:
+        job.fb = open(os.path.join(job.path,job.b_filename), "w")
+        job.ft = open(os.path.join(job.path,job.t_filename), "w")
+        self.scheduler.createHeaders(self,job)
+        self.createScripts(job)
+      if(self.array_submit == True or self.pack is not None):
+        return True # submitted together once every combination is ready
+      with self.stage_locks["submit"]:
+        self.scheduler.submitJob(self,job)
+      return True
+
+  def createJobCardsAndSubmit(self):
+      jobs = self.combinations()
+      start = time.time()
+      if(self.scheduler_type != "None"):
+        self.scheduler.startMonitorDaemon(self)
+      if(self.mirror is not None):
+        # fetch each mirror once up front rather than in whichever worker gets there first
+        self.mirror.ensure(self.esmf_url)
+        self.mirror.ensure(self.nuopc_url)
+      print("preparing {} combinations with {} workers, stage limits {}".format(len(jobs),self.jobs,self.stage_limits))
+      with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as pool:
+        futures = {}
+        for job in jobs:
+          futures[pool.submit(self.prepareAndSubmit,job)] = job
+        prepared = []
+        for future in concurrent.futures.as_completed(futures):
+          try:
+            if(future.result() == True):
+              prepared.append(futures[future])
+          except Exception as err:
+            print("preparing {} failed: {}".format(futures[future].subdir,err))
+      # keep the manifest and packs in the same order on every run
+      prepared.sort(key=jobs.index)
+      if(self.pack is not None):
+        packs = plan_packs(prepared,self.cpn)
+        print("packing {} combinations into {} node allocations".format(len(prepared),len(packs)))
+        self.scheduler.submitPacks(self,packs)
+      elif(self.array_submit == True):
+        self.scheduler.submitArray(self,prepared)
+      if(self.scheduler_type != "None"):
+        self.scheduler.stopMonitorDaemon(self)
+      print("all jobs queued after {:.1f} seconds".format(time.time()-start))
+      if(self.mirror is not None):
+        self.mirror.report()
 
     
 if __name__ == "__main__":
@@ -342,7 +552,10 @@ if __name__ == "__main__":
   parser.add_argument('-y','--yaml', help='Yaml file defining builds and testing parameters', required=True)
   parser.add_argument('-a','--artifacts', help='directory where artifacts will be placed', required=True)
   parser.add_argument('-d','--dryrun', help='directory where artifacts will be placed', required=False,default=False)
+  parser.add_argument('-j','--jobs', help='number of combinations to prepare and submit concurrently', required=False,default=1)
+  parser.add_argument('-i','--incremental', help='skip combinations whose archived hash matches the branch tip', action='store_true')
+  parser.add_argument('-f','--force', help='with --incremental, rebuild every combination anyway', action='store_true')
   args = vars(parser.parse_args())
 
-  test = ESMFTest(args['yaml'],args['artifacts'],args['workdir'],args['dryrun'])  
+  test = ESMFTest(args['yaml'],args['artifacts'],args['workdir'],args['dryrun'],args['jobs'],args['incremental'],args['force'])  
     
@@ -0,0 +1,15 @@
+import os
+import sys
+
+import pytest
+
+# the modules under test are flat scripts in python_scripts, imported by bare name
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def git_identity(monkeypatch):
+    """Let the tests commit in temporary repos without a global git config."""
+    for name in ["AUTHOR", "COMMITTER"]:
+        monkeypatch.setenv("GIT_{}_NAME".format(name), "Test")
+        monkeypatch.setenv("GIT_{}_EMAIL".format(name), "test@example.com")
@@ -0,0 +1,84 @@
+import os
+import subprocess
+import tarfile
+import threading
+import time
+
+import pytest
+
+import archive_results
+from archive_results import ArchiveResults
+from copy_engine import CopyEngine
+
+BUILD = "gfortran_10.3.0_openmpi_O_develop"
+
+
+@pytest.fixture
+def archiver(tmp_path):
+    """An ArchiveResults for the test job 7 of a build directory holding one
+    test log, bundling into an artifacts root under tmp_path."""
+    build_dir = tmp_path / "root" / BUILD
+    test_dir = build_dir / "test" / "testO" / "Linux.gfortran.64.openmpi.default"
+    test_dir.mkdir(parents=True)
+    (test_dir / "ESMF_FieldUTest.Log").write_text("PASS: field create\n")
+    (build_dir / "module-build.log").write_text("modules\n")
+    (build_dir / "info.log").write_text("info\n")
+    (build_dir / "test_7.log").write_text("test log\n")
+    subprocess.check_call(["git", "init", "-q", str(build_dir)])
+    subprocess.check_call(["git", "-C", str(build_dir), "commit", "-q", "--allow-empty", "-m", "c"])
+    subprocess.check_call(["git", "-C", str(build_dir), "tag", "v8.6.0"])
+    artifacts = tmp_path / "artifacts"
+    artifacts.mkdir()
+
+    archiver = ArchiveResults.__new__(ArchiveResults)
+    archiver.jobid = "7"
+    archiver.build_basename = BUILD
+    archiver.build_dir = str(build_dir)
+    archiver.machine_name = "hera"
+    archiver.artifacts_root = str(artifacts)
+    archiver.mpiversion = "4.1.1"
+    archiver.branch = "develop"
+    archiver.dryrun = False
+    archiver.store = None
+    archiver.bundle = "gzip"
+    archiver.direct = False
+    return archiver
+
+
+def outpath(archiver):
+    return archive_results.artifacts_outpath(
+        archiver.artifacts_root, "develop", "hera", BUILD, "4.1.1"
+    )
+
+
+def test_bundles_are_published(archiver):
+    archiver.copy_artifacts(["{}/test_7.log".format(archiver.build_dir)])
+    with tarfile.open("{}/test.tar.gz".format(outpath(archiver))) as tar:
+        assert tar.getnames() == ["ESMF_FieldUTest.Log"]
+
+
+def test_failed_copy_waits_for_bundles(archiver, monkeypatch):
+    done = threading.Event()
+
+    def slow_bundle(directory, category, *args):
+        time.sleep(0.2)
+        if category == "test":
+            done.set()
+        return 0
+
+    runs = []
+    run = CopyEngine.run
+
+    def failing_run(self):
+        # the out/ logs are copied first, fail the copy alongside the bundles
+        runs.append(self)
+        if len(runs) > 1:
+            raise OSError("disk full")
+        run(self)
+
+    monkeypatch.setattr(archive_results, "write_bundle", slow_bundle)
+    monkeypatch.setattr(CopyEngine, "run", failing_run)
+    with pytest.raises(OSError):
+        archiver.copy_artifacts(["{}/test_7.log".format(archiver.build_dir)])
+    assert done.is_set()
+    assert not os.path.isdir(outpath(archiver))
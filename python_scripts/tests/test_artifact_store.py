@@ -0,0 +1,52 @@
+import hashlib
+import os
+import threading
+
+from artifact_store import ArtifactStore, read_manifest, restore, write_manifest
+
+
+def test_put_stores_each_body_once(tmp_path):
+    store = ArtifactStore(str(tmp_path / ".cas"))
+    (tmp_path / "a.Log").write_text("PASS: one\n")
+    (tmp_path / "b.Log").write_text("PASS: one\n")
+    digest, size = store.put(str(tmp_path / "a.Log"))
+    assert digest == hashlib.sha256(b"PASS: one\n").hexdigest()
+    assert size == 10
+    assert store.put(str(tmp_path / "b.Log")) == (digest, size)
+    stored = [os.path.join(path, name) for path, dirs, names in os.walk(store.root) for name in names]
+    # no temporary files are left behind
+    assert stored == [store.path(digest)]
+    assert open(store.path(digest)).read() == "PASS: one\n"
+
+
+def test_put_reads_src_once(tmp_path):
+    store = ArtifactStore(str(tmp_path / ".cas"))
+    # a pipe can only be read once
+    fifo = str(tmp_path / "fifo")
+    os.mkfifo(fifo)
+    body = b"FAIL: two\n" * 100000
+
+    def feed():
+        with open(fifo, "wb") as _file:
+            _file.write(body)
+
+    writer = threading.Thread(target=feed)
+    writer.start()
+    digest, size = store.put(fifo)
+    writer.join()
+    assert (digest, size) == (hashlib.sha256(body).hexdigest(), len(body))
+    assert open(store.path(digest), "rb").read() == body
+
+
+def test_restore_round_trip(tmp_path):
+    artifacts = tmp_path / "artifacts"
+    outpath = artifacts / "develop" / "hera" / "gfortran"
+    outpath.mkdir(parents=True)
+    store = ArtifactStore.for_outpath(str(artifacts), str(outpath))
+    assert store.root == str(artifacts / "develop" / "hera" / ".cas")
+    (tmp_path / "ESMF_FieldUTest.Log").write_text("PASS: field\n")
+    digest, size = store.put(str(tmp_path / "ESMF_FieldUTest.Log"))
+    write_manifest(str(outpath), {"test/ESMF_FieldUTest.Log": {"hash": digest, "header": "Mon", "size": size}})
+    assert read_manifest(str(outpath))["test/ESMF_FieldUTest.Log"]["hash"] == digest
+    restore(str(outpath), str(tmp_path / "out"))
+    assert (tmp_path / "out" / "test" / "ESMF_FieldUTest.Log").read_text() == "Mon\nPASS: field\n"
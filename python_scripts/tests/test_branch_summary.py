@@ -0,0 +1,89 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from branch_summary import HEADER, branch_summary
+from summary_record import SUMMARY_FIELDS, SummaryRecord, write_summary_record
+
+HASH = "v8.6.0-1-gaaaaaaa"
+
+
+def git(repo, *args):
+    return subprocess.check_output(["git"] + list(args), cwd=str(repo)).decode("utf-8")
+
+
+def archive(repo, machine, bopt, build_hash, unit_fail=0):
+    git(repo, "checkout", "-q", machine)
+    outpath = os.path.join(str(repo), "develop", machine, "gfortran", "10.3.0", bopt, "openmpi", "4.1.1")
+    os.makedirs(outpath, exist_ok=True)
+    values = dict.fromkeys(SUMMARY_FIELDS)
+    values.update(
+        esmf_os="Linux",
+        machine=machine,
+        compiler="gfortran",
+        version="10.3.0",
+        mpi_flavor="openmpi",
+        mpi_version="4.1.1",
+        bopt=bopt,
+        unit_pass=7350,
+        unit_fail=unit_fail,
+        hash=build_hash,
+    )
+    write_summary_record(outpath, SummaryRecord(**values))
+    git(repo, "add", "-A")
+    git(
+        repo,
+        "commit",
+        "-q",
+        "-m",
+        "update for gfortran_10.3.0_openmpi_{}_develop with hash {} on {} [ci skip]".format(bopt, build_hash, machine),
+    )
+
+
+@pytest.fixture
+def repo(tmp_path):
+    """An artifacts repo with the summaries of one hash on two machine branches."""
+    repo = tmp_path / "artifacts"
+    git(tmp_path, "init", "-q", "-b", "main", str(repo))
+    git(repo, "commit", "-q", "--allow-empty", "-m", "start")
+    for machine in ["hera", "derecho"]:
+        git(repo, "branch", machine)
+    archive(repo, "hera", "O", HASH)
+    archive(repo, "hera", "g", HASH, unit_fail=2)
+    archive(repo, "derecho", "O", HASH)
+    git(repo, "checkout", "-q", "main")
+    return repo
+
+
+def summarize(repo):
+    branch_summary(str(repo), "develop", True, "refs/heads", "main", False, False, False)
+
+
+def test_writes_table_to_summary_branch(repo):
+    summarize(repo)
+    table = git(repo, "show", "main:develop/{}.summary".format(HASH)).split("\n")
+    assert table[0].split() == HEADER.split()
+    rows = [line.split() for line in table[1:] if line]
+    # sorted by host
+    assert [(row[1], row[6], row[8]) for row in rows] == [("derecho", "O", "0"), ("hera", "O", "0"), ("hera", "g", "2")]
+    assert rows[0][7:9] == ["7350", "0"]
+    assert rows[0][-1] == "-"
+    # the table was committed without touching the checkout
+    assert git(repo, "status", "--porcelain") == ""
+    assert git(repo, "log", "-1", "--format=%s", "main").startswith("update develop summaries for {}".format(HASH))
+
+
+def test_unchanged_table_is_not_committed_again(repo):
+    summarize(repo)
+    commits = git(repo, "rev-list", "--count", "main")
+    summarize(repo)
+    assert git(repo, "rev-list", "--count", "main") == commits
+
+
+def test_repo_is_required(tmp_path):
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "branch_summary.py")
+    result = subprocess.run([sys.executable, script, "develop"], cwd=str(tmp_path), stderr=subprocess.PIPE)
+    assert result.returncode == 2
+    assert b"--repo" in result.stderr
@@ -0,0 +1,74 @@
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+
+import pytest
+
+import bundle
+from bundle import HeaderedFile, write_bundle
+
+
+@pytest.fixture
+def logs(tmp_path):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "ESMF_FieldUTest.Log").write_text("PASS: create\nFAIL: destroy\n")
+    (src / "ESMF_ArrayUTest.Log").write_text("PASS: create\n" * 5000)
+    (src / "ESMF_Info.stdout").write_text("nothing to see\n")
+    out = tmp_path / "out"
+    out.mkdir()
+    return src, out
+
+
+def bundle_files(src):
+    return [str(src / name) for name in os.listdir(str(src))]
+
+
+@pytest.mark.parametrize("compression", ["gzip", "zstd"])
+def test_round_trip(logs, compression):
+    if compression == "zstd" and shutil.which("zstd") is None:
+        pytest.skip("zstd is not installed")
+    src, out = logs
+    total = write_bundle(str(out), "test", bundle_files(src), "Mon Jan  1", compression)
+    command, extension = bundle.COMPRESSORS[compression]
+    data = subprocess.check_output(command + ["-d", str(out / "test.{}".format(extension))])
+    tar_path = out / "test.tar"
+    tar_path.write_bytes(data)
+    with tarfile.open(str(tar_path)) as tar:
+        assert sorted(tar.getnames()) == sorted(os.listdir(str(src)))
+        for name in tar.getnames():
+            assert tar.extractfile(name).read().decode() == "Mon Jan  1\n" + (src / name).read_text()
+    assert total == sum(len("Mon Jan  1\n") + os.path.getsize(path) for path in bundle_files(src))
+
+
+def test_index_lists_member_status(logs):
+    src, out = logs
+    write_bundle(str(out), "test", bundle_files(src), "Mon Jan  1", "gzip")
+    index = json.loads((out / "test.index.json").read_text())
+    assert index["archive"] == "test.tar.gz"
+    statuses = dict((member["name"], member["status"]) for member in index["members"])
+    assert statuses == {"ESMF_ArrayUTest.Log": "PASS", "ESMF_FieldUTest.Log": "FAIL", "ESMF_Info.stdout": "NONE"}
+
+
+def test_missing_file_is_left_out(logs):
+    src, out = logs
+    write_bundle(str(out), "test", bundle_files(src) + [str(src / "gone.Log")], "Mon Jan  1", "gzip")
+    index = json.loads((out / "test.index.json").read_text())
+    assert len(index["members"]) == 3
+
+
+def test_zstd_falls_back_to_gzip(monkeypatch):
+    monkeypatch.setattr(bundle.shutil, "which", lambda name: None)
+    assert bundle.compressor("zstd") == bundle.COMPRESSORS["gzip"]
+
+
+def test_word_split_between_reads_is_seen(tmp_path):
+    (tmp_path / "a.Log").write_text("xxxFAIL")
+    source = HeaderedFile("h", str(tmp_path / "a.Log"))
+    # "h\nxx", "xFAI", "L"
+    while source.read(4):
+        pass
+    source.close()
+    assert source.status() == "FAIL"
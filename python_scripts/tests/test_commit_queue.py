@@ -0,0 +1,96 @@
+import os
+import subprocess
+
+import pytest
+
+from commit_queue import CommitQueue
+from staging import StagedOutpath
+
+
+def git(cwd, *args):
+    return subprocess.check_output(["git"] + list(args), cwd=str(cwd)).decode("utf-8").strip()
+
+
+@pytest.fixture
+def clones(tmp_path):
+    """A file:// remote with a hera branch and two clones of it."""
+    remote = tmp_path / "remote.git"
+    git(tmp_path, "init", "-q", "--bare", str(remote))
+    seed = tmp_path / "seed"
+    git(tmp_path, "clone", "-q", str(remote), str(seed))
+    git(seed, "checkout", "-q", "-b", "hera")
+    (seed / "README").write_text("artifacts\n")
+    git(seed, "add", "README")
+    git(seed, "commit", "-q", "-m", "start")
+    git(seed, "push", "-q", "origin", "hera")
+    ours = tmp_path / "ours"
+    theirs = tmp_path / "theirs"
+    for clone in [ours, theirs]:
+        git(tmp_path, "clone", "-q", "-b", "hera", "file://{}".format(remote), str(clone))
+    return remote, ours, theirs
+
+
+def archive(clone, outpath, text):
+    os.makedirs(str(clone / outpath), exist_ok=True)
+    (clone / outpath / "summary.dat").write_text(text)
+
+
+def test_one_commit_per_batch(clones):
+    remote, ours, theirs = clones
+    queue = CommitQueue(str(ours), "hera", False)
+    archive(ours, "develop/hera/gfortran", "gfortran\n")
+    archive(ours, "develop/hera/intel", "intel\n")
+    queue.submit(["develop/hera/gfortran"], "gfortran results", token="a")
+    queue.submit(["develop/hera/intel"], "intel results", token="b")
+    assert queue.flush() == ["a", "b"]
+    assert git(remote, "rev-list", "--count", "hera") == "2"
+    assert git(remote, "log", "-1", "--format=%B", "hera").split("\n")[-2:] == ["gfortran results", "intel results"]
+    assert queue.flush() == []
+
+
+def test_rejected_push_is_rebased_and_retried(clones):
+    remote, ours, theirs = clones
+    # another run pushed first
+    archive(theirs, "develop/hera/nag", "nag\n")
+    git(theirs, "add", "develop")
+    git(theirs, "commit", "-q", "-m", "nag results")
+    git(theirs, "push", "-q", "origin", "hera")
+
+    queue = CommitQueue(str(ours), "hera", False)
+    archive(ours, "develop/hera/gfortran", "gfortran\n")
+    queue.submit(["develop/hera/gfortran"], "gfortran results", token="a")
+    assert queue.flush() == ["a"]
+    assert not queue.unpushed
+    assert git(remote, "log", "--format=%s", "hera").split("\n") == ["gfortran results", "nag results", "start"]
+
+
+def test_direct_push_is_rewritten_on_top_of_origin(clones):
+    remote, ours, theirs = clones
+    archive(theirs, "develop/hera/nag", "nag\n")
+    git(theirs, "add", "develop")
+    git(theirs, "commit", "-q", "-m", "nag results")
+    git(theirs, "push", "-q", "origin", "hera")
+
+    queue = CommitQueue(str(ours), "hera", False, direct=True)
+    stage = StagedOutpath(str(ours), str(ours / "develop/hera/gfortran"), link=False)
+    with open(os.path.join(stage.path, "summary.dat"), "w") as _file:
+        _file.write("gfortran\n")
+    queue.submit(["develop/hera/gfortran"], "gfortran results", token="a", stage=stage)
+    assert queue.flush() == ["a"]
+    assert git(remote, "log", "--format=%s", "hera").split("\n") == ["gfortran results", "nag results", "start"]
+    assert git(remote, "show", "hera:develop/hera/gfortran/summary.dat") == "gfortran"
+    # pushed stages are removed, and the checkout has the other run's files
+    assert not os.path.exists(stage.path)
+    assert (ours / "develop/hera/nag/summary.dat").read_text() == "nag\n"
+
+
+def test_due(tmp_path):
+    queue = CommitQueue(str(tmp_path), "hera", True, interval=3600, batch=2)
+    assert not queue.due()
+    queue.submit(["a"], "a")
+    assert not queue.due()
+    queue.submit(["b"], "b")
+    assert queue.due()
+    queue.pending = queue.pending[:1]
+    queue.oldest -= 3600
+    assert queue.due()
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from compiler_cache import Invocation, cache_key, included_files
+
+SOURCE = b"""subroutine esmf_sizes(n)
+  include 'ESMF_Sizes.inc'
+  n = SIZE_MAX
+end subroutine
+"""
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    """An ESMF_DIR with a source file including a header from include/."""
+    root = tmp_path / "gfortran_10.3.0_openmpi_O_develop"
+    (root / "src").mkdir(parents=True)
+    (root / "include").mkdir()
+    (root / "src" / "sizes.F90").write_bytes(SOURCE)
+    (root / "include" / "ESMF_Sizes.inc").write_text("integer, parameter :: SIZE_MAX = 8\n")
+    monkeypatch.setenv("ESMF_DIR", str(root))
+    monkeypatch.delenv("COMPILER_CACHE_BASEDIR", raising=False)
+    monkeypatch.chdir(str(root / "src"))
+    return root
+
+
+def key(root):
+    inv = Invocation("gfortran", ["-c", "-I{}/include".format(root), "sizes.F90", "-o", "sizes.o"])
+    return cache_key(inv, SOURCE)
+
+
+def test_changing_an_include_changes_the_key(tree):
+    before = key(tree)
+    assert key(tree) == before
+    (tree / "include" / "ESMF_Sizes.inc").write_text("integer, parameter :: SIZE_MAX = 16\n")
+    assert key(tree) != before
+
+
+def test_nested_and_missing_includes(tree):
+    (tree / "include" / "ESMF_Sizes.inc").write_text("include 'ESMF_Kinds.inc'\ninclude 'absent.inc'\n")
+    (tree / "include" / "ESMF_Kinds.inc").write_text("integer, parameter :: I8 = 8\n")
+    inv = Invocation("gfortran", ["-c", "-I", str(tree / "include"), "sizes.F90"])
+    names = [name for name, digest in included_files(inv, SOURCE.decode())]
+    assert names == ["ESMF_Sizes.inc", "ESMF_Kinds.inc", "absent.inc"]
+    before = key(tree)
+    (tree / "include" / "ESMF_Kinds.inc").write_text("integer, parameter :: I8 = 4\n")
+    assert key(tree) != before
+
+
+def test_key_is_shared_across_build_trees(tree, tmp_path, monkeypatch):
+    other = tmp_path / "gfortran_10.3.0_openmpi_g_develop"
+    os.rename(str(tree), str(other))
+    monkeypatch.setenv("ESMF_DIR", str(other))
+    monkeypatch.chdir(str(other / "src"))
+    moved = key(other)
+    os.rename(str(other), str(tree))
+    monkeypatch.setenv("ESMF_DIR", str(tree))
+    monkeypatch.chdir(str(tree / "src"))
+    assert key(tree) == moved
@@ -0,0 +1,64 @@
+import os
+
+from copy_engine import CopyEngine
+
+
+def sources(tmp_path, count=20):
+    src = tmp_path / "src"
+    src.mkdir()
+    for number in range(count):
+        (src / "log{}.Log".format(number)).write_text("PASS: test {}\n".format(number) * (number + 1))
+    dest = tmp_path / "dest"
+    dest.mkdir()
+    return src, dest
+
+
+def copy(src, dest, **kwargs):
+    copier = CopyEngine(**kwargs)
+    for name in sorted(os.listdir(str(src))):
+        copier.add(str(src / name), str(dest / name), "Mon Jan  1 00:00:00 UTC 2024")
+    copier.run()
+    return copier
+
+
+def check(src, dest):
+    for name in os.listdir(str(src)):
+        assert (dest / name).read_text() == "Mon Jan  1 00:00:00 UTC 2024\n" + (src / name).read_text()
+
+
+def test_copies_with_header(tmp_path):
+    src, dest = sources(tmp_path)
+    copier = copy(src, dest, threads=4)
+    check(src, dest)
+    assert copier.files == 20
+    assert copier.bytes == sum(os.path.getsize(str(src / name)) for name in os.listdir(str(src)))
+
+
+def test_falls_back_without_sendfile(tmp_path, monkeypatch):
+    src, dest = sources(tmp_path)
+
+    def sendfile(out_fd, in_fd, offset, count):
+        # fail part way, after some bytes went out
+        os.write(out_fd, b"partial")
+        raise OSError("sendfile not supported")
+
+    monkeypatch.setattr(os, "sendfile", sendfile)
+    copier = copy(src, dest)
+    check(src, dest)
+    assert copier.files == 20
+
+
+def test_failed_file_does_not_stop_the_rest(tmp_path):
+    src, dest = sources(tmp_path, 3)
+    (src / "broken.Log").symlink_to("missing.Log")
+    copier = copy(src, dest)
+    assert copier.files == 3
+    for name in ["log0.Log", "log1.Log", "log2.Log"]:
+        assert (dest / name).read_text() == "Mon Jan  1 00:00:00 UTC 2024\n" + (src / name).read_text()
+
+
+def test_dryrun_copies_nothing(tmp_path):
+    src, dest = sources(tmp_path, 3)
+    copier = copy(src, dest, dryrun=True)
+    assert os.listdir(str(dest)) == []
+    assert copier.files == 0
@@ -0,0 +1,151 @@
+import json
+import os
+
+# imported as a module so pytest doesn't collect TestIndex, TestLogScanner
+# and test_name as tests
+import esmf_results
+from esmf_results import (
+    BLOCK_SIZE,
+    MAX_FAILURES,
+    MAX_LINE,
+    TEST_INDEX,
+    LogScanner,
+    find_esmf_os,
+    read_results,
+    scan_log,
+)
+
+
+def write(path, text):
+    with open(str(path), "w") as _file:
+        _file.write(text)
+    return str(path)
+
+
+def test_log_scanner_counts_lines(tmp_path):
+    path = write(
+        tmp_path / "unit_tests_results",
+        "ESMF_OS: Linux\n"
+        "PASS: ESMF_ArrayUTest.F90, line 100\n"
+        "PASS: ESMF_ArrayUTest.F90, line 101\n"
+        "FAIL: ESMF_FieldUTest.F90, line 7 PASS: twice on one line\n"
+        "build success\n",
+    )
+    result = scan_log(path)
+    # like grep PASS: | wc -l, the line with both counts for each
+    assert (result.passed, result.failed) == (3, 1)
+    assert result.success
+    assert result.esmf_os == "Linux"
+
+
+def test_log_scanner_lines_across_blocks():
+    scanner = LogScanner()
+    data = b"x" * (BLOCK_SIZE - 3) + b"\nPASS: one\nFAIL: two\n"
+    scanner.update(data[: BLOCK_SIZE - 1])
+    scanner.update(data[BLOCK_SIZE - 1 :])
+    scanner.finish()
+    result = scanner.result()
+    assert (result.passed, result.failed) == (1, 1)
+    assert not result.success
+    assert result.esmf_os is None
+
+
+def test_log_scanner_does_not_hold_long_lines():
+    scanner = LogScanner()
+    for number in range(10):
+        scanner.update(b"PASS: " + b"x" * MAX_LINE)
+        assert len(scanner.tail) <= MAX_LINE
+    scanner.finish()
+    assert scanner.result().passed == 10
+
+
+def test_find_esmf_os(tmp_path):
+    build = write(tmp_path / "build_1.log", "ESMF_OS:    Darwin\n")
+    test = write(tmp_path / "test_1.log", "no os here\n")
+    assert find_esmf_os([test, build]) == "Darwin"
+    assert find_esmf_os([test, str(tmp_path / "missing.log")]) == "unknown"
+
+
+def test_read_results(tmp_path):
+    write(tmp_path / "a_results", "PASS 10 FAIL 1\n")
+    write(tmp_path / "b_results", "PASS 5 FAIL 0\n")
+    assert read_results(str(tmp_path / "*_results")) == "PASS 10 FAIL 1\nPASS 5 FAIL 0"
+    assert read_results(str(tmp_path / "*_missing")) is None
+
+
+def test_test_log_scanner(tmp_path):
+    path = write(
+        tmp_path / "ESMF_ArrayUTest.Log",
+        "20210601 120000.000 INFO PET0 NUMBER_OF_PROCESSORS 4\n"
+        "20210601 120001.500 INFO PET0 PASS  Array create, ESMF_ArrayUTest.F90, line 10\n"
+        "20210601 120002.000 INFO PET0 PASSED is not a result\n"
+        "20210601 120003.000 INFO PET0 FAIL  Array get, ESMF_ArrayUTest.F90, line 20\n"
+        "20210601 120010.250 INFO PET0 Finalizing ESMF\n",
+    )
+    result = scan_log(path, esmf_results.TestLogScanner())
+    assert (result.passed, result.failed) == (1, 1)
+    assert result.status == "FAIL"
+    assert result.ranks == 4
+    assert result.elapsed == 10.25
+    assert result.failures == ["20210601 120003.000 INFO PET0 FAIL  Array get, ESMF_ArrayUTest.F90, line 20"]
+
+
+def test_test_log_scanner_elapsed_line(tmp_path):
+    path = write(tmp_path / "ESMF_Example.stdout", " PASS: example done\n Elapsed time: 3.5 seconds\n")
+    result = scan_log(path, esmf_results.TestLogScanner())
+    assert result.status == "PASS"
+    assert result.elapsed == 3.5
+    assert result.ranks is None
+
+
+def test_test_log_scanner_keeps_first_failures(tmp_path):
+    path = write(tmp_path / "ESMF_ManyUTest.Log", "".join("FAIL case {}\n".format(i) for i in range(50)))
+    result = scan_log(path, esmf_results.TestLogScanner())
+    assert result.failed == 50
+    assert len(result.failures) == MAX_FAILURES
+    assert result.failures[0] == "FAIL case 0"
+
+
+def test_test_name():
+    assert esmf_results.test_name("/x/ESMF_ArrayUTest.Log") == "ESMF_ArrayUTest"
+    assert esmf_results.test_name("/x/ESMF_ArrayUTest.stdout") == "ESMF_ArrayUTest"
+    assert esmf_results.test_name("/x/PET3.ESMF_ArrayUTest.Log") == "ESMF_ArrayUTest"
+
+
+def test_index_merges_files_of_a_test(tmp_path):
+    index = esmf_results.TestIndex()
+    files = {
+        "ESMF_ArrayUTest.Log": "PASS one\nPASS two\nFAIL three\n",
+        "ESMF_ArrayUTest.stdout": "PASS one\nPASS two\nFAIL three\n",
+        "PET0.ESMF_FieldUTest.Log": "NUMBER_OF_PROCESSORS 2\nPASS a\nPASS b\n",
+        "PET1.ESMF_FieldUTest.Log": "NUMBER_OF_PROCESSORS 2\nPASS a\nPASS b\n",
+        "ESMF_FieldUTest.stdout": "PASS a\nPASS b\n",
+        "ESMF_HelloExample.stdout": "PASS: hello\n",
+    }
+    for name, text in files.items():
+        category = "examples" if "Example" in name else "test"
+        path = write(tmp_path / name, text)
+        index.add(category, path, scan_log(path, esmf_results.TestLogScanner()))
+    rows = {(row[1], row[0]): row for row in index.rows()}
+    assert sorted(rows) == [
+        ("examples", "ESMF_HelloExample"),
+        ("test", "ESMF_ArrayUTest"),
+        ("test", "ESMF_FieldUTest"),
+    ]
+    array = dict(zip(esmf_results.TestIndex.columns, rows[("test", "ESMF_ArrayUTest")]))
+    assert array["file"] == "ESMF_ArrayUTest.Log"
+    assert (array["status"], array["passed"], array["failed"]) == ("FAIL", 2, 1)
+    assert array["failures"] == ["FAIL three"]
+    field = dict(zip(esmf_results.TestIndex.columns, rows[("test", "ESMF_FieldUTest")]))
+    assert field["file"] == "PET0.ESMF_FieldUTest.Log"
+    assert (field["status"], field["passed"], field["failed"], field["ranks"]) == ("PASS", 2, 0, 2)
+    hello = dict(zip(esmf_results.TestIndex.columns, rows[("examples", "ESMF_HelloExample")]))
+    assert (hello["file"], hello["status"], hello["passed"]) == ("ESMF_HelloExample.stdout", "PASS", 1)
+
+    index.write(str(tmp_path))
+    with open(os.path.join(str(tmp_path), TEST_INDEX)) as _file:
+        written = json.load(_file)
+    assert written["columns"] == esmf_results.TestIndex.columns
+    assert written["rows"] == 3
+    assert written["name"] == ["ESMF_HelloExample", "ESMF_ArrayUTest", "ESMF_FieldUTest"]
+    assert written["status"] == ["PASS", "FAIL", "PASS"]
@@ -0,0 +1,99 @@
+import os
+import subprocess
+
+import pytest
+
+from git_writer import GitTreeWriter
+from staging import StagedOutpath
+
+
+@pytest.fixture
+def repo(tmp_path):
+    root = tmp_path / "artifacts"
+    root.mkdir()
+    git(root, "init", "-q", "-b", "machine")
+    write(root / "README", "artifacts\n")
+    git(root, "add", "README")
+    git(root, "commit", "-q", "-m", "initial")
+    return root
+
+
+def git(root, *args):
+    return subprocess.check_output(["git"] + list(args), cwd=str(root)).decode("utf-8")
+
+
+def write(path, text):
+    with open(str(path), "w") as _file:
+        _file.write(text)
+
+
+def stage(root, outpath, files, carry=[]):
+    staged = StagedOutpath(str(root), str(root / outpath), carry, link=False)
+    for name, text in files.items():
+        os.makedirs(os.path.dirname(os.path.join(staged.path, name)), exist_ok=True)
+        write(os.path.join(staged.path, name), text)
+    return staged
+
+
+def test_commit_replaces_outpath(repo):
+    writer = GitTreeWriter(str(repo), "machine")
+    before = writer.tip()
+    outpath = "develop/machine/gfortran/10.3.0/O/openmpi/4.1.1"
+    files = writer.commit(
+        [stage(repo, outpath, {"summary.dat": "first\n", "test/ESMF_ArrayUTest.Log": "PASS\n"})],
+        "first archive",
+    )
+    assert files == 2
+    assert git(repo, "rev-parse", "machine~1").strip() == before
+    assert writer.read(outpath + "/summary.dat") == b"first\n"
+    assert writer.listdir(outpath) == ["summary.dat", "test"]
+
+    # files the stage doesn't carry are deleted, carried ones kept
+    writer.commit([stage(repo, outpath, {"summary.dat": "second\n"}, carry=["test"])], "second archive")
+    assert writer.read(outpath + "/summary.dat") == b"second\n"
+    assert writer.read(outpath + "/test/ESMF_ArrayUTest.Log") == b"PASS\n"
+    writer.commit([stage(repo, outpath, {"summary.json": "{}\n"})], "third archive")
+    assert writer.listdir(outpath) == ["summary.json"]
+    assert git(repo, "log", "--format=%s", "machine").split("\n")[:3] == [
+        "third archive",
+        "second archive",
+        "first archive",
+    ]
+
+
+def test_checkout_stays_clean(repo):
+    writer = GitTreeWriter(str(repo), "machine")
+    writer.commit([stage(repo, "develop/a", {"summary.dat": "a\n"})], "archive a")
+    writer.commit_files({"develop/b/summary.json": b"{}"}, "archive b")
+    assert git(repo, "status", "--porcelain", "--untracked-files=no") == ""
+    with open(str(repo / "develop" / "a" / "summary.dat")) as _file:
+        assert _file.read() == "a\n"
+    assert (repo / "develop" / "b" / "summary.json").is_file()
+
+
+def test_other_branch_checked_out(repo):
+    git(repo, "checkout", "-q", "-b", "main")
+    writer = GitTreeWriter(str(repo), "machine")
+    commit = writer.commit_files({"develop/summary.json": b"{}"}, "archive")
+    assert commit == git(repo, "rev-parse", "machine").strip()
+    assert git(repo, "status", "--porcelain") == ""
+    assert not (repo / "develop").exists()
+    assert writer.read("develop/summary.json") == b"{}"
+
+
+def test_new_branch_in_bare_repo(repo, tmp_path):
+    bare = tmp_path / "bare.git"
+    subprocess.check_call(["git", "clone", "-q", "--bare", str(repo), str(bare)])
+    writer = GitTreeWriter(str(bare), "other")
+    assert writer.tip() is None
+    assert writer.listdir("develop") == []
+    writer.commit_files({"develop/summary.json": b"{}"}, "first on other")
+    assert writer.read("develop/summary.json") == b"{}"
+    assert git(bare, "rev-list", "--count", "other").strip() == "1"
+
+
+def test_dryrun_commits_nothing(repo):
+    writer = GitTreeWriter(str(repo), "machine", dryrun=True)
+    before = writer.tip()
+    assert writer.commit_files({"x": b"y"}, "dry") == before
+    assert writer.tip() == before
@@ -0,0 +1,100 @@
+import os
+import subprocess
+
+import pytest
+
+from archive_results import archived_hash, artifacts_outpath
+from git_writer import GitTreeWriter
+from mirror_cache import MirrorCache
+from test_esmf import BuildJob, ESMFTest
+
+MPI = {"openmpi": {"module": "openmpi/4.1.1"}}
+
+
+def git(cwd, *args):
+    return subprocess.check_output(["git"] + list(args), cwd=str(cwd)).decode("utf-8").strip()
+
+
+def summary_dat(build_hash, unit="PASS 7350 \tFAIL 2"):
+    return (
+        "Build for = gfortran_10.3.0_openmpi_O_develop, mpi version 4.1.1 on machine esmf_os: Linux\n"
+        "Build time = 12:00:00\n"
+        "git hash = {}\n\n"
+        "unit test results   \t{}\n"
+        "system test results \t{}\n"
+        "example test results \t{}\n"
+        "nuopc test results \tPASS 0 \tFAIL 0\n\n".format(build_hash, unit, unit, unit)
+    )
+
+
+@pytest.fixture
+def esmf_test(tmp_path):
+    upstream = tmp_path / "esmf"
+    upstream.mkdir()
+    git(upstream, "init", "-q", "-b", "develop")
+    (upstream / "README").write_text("esmf\n")
+    git(upstream, "add", "README")
+    git(upstream, "commit", "-q", "-m", "initial")
+    git(upstream, "tag", "v8.2.0")
+    artifacts = tmp_path / "artifacts"
+    artifacts.mkdir()
+    git(artifacts, "init", "-q", "-b", "machine")
+    # only the attributes isUnchanged() uses; __init__ would read yaml and submit
+    test = ESMFTest.__new__(ESMFTest)
+    test.artifacts_root = str(artifacts)
+    test.machine_name = "machine"
+    test.artifact_direct = False
+    test.esmf_url = "file://{}".format(upstream)
+    test.mirror = MirrorCache(str(tmp_path / "mirrors"))
+    job = BuildJob("O", "gfortran", "10.3.0", "openmpi", "develop", "develop", MPI, str(tmp_path))
+    return test, job
+
+
+def write_summary(test, job, text):
+    outpath = artifacts_outpath(test.artifacts_root, job.branch, test.machine_name, job.subdir, job.mpiver)
+    os.makedirs(outpath, exist_ok=True)
+    with open(os.path.join(outpath, "summary.dat"), "w") as _file:
+        _file.write(text)
+    return outpath
+
+
+def test_nothing_archived(esmf_test):
+    test, job = esmf_test
+    assert not test.isUnchanged(job)
+
+
+def test_tested_at_tip_is_unchanged(esmf_test):
+    test, job = esmf_test
+    write_summary(test, job, summary_dat("v8.2.0"))
+    assert test.isUnchanged(job)
+
+
+def test_tested_at_older_hash(esmf_test):
+    test, job = esmf_test
+    write_summary(test, job, summary_dat("v8.1.0-5-g1234567"))
+    assert not test.isUnchanged(job)
+
+
+def test_build_archived_but_tests_never_ran(esmf_test):
+    test, job = esmf_test
+    outpath = write_summary(test, job, summary_dat("v8.2.0", unit="-1 -1"))
+    assert archived_hash(outpath) is None
+    assert not test.isUnchanged(job)
+
+
+def test_tests_skipped_after_failed_build(esmf_test):
+    test, job = esmf_test
+    write_summary(test, job, summary_dat("v8.2.0", unit="build failed, tests skipped"))
+    assert not test.isUnchanged(job)
+
+
+def test_direct_mode_reads_machine_branch(esmf_test):
+    test, job = esmf_test
+    test.artifact_direct = True
+    outpath = artifacts_outpath(test.artifacts_root, job.branch, test.machine_name, job.subdir, job.mpiver)
+    path = os.path.relpath(outpath, test.artifacts_root) + "/summary.dat"
+    writer = GitTreeWriter(test.artifacts_root, "machine")
+    writer.commit_files({path: summary_dat("v8.2.0", unit="-1 -1").encode("utf-8")}, "build")
+    assert not test.isUnchanged(job)
+    writer.commit_files({path: summary_dat("v8.2.0").encode("utf-8")}, "test")
+    assert test.isUnchanged(job)
@@ -0,0 +1,165 @@
+import json
+import os
+import subprocess
+
+import pytest
+
+from pbs import pbs
+from scheduler import scheduler
+from slurm import slurm
+from test_esmf import BuildJob, ESMFTest
+
+MPI = {"openmpi": {"module": "openmpi/4.1.1"}}
+
+# stand-ins for the scheduler commands: each records its arguments and
+# answers with the next job number, or prints a canned status report
+SUBMIT = """#!/bin/bash
+echo "$@" >> {log}/{name}.calls
+n=$((1000 + `wc -l < {log}/{name}.calls`))
+{answer}
+"""
+SBATCH_ANSWER = 'echo "Submitted batch job $n"'
+QSUB_ANSWER = 'if grep -q "^#PBS -J" "${{@: -1}}"; then echo "$n[].server"; else echo "$n.server"; fi'
+REPORT = """#!/bin/bash
+echo "$@" >> {log}/{name}.calls
+cat {log}/{name}.out
+"""
+
+
+@pytest.fixture
+def standins(tmp_path, monkeypatch):
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, text in [
+        ("sbatch", SUBMIT.format(log=tmp_path, name="sbatch", answer=SBATCH_ANSWER)),
+        ("qsub", SUBMIT.format(log=tmp_path, name="qsub", answer=QSUB_ANSWER.format())),
+        ("sacct", REPORT.format(log=tmp_path, name="sacct")),
+        ("qstat", REPORT.format(log=tmp_path, name="qstat")),
+    ]:
+        (bin_dir / name).write_text(text)
+        (bin_dir / name).chmod(0o755)
+    monkeypatch.setenv("PATH", "{}{}{}".format(bin_dir, os.pathsep, os.environ["PATH"]))
+    monkeypatch.setattr(scheduler, "status_cache", {})
+    return tmp_path
+
+
+def calls(standins, name):
+    return (standins / "{}.calls".format(name)).read_text().split("\n")[:-1]
+
+
+@pytest.fixture
+def run(tmp_path):
+    """An ESMFTest with just what submitArray needs, and three combinations
+    whose test scripts only leave a mark."""
+    test = ESMFTest.__new__(ESMFTest)
+    test.dryrun = False
+    test.script_dir = str(tmp_path)
+    test.mypath = str(tmp_path)
+    # scripts run as $bash -l, skip the login profile
+    test.bash = "/bin/bash --noprofile"
+    test.account = "account"
+    test.queue = "regular"
+    test.partition = test.cluster = test.constraint = "None"
+    test.cpn = 36
+    test.machine_name = "machine"
+    test.artifacts_root = str(tmp_path / "artifacts")
+    test.artifact_store = test.artifact_bundle = None
+    test.artifact_direct = False
+    test.monitor_queue = str(tmp_path / "monitor-queue.jsonl")
+    jobs = []
+    for ver in ["9.4.0", "10.3.0", "11.2.0"]:
+        job = BuildJob("O", "gfortran", ver, "openmpi", "develop", "develop", MPI, str(tmp_path))
+        job.build_time = "1:00:00"
+        job.test_time = "2:00:00"
+        os.makedirs(job.path)
+        with open(os.path.join(job.path, job.t_filename), "w") as _file:
+            _file.write("echo tested > tested\n")
+        jobs.append(job)
+    return test, jobs
+
+
+def queued(test):
+    with open(test.monitor_queue) as _file:
+        return [(record["jobid"], record["stage"]) for record in map(json.loads, _file)]
+
+
+def test_slurm_array_submission(standins, run):
+    test, jobs = run
+    slurm("slurm").submitArray(test, jobs)
+    submitted = calls(standins, "sbatch")
+    assert submitted[0].endswith("build-array.bat")
+    assert submitted[1].startswith("--dependency=aftercorr:1001 ")
+    assert submitted[1].endswith("test-array.bat")
+    assert queued(test) == [
+        ("1001_0", "build"),
+        ("1002_0", "test"),
+        ("1001_1", "build"),
+        ("1002_1", "test"),
+        ("1001_2", "build"),
+        ("1002_2", "test"),
+    ]
+    with open(os.path.join(test.script_dir, "build-array.bat")) as _file:
+        assert "#SBATCH --array=0-2\n" in _file.read()
+    with open(os.path.join(test.script_dir, "array.manifest")) as _file:
+        assert [line.split()[0] for line in _file] == [job.path for job in jobs]
+
+
+def test_pbs_array_tests_wait_for_their_own_build(standins, run):
+    test, jobs = run
+    pbs("pbs").submitArray(test, jobs)
+    submitted = calls(standins, "qsub")
+    assert submitted[1].startswith("-W depend=afterany:1001[] ")
+    assert queued(test)[:2] == [("1001_0", "build"), ("1002_0", "test")]
+    # build 0 succeeded, build 1 failed and build 2 never wrote a log
+    with open(os.path.join(jobs[0].path, "build_1001_0.log"), "w") as _file:
+        _file.write("build success\n")
+    with open(os.path.join(jobs[1].path, "build_1001_1.log"), "w") as _file:
+        _file.write("make: *** [lib] Error 2\n")
+    for index in range(3):
+        env = dict(os.environ, PBS_JOBID="1002[{}].server".format(index), PBS_ARRAY_INDEX=str(index))
+        subprocess.check_call(["bash", os.path.join(test.script_dir, "test-array.bat")], env=env)
+    assert [os.path.exists(os.path.join(job.path, "tested")) for job in jobs] == [True, False, False]
+
+
+def test_sacct_status_of_array_tasks(standins):
+    (standins / "sacct.out").write_text(
+        "1001_0|COMPLETED\n"
+        "1001_0.batch|COMPLETED\n"
+        "1001_1|FAILED\n"
+        "1001_2|RUNNING\n"
+        "1002_0|CANCELLED by 12345\n"
+        "1002_[1-2,4%2]|PENDING\n"
+    )
+    jobids = ["1001_0", "1001_1", "1001_2", "1002_0", "1002_1", "1002_2", "1002_3", "1002_4"]
+    states = slurm("slurm").check_many(jobids)
+    assert states == {
+        "1001_0": "COMPLETED",
+        "1001_1": "FAILED",
+        "1001_2": "RUNNING",
+        "1002_0": "CANCELLED",
+        "1002_1": "PENDING",
+        "1002_2": "PENDING",
+        "1002_3": "MISSING",
+        "1002_4": "PENDING",
+    }
+    assert calls(standins, "sacct") == [
+        "-j {} --parsable2 --noheader --format=JobID,State".format(",".join(jobids))
+    ]
+    # answered from the status cache the second time
+    slurm("slurm").check_many(jobids[:2])
+    assert len(calls(standins, "sacct")) == 1
+
+
+def test_qstat_status_of_array_subjobs(standins):
+    report = {
+        "Jobs": {
+            "1001[0].server": {"job_state": "F"},
+            "1001[1].server": {"job_state": "R"},
+            "1002[0].server": {"job_state": "Q"},
+            "1003.server": {"job_state": "X"},
+        }
+    }
+    (standins / "qstat.out").write_text(json.dumps(report))
+    states = pbs("pbs").check_many(["1001_0", "1001_1", "1002_0", "1003", "1004"])
+    assert states == {"1001_0": "F", "1001_1": "R", "1002_0": "Q", "1003": "X", "1004": "MISSING"}
+    assert calls(standins, "qstat") == ["-x -f -F json 1001[0] 1001[1] 1002[0] 1003 1004"]
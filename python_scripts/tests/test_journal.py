@@ -0,0 +1,66 @@
+import sqlite3
+
+from journal import MonitorJournal
+
+
+def record(jobid, build_basename="build_gfortran_10.3.0_openmpi_O", stage="build"):
+    return {
+        "jobid": jobid,
+        "build_basename": build_basename,
+        "mpiversion": "4.1.1",
+        "branch": "develop",
+        "stage": stage,
+    }
+
+
+def test_outstanding_skips_done_jobs(tmp_path):
+    journal = MonitorJournal(str(tmp_path))
+    for jobid in range(1, 7):
+        journal.add_job("queue-a.jsonl", record(jobid))
+    journal.add_job("queue-b.jsonl", record(7, stage="test"))
+    journal.set_stage("queue-a.jsonl", 2, "build_gfortran_10.3.0_openmpi_O", "running")
+    journal.set_stage("queue-a.jsonl", 3, "build_gfortran_10.3.0_openmpi_O", "finished")
+    journal.set_stage("queue-a.jsonl", 4, "build_gfortran_10.3.0_openmpi_O", "archived", build_hash="abc")
+    journal.set_stage("queue-a.jsonl", 5, "build_gfortran_10.3.0_openmpi_O", "committed", "build")
+    journal.set_stage("queue-a.jsonl", 6, "build_gfortran_10.3.0_openmpi_O", "abandoned")
+    rows = journal.outstanding()
+    assert [(row["jobid"], row["stage"]) for row in rows] == [
+        ("1", "submitted"),
+        ("2", "running"),
+        ("3", "finished"),
+        ("4", "archived"),
+        ("7", "submitted"),
+    ]
+    assert rows[3]["build_hash"] == "abc"
+    assert rows[4]["kind"] == "test"
+    assert [row["jobid"] for row in journal.outstanding("queue-b.jsonl")] == ["7"]
+
+
+def test_outstanding_uses_stage_index(tmp_path):
+    journal = MonitorJournal(str(tmp_path))
+    plan = journal.db.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM jobs WHERE stage IN (?, ?, ?, ?)",
+        ["submitted", "running", "finished", "archived"],
+    ).fetchall()
+    assert any("jobs_stage" in row[-1] for row in plan)
+
+
+def test_reopen_and_add_kind_column(tmp_path):
+    directory = tmp_path / ".monitor"
+    directory.mkdir()
+    db = sqlite3.connect(str(directory / "state.sqlite"))
+    # a journal written before the kind column existed
+    db.execute(
+        "CREATE TABLE jobs (queue_file TEXT, jobid TEXT, "
+        "build_basename TEXT, mpiversion TEXT, branch TEXT, stage TEXT, "
+        "commit_kind TEXT, build_hash TEXT, submitted REAL, updated REAL, "
+        "PRIMARY KEY (queue_file, jobid, build_basename))"
+    )
+    db.execute("INSERT INTO jobs (queue_file, jobid, build_basename, stage) VALUES ('q', '1', 'b', 'running')")
+    db.commit()
+    db.close()
+    journal = MonitorJournal(str(tmp_path))
+    rows = journal.outstanding()
+    assert [(row["jobid"], row["kind"]) for row in rows] == [("1", None)]
+    journal.add_job("q", record(2))
+    assert [row["jobid"] for row in MonitorJournal(str(tmp_path)).outstanding("q")] == ["1", "2"]
@@ -0,0 +1,65 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+from mirror_cache import MirrorCache
+
+
+def git(cwd, *args):
+    return subprocess.check_output(["git"] + list(args), cwd=str(cwd)).decode("utf-8").strip()
+
+
+def commit(repo, name, text):
+    with open(os.path.join(str(repo), name), "w") as _file:
+        _file.write(text)
+    git(repo, "add", name)
+    git(repo, "commit", "-q", "-m", "add {}".format(name))
+    return git(repo, "rev-parse", "HEAD")
+
+
+@pytest.fixture
+def upstream(tmp_path):
+    repo = tmp_path / "remote" / "esmf"
+    repo.mkdir(parents=True)
+    git(repo, "init", "-q", "-b", "develop")
+    commit(repo, "README", "esmf\n")
+    return "file://{}".format(repo)
+
+
+def test_clone_and_refresh(tmp_path, upstream):
+    mirrors = MirrorCache(str(tmp_path / "mirrors"))
+    mirror = mirrors.ensure(upstream)
+    assert mirror == str(tmp_path / "mirrors" / "esmf.git")
+    first = git(upstream[len("file://") :], "rev-parse", "HEAD")
+    assert mirrors.tip(upstream, "develop") == first
+
+    second = commit(upstream[len("file://") :], "NEWS", "more\n")
+    # fetched once per run, so the same cache doesn't see the new commit
+    assert mirrors.tip(upstream, "develop") == first
+    assert MirrorCache(str(tmp_path / "mirrors")).tip(upstream, "develop") == second
+
+
+def test_shared_checkout(tmp_path, upstream):
+    mirrors = MirrorCache(str(tmp_path / "mirrors"))
+    dest = tmp_path / "build"
+    mirrors.checkout(upstream, "develop", str(dest))
+    assert (dest / "README").is_file()
+    assert git(dest, "remote", "get-url", "origin") == upstream
+    assert mirrors.checkouts == {upstream: 1}
+
+
+def test_worktree_after_rm_rf(tmp_path, upstream):
+    mirrors = MirrorCache(str(tmp_path / "mirrors"), "worktree")
+    dest = tmp_path / "build"
+    mirrors.checkout(upstream, "develop", str(dest))
+    assert (dest / "README").is_file()
+    # test_esmf.py removes build directories with rm -rf, leaving the
+    # worktree registered in the mirror
+    shutil.rmtree(str(dest))
+    mirrors = MirrorCache(str(tmp_path / "mirrors"), "worktree")
+    mirrors.checkout(upstream, "develop", str(dest))
+    assert (dest / "README").is_file()
+    worktrees = git(mirrors.mirror_path(upstream), "worktree", "list", "--porcelain")
+    assert worktrees.count("worktree {}".format(dest)) == 1
@@ -0,0 +1,246 @@
+import asyncio
+import concurrent.futures
+import json
+import os
+import threading
+
+import pytest
+
+from journal import MonitorJournal
+from monitor import JobMonitor
+from scheduler import scheduler
+from sentinel import sentinel_path
+from slurm import slurm
+
+
+class FileSlurm(slurm):
+    """slurm reading what sacct and squeue would print from files in
+    directory, and remembering what it was asked to cancel."""
+
+    def __init__(self, directory):
+        slurm.__init__(self, "slurm")
+        self.directory = directory
+        self.cancelled = []
+
+    def statusCommand(self, jobids):
+        return ["cat", os.path.join(self.directory, "sacct.out")]
+
+    def orphanCommand(self, jobids):
+        return ["cat", os.path.join(self.directory, "squeue.out")]
+
+    def cancelCommand(self, jobids):
+        self.cancelled.extend(jobids)
+        return ["true"]
+
+
+class FakeArchive:
+    """Stands in for ArchiveResults: records which collect ran, in order."""
+
+    log = []
+    lock = threading.Lock()
+
+    def __init__(self, record, build_dir, scheduler):
+        self.jobid = record["jobid"]
+        self.build_basename = record["build_basename"]
+        self.build_dir = build_dir
+        self.scheduler = scheduler
+        # a journal row says "kind", a queue record "stage"
+        if "kind" in record.keys():
+            self.test_job = record["kind"] == "test"
+        else:
+            self.test_job = record.get("stage") == "test"
+        self.commit_kind = None
+        self.direct = False
+
+    def collect(self):
+        with self.lock:
+            self.log.append(("collect", self.jobid, self.build_basename))
+        self.commit_kind = "build"
+
+    def collect_skipped(self):
+        with self.lock:
+            self.log.append(("skipped", self.jobid, self.build_basename))
+        self.commit_kind = "skipped test"
+
+    def ran(self):
+        return os.path.exists(os.path.join(self.build_dir, "test_{}.log".format(self.jobid)))
+
+    def commit_artifacts(self, committer=None, token=None):
+        pass
+
+
+class Monitor(JobMonitor):
+    def archiver(self, record):
+        return FakeArchive(record, os.path.join(self.test_root_dir, record["build_basename"]), self.scheduler)
+
+
+@pytest.fixture
+def run(tmp_path, monkeypatch):
+    """A monitor of a queue file in tmp_path that asks FileSlurm on every poll."""
+    monkeypatch.setattr(scheduler, "status_cache", {})
+    monkeypatch.setattr(scheduler, "status_ttl", 0)
+    monkeypatch.setattr(FakeArchive, "log", [])
+    (tmp_path / "sacct.out").write_text("")
+    (tmp_path / "squeue.out").write_text("")
+    queue_file = str(tmp_path / "monitor-queue.jsonl")
+    monitor = Monitor(
+        queue_file, "machine", FileSlurm(str(tmp_path)), str(tmp_path), str(tmp_path / "artifacts"), True,
+        scan_interval=0.01, poll_interval=0,
+    )
+    return monitor, tmp_path
+
+
+def enqueue(monitor, *records):
+    with open(monitor.queue_file, "a") as _file:
+        for record in records:
+            _file.write(json.dumps(record) + "\n")
+
+
+def job(jobid, name, stage="build"):
+    return {"jobid": jobid, "build_basename": name, "mpiversion": "4.1.1", "branch": "develop", "stage": stage}
+
+
+def finish(tmp_path, jobid, name, status=0):
+    os.makedirs(str(tmp_path / name), exist_ok=True)
+    with open(sentinel_path(str(tmp_path / name), jobid), "w") as _file:
+        _file.write(json.dumps({"jobid": jobid, "status": status}) + "\n")
+
+
+def poll(monitor):
+    """One pass of the monitor loop, waiting for the archives it started."""
+
+    async def main():
+        monitor.executor = concurrent.futures.ThreadPoolExecutor(2)
+        monitor.read_queue()
+        await monitor.poll()
+        if monitor.archive_tasks:
+            await asyncio.wait(list(monitor.archive_tasks.values()))
+        monitor.archive_tasks = {}
+        monitor.executor.shutdown()
+
+    asyncio.run(main())
+
+
+def test_archives_every_job_then_exits(run):
+    monitor, tmp_path = run
+    enqueue(monitor, job("11", "a"), job("12", "a", "test"), job("21", "b"), {"end": True})
+    for jobid, name in [("11", "a"), ("12", "a"), ("21", "b")]:
+        finish(tmp_path, jobid, name)
+        (tmp_path / name / "test_{}.log".format(jobid)).write_text("ran\n")
+    monitor.run()
+    assert sorted(FakeArchive.log) == [("collect", "11", "a"), ("collect", "12", "a"), ("collect", "21", "b")]
+    # the test job of a combination is archived after its build job
+    assert FakeArchive.log.index(("collect", "11", "a")) < FakeArchive.log.index(("collect", "12", "a"))
+    assert monitor.archived == 3
+    assert monitor.tracked == []
+
+
+def test_keeps_waiting_for_running_jobs(run):
+    monitor, tmp_path = run
+    (tmp_path / "sacct.out").write_text("21|RUNNING\n")
+    enqueue(monitor, job("11", "a"), job("21", "b"))
+    finish(tmp_path, "11", "a")
+    poll(monitor)
+    assert FakeArchive.log == [("collect", "11", "a")]
+    assert [archiver.jobid for started, archiver in monitor.tracked] == ["21"]
+    (tmp_path / "sacct.out").write_text("21|TIMEOUT\n")
+    poll(monitor)
+    assert FakeArchive.log[-1] == ("collect", "21", "b")
+    assert monitor.tracked == []
+
+
+def test_reads_only_complete_queue_lines(run):
+    monitor, tmp_path = run
+    enqueue(monitor, job("11", "a"))
+    with open(monitor.queue_file, "a") as _file:
+        _file.write(json.dumps(job("21", "b"))[:20])
+    monitor.read_queue()
+    assert [archiver.jobid for started, archiver in monitor.tracked] == ["11"]
+    with open(monitor.queue_file, "a") as _file:
+        _file.write(json.dumps(job("21", "b"))[20:] + "\n")
+    monitor.read_queue()
+    assert [archiver.jobid for started, archiver in monitor.tracked] == ["11", "21"]
+    assert not monitor.ended
+    enqueue(monitor, {"end": True})
+    monitor.read_queue()
+    assert monitor.ended
+
+
+def test_gives_up_after_budget(run):
+    monitor, tmp_path = run
+    (tmp_path / "sacct.out").write_text("11|PENDING\n")
+    enqueue(monitor, job("11", "a"))
+    monitor.budget = 0
+    poll(monitor)
+    assert FakeArchive.log == []
+    assert monitor.tracked == []
+
+
+def test_pack_mates_finish_separately(run):
+    monitor, tmp_path = run
+    (tmp_path / "sacct.out").write_text("777|RUNNING\n")
+    # one pack: three combinations built by the same job
+    enqueue(monitor, job("777", "a"), job("777", "b"), job("777", "c"))
+    for name in ["a", "b", "c"]:
+        (tmp_path / name).mkdir()
+    finish(tmp_path, "777", "b")
+    poll(monitor)
+    assert FakeArchive.log == [("collect", "777", "b")]
+    assert [archiver.build_basename for started, archiver in monitor.tracked] == ["a", "c"]
+    finish(tmp_path, "777", "a")
+    poll(monitor)
+    assert FakeArchive.log[1:] == [("collect", "777", "a")]
+    # the pack job ended without c writing its sentinel (killed)
+    (tmp_path / "sacct.out").write_text("777|TIMEOUT\n")
+    poll(monitor)
+    assert FakeArchive.log[2:] == [("collect", "777", "c")]
+    assert monitor.tracked == []
+
+
+def test_cancels_test_job_of_failed_build(run):
+    monitor, tmp_path = run
+    (tmp_path / "sacct.out").write_text("12|PENDING\n")
+    (tmp_path / "squeue.out").write_text("12|DependencyNeverSatisfied\n")
+    enqueue(monitor, job("11", "a"), job("12", "a", "test"))
+    finish(tmp_path, "11", "a", status=1)
+    poll(monitor)
+    assert monitor.scheduler.cancelled == ["12"]
+    assert FakeArchive.log == [("collect", "11", "a"), ("skipped", "12", "a")]
+    assert monitor.tracked == []
+
+
+def test_finished_test_job_that_never_ran_is_skipped(run):
+    monitor, tmp_path = run
+    # PBS Pro lists a test job it deleted after a failed build as finished
+    (tmp_path / "sacct.out").write_text("12|COMPLETED\n22|COMPLETED\n")
+    enqueue(monitor, job("12", "a", "test"), job("22", "b", "test"))
+    for name in ["a", "b"]:
+        (tmp_path / name).mkdir()
+    (tmp_path / "b" / "test_22.log").write_text("ran\n")
+    poll(monitor)
+    assert sorted(FakeArchive.log) == [("collect", "22", "b"), ("skipped", "12", "a")]
+    assert monitor.scheduler.cancelled == []
+    assert monitor.tracked == []
+
+
+def test_resume_picks_up_where_the_journal_left_off(run):
+    monitor, tmp_path = run
+    journal = MonitorJournal(monitor.artifacts_root)
+    monitor = Monitor(
+        monitor.queue_file, "machine", "slurm", str(tmp_path), monitor.artifacts_root, True, journal=journal
+    )
+    enqueue(monitor, job("11", "a"), job("12", "a", "test"), job("21", "b"), job("31", "c"))
+    monitor.read_queue()
+    monitor.record(monitor.tracked[0][1], "committed", commit_kind="build")
+    monitor.record(monitor.tracked[2][1], "finished")
+    monitor.record(monitor.tracked[3][1], "archived", commit_kind="build", build_hash="v8.6.0")
+
+    resumed = Monitor.resume(journal, journal.unfinished_queues()[0])
+    assert resumed.offset == monitor.offset
+    assert [(archiver.jobid, archiver.test_job) for started, archiver in resumed.tracked] == [("12", True)]
+    # 21 is archived again, 31 only committed
+    assert [(archiver.jobid, collect is not None) for archiver, collect in resumed.resumed] == [
+        ("21", True),
+        ("31", False),
+    ]
+    assert resumed.resumed[1][0].build_hash == "v8.6.0"
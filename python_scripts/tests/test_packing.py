@@ -0,0 +1,95 @@
+import collections
+import os
+import subprocess
+
+import pytest
+
+from packing import plan_packs
+from slurm import slurm
+from test_esmf import BuildJob, ESMFTest
+
+MPI = {"openmpi": {"module": "openmpi/4.1.1"}}
+
+Job = collections.namedtuple("Job", ["name", "build_cores", "test_cores"])
+
+
+def test_packs_fit_capacity():
+    jobs = [Job("a", 4, 8), Job("b", 8, 2), Job("c", 2, 2), Job("d", 6, 6), Job("e", 1, 4)]
+    packs = plan_packs(jobs, 16)
+    assert sorted(job.name for pack in packs for job in pack) == ["a", "b", "c", "d", "e"]
+    for pack in packs:
+        assert sum(max(job.build_cores, job.test_cores) for job in pack) <= 16
+
+
+def test_first_fit_decreasing_keeps_job_order():
+    jobs = [Job("small", 2, 2), Job("big", 12, 12), Job("medium", 6, 6), Job("tiny", 1, 1)]
+    packs = plan_packs(jobs, 16)
+    assert [[job.name for job in pack] for pack in packs] == [["small", "big", "tiny"], ["medium"]]
+
+
+def test_job_larger_than_capacity_gets_its_own_pack():
+    jobs = [Job("huge", 64, 32), Job("a", 8, 8), Job("b", 8, 8)]
+    packs = plan_packs(jobs, 16)
+    assert [[job.name for job in pack] for pack in packs] == [["huge"], ["a", "b"]]
+
+
+@pytest.fixture
+def pack(tmp_path, monkeypatch):
+    """Two combinations sharing a node, with build and test scripts that
+    succeed or fail as told and a taskset that only records the cores."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "taskset").write_text('#!/bin/bash\necho "$2" > cores\nshift 2\nexec "$@"\n')
+    (bin_dir / "taskset").chmod(0o755)
+    monkeypatch.setenv("PATH", "{}{}{}".format(bin_dir, os.pathsep, os.environ["PATH"]))
+    test = ESMFTest.__new__(ESMFTest)
+    test.script_dir = str(tmp_path)
+    # scripts run as $bash -l, skip the login profile
+    test.bash = "/bin/bash --noprofile"
+    test.account = "account"
+    test.queue = "regular"
+    test.partition = test.cluster = test.constraint = "None"
+    test.cpn = 16
+    jobs = []
+    for ver in ["10.3.0", "11.2.0"]:
+        job = BuildJob("O", "gfortran", ver, "openmpi", "develop", "develop", MPI, str(tmp_path))
+        job.build_time = job.test_time = "1:00:00"
+        job.build_cores = job.test_cores = 8
+        os.makedirs(job.path)
+        jobs.append(job)
+    return test, jobs
+
+
+def builds(jobs, results):
+    for job, result in zip(jobs, results):
+        with open(os.path.join(job.path, job.b_filename), "w") as _file:
+            _file.write("echo build {} > build_$JOBID.log\n".format(result))
+        with open(os.path.join(job.path, job.t_filename), "w") as _file:
+            _file.write("echo tested > tested\n")
+
+
+def run_pack(test, pack, stage, build_jobnum=None, jobid="77"):
+    script = slurm("slurm").writePackScript(test, pack, stage, 0, build_jobnum)
+    return subprocess.call(["bash", script], env=dict(os.environ, SLURM_JOBID=jobid))
+
+
+def test_pack_pins_each_combination(pack):
+    test, jobs = pack
+    builds(jobs, ["success", "success"])
+    assert run_pack(test, jobs, "build") == 0
+    cores = [open(os.path.join(job.path, "cores")).read().strip() for job in jobs]
+    assert cores == ["0-7", "8-15"]
+
+
+def test_pack_tests_only_what_built(pack):
+    test, jobs = pack
+    builds(jobs, ["success", "failed"])
+    assert run_pack(test, jobs, "build") == 0
+    assert run_pack(test, jobs, "test", "77", "78") == 0
+    assert [os.path.exists(os.path.join(job.path, "tested")) for job in jobs] == [True, False]
+
+
+def test_build_pack_fails_when_nothing_built(pack):
+    test, jobs = pack
+    builds(jobs, ["failed", "failed"])
+    assert run_pack(test, jobs, "build") != 0
@@ -0,0 +1,58 @@
+import os
+import subprocess
+
+import pytest
+
+from test_esmf import ESMFTest
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """A build directory with the fingerprint check of a persistent build
+    script in check.sh and a make that only records what it was asked."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    make = bin_dir / "make"
+    make.write_text('#!/bin/bash\necho "$@" >> make.calls\n')
+    make.chmod(0o755)
+    build = tmp_path / "build"
+    build.mkdir()
+    with open(str(build / "check.sh"), "w") as file_out:
+        ESMFTest.__new__(ESMFTest).writeBuildFingerprint(file_out)
+    (build / "module-build.log").write_text("Currently Loaded Modules:\n  1) gcc/10.3.0   2) openmpi/4.1.1\n")
+    return build, str(bin_dir)
+
+
+def build(tree, **esmf_env):
+    directory, bin_dir = tree
+    env = {"PATH": bin_dir + os.pathsep + os.environ["PATH"], "JOBID": "1", "ESMF_COMPILER": "gfortran"}
+    env.update(esmf_env)
+    calls = directory / "make.calls"
+    if calls.exists():
+        calls.unlink()
+    subprocess.check_call(["bash", "check.sh"], cwd=str(directory), env=env)
+    return calls.read_text().split("\n")[:-1] if calls.exists() else []
+
+
+def test_first_build_is_clean(tree):
+    assert build(tree) == ["clean"]
+
+
+def test_unchanged_environment_stays_incremental(tree):
+    build(tree)
+    assert build(tree) == []
+    assert build(tree) == []
+
+
+def test_changed_modules_trigger_clean_build(tree):
+    build(tree)
+    (tree[0] / "module-build.log").write_text("Currently Loaded Modules:\n  1) gcc/11.2.0   2) openmpi/4.1.1\n")
+    assert build(tree) == ["clean"]
+    assert build(tree) == []
+
+
+def test_changed_esmf_variable_triggers_clean_build(tree):
+    build(tree)
+    assert build(tree, ESMF_BOPT="g") == ["clean"]
+    assert build(tree, ESMF_BOPT="g") == []
+    assert build(tree, ESMF_BOPT="O") == ["clean"]
@@ -0,0 +1,135 @@
+import os
+import subprocess
+
+import pytest
+
+import esmf_results
+from results_db import ResultsDatabase
+from summary_record import SUMMARY_FIELDS, SummaryRecord, write_summary_record
+
+OUTPATH = "develop/{}/gfortran/10.3.0/{}/openmpi/4.1.1"
+SUMMARY_DAT = """Build for = gfortran_10.3.0_openmpi_g_develop, mpi version 4.1.1 on derecho esmf_os: Linux
+Build time = 2021-06-01 12:34:56
+git hash = v8.6.0-1-gaaaaaaa
+
+unit test results   \tPASS 7350 FAIL 0
+system test results \tPASS 45 FAIL 0
+example test results \tPASS 60 FAIL 0
+nuopc test results \tPASS 30 \tFAIL 0
+
+"""
+
+
+def git(repo, *args):
+    return subprocess.check_output(["git"] + list(args), cwd=str(repo)).decode("utf-8").strip()
+
+
+def record(machine, bopt, build_hash, unit_fail=0):
+    values = dict.fromkeys(SUMMARY_FIELDS)
+    values.update(
+        machine=machine,
+        compiler="gfortran",
+        version="10.3.0",
+        mpi_flavor="openmpi",
+        mpi_version="4.1.1",
+        bopt=bopt,
+        branch="develop",
+        hash=build_hash,
+        stage="test",
+        unit_pass=7350,
+        unit_fail=unit_fail,
+        system_pass=45,
+        system_fail=0,
+        example_pass=60,
+        example_fail=0,
+        nuopc_pass=30,
+        nuopc_fail=0,
+    )
+    return SummaryRecord(**values)
+
+
+def archive(repo, machine, bopt, build_hash, unit_fail=0):
+    git(repo, "checkout", "-q", machine)
+    outpath = os.path.join(str(repo), OUTPATH.format(machine, bopt))
+    os.makedirs(outpath, exist_ok=True)
+    write_summary_record(outpath, record(machine, bopt, build_hash, unit_fail))
+    git(repo, "add", "-A")
+    git(repo, "commit", "-q", "-m", "{} {} {}".format(machine, bopt, build_hash))
+
+
+@pytest.fixture
+def repo(tmp_path):
+    """An artifacts repo with a branch for each of two machines."""
+    repo = tmp_path / "artifacts"
+    git(tmp_path, "init", "-q", "-b", "main", str(repo))
+    git(repo, "commit", "-q", "--allow-empty", "-m", "start")
+    for machine in ["hera", "derecho"]:
+        git(repo, "branch", machine)
+    archive(repo, "hera", "O", "v8.6.0-1-gaaaaaaa")
+    archive(repo, "hera", "g", "v8.6.0-1-gaaaaaaa", unit_fail=2)
+    archive(repo, "derecho", "O", "v8.6.0-1-gaaaaaaa")
+    # archived before summary.json existed
+    outpath = repo / OUTPATH.format("derecho", "g")
+    os.makedirs(str(outpath))
+    (outpath / "summary.dat").write_text(SUMMARY_DAT)
+    git(repo, "add", "-A")
+    git(repo, "commit", "-q", "-m", "derecho g")
+    return repo
+
+
+def test_ingest_and_query(repo, tmp_path):
+    results = ResultsDatabase(str(tmp_path / "results.sqlite"))
+    # commits that change no summary aren't counted
+    assert results.ingest(str(repo)) == (4, 4)
+    records = results.query(branch="develop", hash="v8.6.0-1-gaaaaaaa")
+    assert [(r.machine, r.bopt) for r in records] == [("derecho", "O"), ("derecho", "g"), ("hera", "O"), ("hera", "g")]
+    assert records[1].unit_pass == 7350
+    failed = results.query(hash="v8.6.0-1-gaaaaaaa", failed="unit")
+    assert [(r.machine, r.bopt, r.unit_fail) for r in failed] == [("hera", "g", 2)]
+    assert results.query(machine="hera", bopt="O", failed="any") == []
+
+
+def test_ingest_reads_only_new_commits(repo, tmp_path):
+    path = str(tmp_path / "results.sqlite")
+    ResultsDatabase(path).ingest(str(repo))
+    results = ResultsDatabase(path)
+    assert results.ingest(str(repo)) == (0, 0)
+    # the test results of a new hash, and of the same hash again
+    archive(repo, "hera", "O", "v8.6.0-2-gbbbbbbb", unit_fail=1)
+    archive(repo, "hera", "g", "v8.6.0-1-gaaaaaaa")
+    assert results.ingest(str(repo)) == (2, 2)
+    assert [r.unit_fail for r in results.query(machine="hera", bopt="g")] == [0]
+    assert [r.hash for r in results.query(failed="unit")] == ["v8.6.0-2-gbbbbbbb"]
+
+
+def test_ingest_after_rewritten_branch(repo, tmp_path):
+    results = ResultsDatabase(str(tmp_path / "results.sqlite"))
+    results.ingest(str(repo))
+    git(repo, "checkout", "-q", "hera")
+    git(repo, "reset", "-q", "--hard", "HEAD~1")
+    git(repo, "commit", "-q", "--allow-empty", "-m", "rewritten")
+    # the commit ingested last is gone
+    git(repo, "reflog", "expire", "--expire=now", "--all")
+    git(repo, "gc", "-q", "--prune=now")
+    assert results.ingest(str(repo)) == (1, 1)
+    # what was read before stays
+    assert len(results.query(machine="hera")) == 2
+
+
+def test_failing_tests(repo, tmp_path):
+    git(repo, "checkout", "-q", "hera")
+    outpath = repo / OUTPATH.format("hera", "g")
+    index = esmf_results.TestIndex()
+    for name, text in [("ESMF_FieldUTest.Log", "PASS a\nFAIL b\nFAIL c\n"), ("ESMF_ArrayUTest.Log", "PASS a\n")]:
+        (tmp_path / name).write_text(text)
+        index.add("test", str(tmp_path / name), esmf_results.scan_log(str(tmp_path / name), esmf_results.TestLogScanner()))
+    index.write(str(outpath))
+    git(repo, "add", "-A")
+    git(repo, "commit", "-q", "-m", "hera g tests")
+    results = ResultsDatabase(str(tmp_path / "results.sqlite"))
+    results.ingest(str(repo))
+    assert results.failing_tests(branch="develop") == [
+        ("hera", OUTPATH.format("hera", "g"), "v8.6.0-1-gaaaaaaa", "test", "ESMF_FieldUTest", 2, ["FAIL b", "FAIL c"])
+    ]
+    assert results.failing_tests(name="ESMF_ArrayUTest") == []
+    assert results.failing_tests(machine="derecho") == []
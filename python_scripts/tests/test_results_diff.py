@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from results_db import ResultsDatabase
+from results_diff import diff_hashes
+from summary_record import SUMMARY_FIELDS, SummaryRecord
+
+A = "develop/machine/gfortran/10.3.0/O/openmpi/4.1.1"
+B = "develop/machine/intel/2021/g/mpt/2.23"
+C = "develop/machine/nvhpc/21.9/O/openmpi/4.1.1"
+D = "develop/machine/gfortran/10.3.0/g/mpich/3.4"
+
+
+def add(results, path, build_hash, unit=(10, 0), stage="test", tests={}):
+    values = dict.fromkeys(SUMMARY_FIELDS)
+    values.update(hash=build_hash, stage=stage, machine="machine", unit_pass=unit[0], unit_fail=unit[1])
+    results.add(SummaryRecord(**values), path, "refs/heads/machine", build_hash, 0)
+    for name, status in tests.items():
+        failed = int(status == "FAIL")
+        failures = json.dumps(["FAIL {}".format(name)] * failed)
+        results.db.execute(
+            "INSERT INTO tests VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (path, build_hash, name, "test", name + ".Log", status, 1, failed, 4, 1.0, failures),
+        )
+
+
+@pytest.fixture
+def results(tmp_path):
+    results = ResultsDatabase(str(tmp_path / "results.sqlite"))
+    add(results, A, "old", tests={"ESMF_ArrayUTest": "PASS", "ESMF_FieldUTest": "FAIL"})
+    add(results, A, "new", unit=(10, 1), tests={"ESMF_ArrayUTest": "FAIL", "ESMF_FieldUTest": "PASS"})
+    add(results, B, "old", tests={"ESMF_ArrayUTest": "PASS"})
+    add(results, B, "new", unit=(-1, -1), stage="build")
+    add(results, C, "old")
+    add(results, D, "new")
+    results.db.commit()
+    return results
+
+
+def test_diff_hashes(results):
+    diff = diff_hashes(results, "old", "new")
+    a, b, c, d = [path.split("/", 1)[1] for path in [A, B, C, D]]
+    assert sorted(diff.old) == sorted([a, b, c])
+    assert sorted(diff.new) == sorted([a, b, d])
+    assert diff.failures == [(a, "ESMF_ArrayUTest.Log", "ESMF_ArrayUTest", 1, ["FAIL ESMF_ArrayUTest"])]
+    assert diff.fixes == [(a, "ESMF_FieldUTest.Log", "ESMF_FieldUTest")]
+    assert diff.missing == [c]
+    assert diff.added == [d]
+    assert diff.incomplete == [b]
+    assert diff.counts == [(a, "unit", (10, 0), (10, 1))]
+
+
+def test_same_hash_has_no_changes(results):
+    diff = diff_hashes(results, "new", "new")
+    assert (diff.failures, diff.fixes, diff.missing, diff.added, diff.counts) == ([], [], [], [], [])
+
+
+def test_branch_filter(results):
+    diff = diff_hashes(results, "old", "new", branch="main")
+    assert diff.old == {} and diff.new == {}
@@ -0,0 +1,50 @@
+import os
+import signal
+import subprocess
+import time
+
+import pytest
+
+from sentinel import read_sentinel, write_sentinel_trap
+
+
+@pytest.fixture
+def script(tmp_path):
+    """Write a job script with the sentinel trap followed by body."""
+
+    def write(body):
+        path = str(tmp_path / "job.bat")
+        with open(path, "w") as file_out:
+            file_out.write("JOBID=42\n")
+            write_sentinel_trap(file_out, str(tmp_path))
+            file_out.write(body)
+        return path
+
+    return write
+
+
+def test_no_sentinel_before_the_job_ends(tmp_path):
+    assert read_sentinel(str(tmp_path), "42") is None
+
+
+def test_sentinel_after_success(tmp_path, script):
+    subprocess.call(["bash", script("echo building\n")])
+    record = read_sentinel(str(tmp_path), "42")
+    assert record["jobid"] == "42"
+    assert record["status"] == 0
+    assert record["end"] >= record["start"]
+    assert not os.path.exists(str(tmp_path / "complete_42.json.tmp"))
+
+
+def test_sentinel_after_failed_command(tmp_path, script):
+    subprocess.call(["bash", script("set -e\nfalse\necho not reached\n")])
+    assert read_sentinel(str(tmp_path), "42")["status"] == 1
+
+
+def test_sentinel_after_sigterm(tmp_path, script):
+    proc = subprocess.Popen(["bash", script("touch started\nsleep 30 & wait\n")], cwd=str(tmp_path))
+    while not os.path.exists(str(tmp_path / "started")):
+        time.sleep(0.01)
+    proc.send_signal(signal.SIGTERM)
+    proc.wait()
+    assert read_sentinel(str(tmp_path), "42")["status"] == 143
@@ -0,0 +1,94 @@
+import os
+import subprocess
+
+import pytest
+
+import staging
+from staging import StagedOutpath
+
+
+@pytest.fixture
+def artifacts(tmp_path):
+    """An artifacts repo with one published outpath holding out/ and test/."""
+    root = tmp_path / "artifacts"
+    subprocess.check_call(["git", "init", "-q", str(root)])
+    outpath = root / "develop" / "hera" / "gfortran"
+    (outpath / "out").mkdir(parents=True)
+    (outpath / "test").mkdir()
+    (outpath / "out" / "build.log").write_text("old build\n")
+    (outpath / "test" / "ESMF_FieldUTest.Log").write_text("old test\n")
+    return str(root), str(outpath)
+
+
+def stage_test_results(root, outpath):
+    stage = StagedOutpath(root, outpath, ["out"])
+    stage.makedirs("test")
+    with open(os.path.join(stage.path, "test", "ESMF_FieldUTest.Log"), "w") as _file:
+        _file.write("new test\n")
+    return stage
+
+
+def check_published(outpath):
+    assert open(os.path.join(outpath, "out", "build.log")).read() == "old build\n"
+    assert open(os.path.join(outpath, "test", "ESMF_FieldUTest.Log")).read() == "new test\n"
+
+
+def test_carried_entries_are_linked(artifacts):
+    root, outpath = artifacts
+    stage = StagedOutpath(root, outpath, ["out"])
+    assert os.path.samefile(os.path.join(stage.path, "out", "build.log"), os.path.join(outpath, "out", "build.log"))
+    assert not os.path.exists(os.path.join(stage.path, "test"))
+    assert ".monitor/" in open(os.path.join(root, ".git", "info", "exclude")).read().split("\n")
+
+
+def test_publish_swaps_in_the_stage(artifacts):
+    root, outpath = artifacts
+    stage = stage_test_results(root, outpath)
+    # until published, readers still see the old tree
+    assert open(os.path.join(outpath, "test", "ESMF_FieldUTest.Log")).read() == "old test\n"
+    stage.publish()
+    check_published(outpath)
+
+
+def test_publish_without_exchange(artifacts, monkeypatch):
+    root, outpath = artifacts
+    monkeypatch.setattr(staging, "exchange", lambda src, dest: False)
+    stage_test_results(root, outpath).publish()
+    check_published(outpath)
+
+
+def test_publish_new_outpath(tmp_path):
+    root = str(tmp_path)
+    outpath = os.path.join(root, "develop", "hera", "gfortran")
+    stage = StagedOutpath(root, outpath, ["out"])
+    stage.makedirs("out")
+    stage.publish()
+    assert os.listdir(outpath) == ["out"]
+
+
+def test_exchange_swaps_directories(tmp_path):
+    (tmp_path / "a").mkdir()
+    (tmp_path / "a" / "a").write_text("")
+    (tmp_path / "b").mkdir()
+    if not staging.exchange(str(tmp_path / "a"), str(tmp_path / "b")):
+        pytest.skip("no renameat2 here")
+    assert os.listdir(str(tmp_path / "b")) == ["a"]
+    assert os.listdir(str(tmp_path / "a")) == []
+
+
+def test_exchange_without_renameat2(tmp_path, monkeypatch):
+    class OldLibc:
+        pass
+
+    monkeypatch.setattr(staging.ctypes, "CDLL", lambda name, use_errno: OldLibc())
+    (tmp_path / "a").mkdir()
+    (tmp_path / "b").mkdir()
+    assert staging.exchange(str(tmp_path / "a"), str(tmp_path / "b")) is False
+
+
+def test_discard(artifacts):
+    root, outpath = artifacts
+    stage = stage_test_results(root, outpath)
+    stage.discard()
+    assert not os.path.exists(stage.path)
+    assert open(os.path.join(outpath, "test", "ESMF_FieldUTest.Log")).read() == "old test\n"
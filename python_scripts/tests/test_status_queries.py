@@ -0,0 +1,88 @@
+import asyncio
+import json
+
+import pytest
+
+from pbs import pbs
+from scheduler import scheduler
+from slurm import slurm
+
+
+class CommandSlurm(slurm):
+    """slurm whose status query is the shell command in self.command, run
+    through sh so it can print, fail or both."""
+
+    def __init__(self, command):
+        slurm.__init__(self, "slurm")
+        self.command = command
+        self.queries = 0
+
+    def statusCommand(self, jobids):
+        self.queries += 1
+        return ["sh", "-c", self.command]
+
+
+class CommandPbs(pbs):
+    def __init__(self, command):
+        pbs.__init__(self, "pbs")
+        self.command = command
+
+    def statusCommand(self, jobids):
+        return ["sh", "-c", self.command]
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(scheduler, "status_cache", {})
+
+
+def test_one_query_for_all_jobs():
+    sched = CommandSlurm("printf '1|RUNNING\\n2|COMPLETED\\n2.batch|COMPLETED\\n'")
+    assert sched.check_many(["1", "2", "3"]) == {"1": "RUNNING", "2": "COMPLETED", "3": "MISSING"}
+    assert sched.queries == 1
+    # cached for status_ttl seconds
+    assert sched.check_many(["2"]) == {"2": "COMPLETED"}
+    assert sched.queries == 1
+    assert sched.checkqueue("2")
+    assert not sched.checkqueue("1")
+
+
+def test_failed_query_decides_nothing():
+    sched = CommandSlurm("echo 'sacct: error: slurmdbd unreachable' >&2; exit 1")
+    assert sched.check_many(["1", "2"]) == {}
+    assert not sched.checkqueue("1")
+    # nothing was cached, so the next call asks again
+    sched.command = "printf '1|COMPLETED\\n'"
+    assert sched.check_many(["1"]) == {"1": "COMPLETED"}
+
+
+def test_missing_command_decides_nothing():
+    sched = CommandSlurm("")
+    sched.statusCommand = lambda jobids: ["/nonexistent/sacct"]
+    assert sched.check_many(["1"]) == {}
+    assert not sched.checkqueue("1")
+
+
+def test_unparsable_output_decides_nothing():
+    sched = CommandPbs("echo 'qstat: cannot connect to server'")
+    assert sched.check_many(["1"]) == {}
+    assert not sched.checkqueue("1")
+
+
+def test_qstat_error_exit_with_report_is_used():
+    # qstat exits 35 when one of the jobs is unknown but reports the others
+    report = json.dumps({"Jobs": {"1.server": {"job_state": "F"}}})
+    sched = CommandPbs("echo '{}'; exit 35".format(report))
+    assert sched.check_many(["1", "2"]) == {"1": "F", "2": "MISSING"}
+
+
+def test_async_query_failure_and_timeout():
+    sched = CommandSlurm("exit 1")
+    assert asyncio.run(sched.check_many_async(["1"], 5)) == {}
+    sched.command = "exec sleep 5"
+    assert asyncio.run(sched.check_many_async(["1"], 0.1)) == {}
+    sched.command = "printf '1|FAILED\\n'"
+    assert asyncio.run(sched.check_many_async(["1"], 5)) == {"1": "FAILED"}
+    # and the answer is shared with check_many
+    sched.command = "exit 1"
+    assert sched.check_many(["1"]) == {"1": "FAILED"}
@@ -0,0 +1,92 @@
+import json
+import os
+
+from summary_record import (
+    SUMMARY_FIELDS,
+    SUMMARY_JSON,
+    SUMMARY_ROW,
+    SummaryRecord,
+    load_summary_record,
+    parse_counts,
+    parse_summary_dat,
+    write_summary_record,
+)
+
+SUMMARY_DAT = """Build for = gfortran_10.3.0_openmpi_O_develop, mpi version 4.1.1 on cheyenne esmf_os: Linux
+Build time = 2021-06-01 12:34:56
+git hash = v8.2.0b05-12-gabcdef0
+
+unit test results   \tPASS 7350 FAIL 2
+system test results \tPASS 45 FAIL 0
+example test results \tPASS 60 FAIL 1
+nuopc test results \tPASS 30 \tFAIL 0
+
+"""
+SUMMARY_PATH = "develop/cheyenne/gfortran/10.3.0/O/openmpi/4.1.1/summary.dat"
+
+
+def test_parse_counts():
+    assert parse_counts("PASS 7350 FAIL 2") == (7350, 2)
+    assert parse_counts("PASS 30 \tFAIL 0") == (30, 0)
+    assert parse_counts("-1 -1") == (-1, -1)
+    assert parse_counts("unit tests did not complete") == (None, None)
+
+
+def test_parse_summary_dat():
+    record = parse_summary_dat(SUMMARY_DAT, SUMMARY_PATH)
+    assert record.branch == "develop"
+    assert record.machine == "cheyenne"
+    assert record.compiler == "gfortran"
+    assert record.version == "10.3.0"
+    assert record.bopt == "O"
+    assert record.mpi_flavor == "openmpi"
+    assert record.mpi_version == "4.1.1"
+    assert record.esmf_os == "Linux"
+    assert record.build_time == "2021-06-01 12:34:56"
+    assert record.hash == "v8.2.0b05-12-gabcdef0"
+    assert (record.unit_pass, record.unit_fail) == (7350, 2)
+    assert (record.system_pass, record.system_fail) == (45, 0)
+    assert (record.example_pass, record.example_fail) == (60, 1)
+    assert (record.nuopc_pass, record.nuopc_fail) == (30, 0)
+    assert record.stage == "test"
+    assert record.build_seconds is None
+
+
+def test_parse_build_only_summary_dat():
+    text = SUMMARY_DAT.replace("PASS 7350 FAIL 2", "-1 -1")
+    record = parse_summary_dat(text, SUMMARY_PATH)
+    assert record.stage == "build"
+    assert (record.unit_pass, record.unit_fail) == (-1, -1)
+
+
+def test_summary_record_round_trip(tmp_path):
+    values = dict.fromkeys(SUMMARY_FIELDS)
+    values.update(parse_summary_dat(SUMMARY_DAT, SUMMARY_PATH)._asdict())
+    values.update(build_seconds=1234, test_seconds=5678)
+    record = SummaryRecord(**values)
+    write_summary_record(str(tmp_path), record)
+    with open(os.path.join(str(tmp_path), SUMMARY_JSON)) as _file:
+        data = _file.read()
+    assert load_summary_record(data) == record
+    assert load_summary_record(data.encode("utf-8")) == record
+    with open(os.path.join(str(tmp_path), SUMMARY_ROW)) as _file:
+        row = _file.read()
+    assert row.endswith("\n")
+    columns = row.rstrip("\n").split("\t")
+    assert len(columns) == len(SUMMARY_FIELDS)
+    assert columns[SUMMARY_FIELDS.index("unit_pass")] == "7350"
+    assert columns[SUMMARY_FIELDS.index("esmf_os")] == "Linux"
+
+
+def test_missing_fields_load_as_none(tmp_path):
+    record = load_summary_record(json.dumps({"machine": "derecho", "unit_fail": 3}))
+    assert record.machine == "derecho"
+    assert record.unit_fail == 3
+    assert record.hash is None
+    assert "-" in write_row(tmp_path, record)
+
+
+def write_row(tmp_path, record):
+    write_summary_record(str(tmp_path), record)
+    with open(os.path.join(str(tmp_path), SUMMARY_ROW)) as _file:
+        return _file.read().split("\t")